@@ -0,0 +1,244 @@
+"""
+Per-chat approximate nearest neighbour (HNSW) indexes for very large chats.
+
+Chats with at least ANN_INDEX_MIN_CHUNKS chunks get an HNSW index (usearch)
+built by the ingestion worker and saved under ANN_INDEX_DIR, one
+`{chat}.usearch` file plus a `{chat}.meta.json` sidecar mapping index keys
+to chunk ids, document ids and filenames. The API process memory-maps the
+index file (Index.restore(view=True)) instead of holding the chat's
+embedding matrix resident, and reloads it when a worker rewrites it.
+
+The API and the workers must share ANN_INDEX_DIR (same host or volume);
+a chat without an index file is served by the exact full scan. usearch is an
+optional dependency: without it every chat uses the full scan.
+"""
+
+import os
+import re
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+try:
+    from usearch.index import Index
+    USEARCH_AVAILABLE = True
+except ImportError:
+    USEARCH_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+ANN_INDEX_ENABLED = os.getenv("ANN_INDEX_ENABLED", "true").lower() == "true" and USEARCH_AVAILABLE
+ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ann_indexes"))
+# Chats below this size are scored exactly from the cached embedding matrix
+ANN_INDEX_MIN_CHUNKS = int(os.getenv("ANN_INDEX_MIN_CHUNKS", "50000"))
+# HNSW graph degree and beam widths (build / query)
+ANN_INDEX_CONNECTIVITY = int(os.getenv("ANN_INDEX_CONNECTIVITY", "16"))
+ANN_INDEX_EXPANSION_ADD = int(os.getenv("ANN_INDEX_EXPANSION_ADD", "128"))
+ANN_INDEX_EXPANSION_SEARCH = int(os.getenv("ANN_INDEX_EXPANSION_SEARCH", "128"))
+# Candidates fetched per requested chunk, so file / scope filters still fill top-k
+ANN_INDEX_OVERFETCH = int(os.getenv("ANN_INDEX_OVERFETCH", "4"))
+# Rebuild instead of appending once deleted chunks exceed this fraction of the index
+ANN_INDEX_MAX_STALE_FRACTION = float(os.getenv("ANN_INDEX_MAX_STALE_FRACTION", "0.2"))
+ANN_INDEX_CACHE_CHATS = int(os.getenv("ANN_INDEX_CACHE_CHATS", "64"))
+
+
+def _base_path(chat_id: str) -> str:
+    safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", chat_id)
+    return os.path.join(ANN_INDEX_DIR, safe_id)
+
+
+class ChatAnnIndex:
+    """
+    HNSW index over one chat's unit-normalized chunk embeddings.
+
+    Index keys are row numbers into chunk_ids / doc_ids / filenames, the same
+    parallel arrays ChatEmbeddingMatrix exposes, so search results are
+    consumed the same way as full-scan rows.
+    """
+
+    def __init__(self, chat_id: str, dimensions: int, index, chunk_ids: List[str],
+                 doc_ids: List[str], filenames: List[str], mtime: float = 0.0):
+        self.chat_id = chat_id
+        self.dimensions = dimensions
+        self.index = index
+        self.chunk_ids = np.array(chunk_ids, dtype=object)
+        self.doc_ids = np.array(doc_ids, dtype=object)
+        self.filenames = np.array(filenames, dtype=object)
+        self.mtime = mtime
+
+    @property
+    def size(self) -> int:
+        return len(self.chunk_ids)
+
+    @classmethod
+    def create(cls, chat_id: str, dimensions: int) -> "ChatAnnIndex":
+        index = Index(
+            ndim=dimensions, metric="ip", dtype="f32",
+            connectivity=ANN_INDEX_CONNECTIVITY,
+            expansion_add=ANN_INDEX_EXPANSION_ADD,
+            expansion_search=ANN_INDEX_EXPANSION_SEARCH
+        )
+        return cls(chat_id, dimensions, index, [], [], [])
+
+    @classmethod
+    def load(cls, chat_id: str, view: bool = True) -> Optional["ChatAnnIndex"]:
+        """
+        Open a chat's saved index; view=True memory-maps it read-only.
+
+        Returns:
+            The index, or None if the chat has none (or it cannot be read)
+        """
+        base = _base_path(chat_id)
+        try:
+            mtime = os.path.getmtime(base + ".meta.json")
+            with open(base + ".meta.json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            index = Index.restore(base + ".usearch", view=view)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"⚠️ Could not load ANN index for {chat_id}: {e}")
+            return None
+        if index is None:
+            return None
+        index.expansion_search = ANN_INDEX_EXPANSION_SEARCH
+        return cls(chat_id, meta["dimensions"], index, meta["chunk_ids"], meta["doc_ids"], meta["filenames"], mtime)
+
+    def add(self, matrix: np.ndarray, chunk_ids, doc_ids, filenames):
+        """Append unit-normalized rows (keys continue after the existing rows)."""
+        if len(chunk_ids) == 0:
+            return
+        keys = np.arange(self.size, self.size + len(chunk_ids), dtype=np.uint64)
+        self.index.add(keys, np.ascontiguousarray(matrix, dtype=np.float32))
+        self.chunk_ids = np.concatenate([self.chunk_ids, np.array(chunk_ids, dtype=object)])
+        self.doc_ids = np.concatenate([self.doc_ids, np.array(doc_ids, dtype=object)])
+        self.filenames = np.concatenate([self.filenames, np.array(filenames, dtype=object)])
+
+    def save(self):
+        """Write index and sidecar atomically (readers skip keys the sidecar doesn't know yet)."""
+        os.makedirs(ANN_INDEX_DIR, exist_ok=True)
+        base = _base_path(self.chat_id)
+        self.index.save(base + ".usearch.tmp")
+        os.replace(base + ".usearch.tmp", base + ".usearch")
+        with open(base + ".meta.json.tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "chat_id": self.chat_id,
+                "dimensions": self.dimensions,
+                "chunk_ids": self.chunk_ids.tolist(),
+                "doc_ids": self.doc_ids.tolist(),
+                "filenames": self.filenames.tolist(),
+            }, f)
+        os.replace(base + ".meta.json.tmp", base + ".meta.json")
+
+    def search(self, question_vector, k: int, boost: Optional[Callable[[np.ndarray], Optional[np.ndarray]]] = None,
+               allowed: Optional[Callable[[np.ndarray], np.ndarray]] = None) -> tuple:
+        """
+        Approximate top-k rows by inner product with the (unit) question vector.
+
+        Args:
+            question_vector: Question embedding shortened to this index's size
+            k: Number of rows to return
+            boost: Optional rows -> additive score boost (filename boost)
+            allowed: Optional rows -> bool mask (file / scope filters)
+
+        Returns:
+            (rows, scores) sorted by score descending, like score_top_k
+        """
+        if self.size == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        q = np.asarray(question_vector, dtype=np.float32)
+        q = q / (float(np.linalg.norm(q)) or 1.0)
+        candidates = min(max(k * ANN_INDEX_OVERFETCH, k), self.size)
+        while True:
+            matches = self.index.search(q, candidates)
+            rows = np.asarray(matches.keys, dtype=np.int64)
+            scores = 1.0 - np.asarray(matches.distances, dtype=np.float32)
+            known = rows < self.size
+            rows, scores = rows[known], scores[known]
+            if allowed is not None and len(rows):
+                keep = allowed(rows)
+                rows, scores = rows[keep], scores[keep]
+            # Filters can starve the candidate list; widen the search before giving up
+            if len(rows) >= k or candidates >= self.size:
+                break
+            candidates = min(candidates * 4, self.size)
+
+        if boost is not None and len(rows):
+            extra = boost(rows)
+            if extra is not None:
+                scores = scores + extra
+        order = np.argsort(-scores, kind="stable")[:k]
+        return rows[order], scores[order]
+
+
+class AnnIndexCache:
+    """LRU of memory-mapped chat indexes, reopened when a worker rewrites the files."""
+
+    def __init__(self, max_chats: int):
+        self.max_chats = max_chats
+        self._entries: "OrderedDict[str, ChatAnnIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.searches = 0
+
+    def get(self, chat_id: str) -> Optional[ChatAnnIndex]:
+        if not ANN_INDEX_ENABLED:
+            return None
+        try:
+            mtime = os.path.getmtime(_base_path(chat_id) + ".meta.json")
+        except OSError:
+            self.invalidate(chat_id)
+            return None
+
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is not None and entry.mtime == mtime:
+                self._entries.move_to_end(chat_id)
+                self.searches += 1
+                return entry
+
+        entry = ChatAnnIndex.load(chat_id, view=True)
+        if entry is None:
+            return None
+        with self._lock:
+            self._entries[chat_id] = entry
+            self._entries.move_to_end(chat_id)
+            while len(self._entries) > self.max_chats:
+                self._entries.popitem(last=False)
+            self.searches += 1
+        logger.info(f"🗺️ Opened ANN index for {chat_id} ({entry.size} chunks, {entry.dimensions} dims)")
+        return entry
+
+    def invalidate(self, chat_id: str):
+        with self._lock:
+            self._entries.pop(chat_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": ANN_INDEX_ENABLED,
+                "open_chats": len(self._entries),
+                "searches": self.searches,
+                "min_chunks": ANN_INDEX_MIN_CHUNKS,
+            }
+
+
+def has_ann_index(chat_id: str) -> bool:
+    return os.path.exists(_base_path(chat_id) + ".meta.json")
+
+
+def delete_chat_ann_index(chat_id: str):
+    """Remove a chat's index files (e.g. when it drops below the threshold or is deleted)."""
+    ann_index_cache.invalidate(chat_id)
+    base = _base_path(chat_id)
+    for path in (base + ".meta.json", base + ".usearch"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+ann_index_cache = AnnIndexCache(ANN_INDEX_CACHE_CHATS)
@@ -0,0 +1,193 @@
+"""
+Semantic answer cache for the published-chat API endpoints.
+
+Near-duplicate questions (FAQ traffic) against the same chat are answered from
+cache instead of calling the LLM. An entry is only reused when:
+
+- the chat has opted in (`answerCacheEnabled` in its effective settings),
+- the chat content version(s) are unchanged (see retrieval.bump_chat_version),
+- the effective settings fingerprint is unchanged,
+- the entry is younger than the chat's TTL, and
+- the cosine similarity of the question embeddings meets the chat's threshold.
+
+Entries live in Redis so all API workers share them, with a process-local
+fallback when Redis is unavailable.
+"""
+
+import os
+import json
+import time
+import base64
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from cachetools import TTLCache
+
+from retrieval import get_chat_version, get_shared_redis
+
+logger = logging.getLogger(__name__)
+
+# Global kill switch; per-chat opt-in still applies when enabled
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+ANSWER_CACHE_MAX_ENTRIES_PER_CHAT = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES_PER_CHAT", "100"))
+# Fraction of the normal per-token credit cost charged for a cache hit
+ANSWER_CACHE_CREDIT_MULTIPLIER = float(os.getenv("ANSWER_CACHE_CREDIT_MULTIPLIER", "0.1"))
+
+# Settings keys that only configure the cache itself (excluded from the fingerprint)
+ANSWER_CACHE_SETTING_KEYS = ("answerCacheEnabled", "answerCacheThreshold", "answerCacheTtlSeconds")
+
+
+def answer_cache_policy(settings: Optional[dict]) -> Optional[Dict[str, Any]]:
+    """
+    Resolve the answer cache policy from a chat's effective settings.
+
+    Args:
+        settings: Output of merge_settings_with_overrides
+
+    Returns:
+        {"threshold": float, "ttl": int} when the chat opted in, otherwise None
+    """
+    if not ANSWER_CACHE_ENABLED or not settings or not settings.get("answerCacheEnabled"):
+        return None
+    threshold = settings.get("answerCacheThreshold") or ANSWER_CACHE_SIMILARITY_THRESHOLD
+    ttl = settings.get("answerCacheTtlSeconds") or ANSWER_CACHE_TTL_SECONDS
+    return {"threshold": min(max(float(threshold), 0.0), 1.0), "ttl": int(ttl)}
+
+
+def settings_fingerprint(settings: Optional[dict], **extra) -> str:
+    """
+    Stable hash of the settings that influence an answer.
+
+    Args:
+        settings: Effective chat settings
+        **extra: Request-level inputs that also change the answer (scope filters, token limits)
+    """
+    relevant = {
+        key: value for key, value in (settings or {}).items()
+        if key not in ANSWER_CACHE_SETTING_KEYS and key not in ("publishedAt", "publishedBy")
+    }
+    relevant.update(extra)
+    encoded = json.dumps(relevant, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:16]
+
+
+def _unit(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticAnswerCache:
+    """Per-chat buckets of (question embedding, answer, context) keyed by content version and settings."""
+
+    def __init__(self, max_entries_per_chat: int):
+        self.max_entries_per_chat = max_entries_per_chat
+        self._local = TTLCache(maxsize=1024, ttl=ANSWER_CACHE_TTL_SECONDS)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    @staticmethod
+    def bucket_key(chat_id: str, version_chat_ids: List[str], fingerprint: str) -> str:
+        """
+        Bucket for a chat's answers at its current content version.
+
+        Compute it once, before retrieval, and pass the same key to lookup and
+        store: recomputing it after the LLM call would file an answer built
+        from the old content under a version bumped during generation.
+        """
+        # Subchats inherit parent files, so the parent's version is part of the key too
+        versions = "-".join(str(get_chat_version(c)) for c in version_chat_ids if c)
+        return f"trainly:answer_cache:{chat_id}:{versions}:{fingerprint}"
+
+    def _load_entries(self, key: str) -> List[dict]:
+        conn = get_shared_redis()
+        if conn is not None:
+            try:
+                return [json.loads(raw) for raw in conn.lrange(key, 0, -1)]
+            except Exception as e:
+                logger.warning(f"⚠️ Could not read answer cache from Redis: {e}")
+        with self._lock:
+            return list(self._local.get(key, []))
+
+    def lookup(self, key: str, chat_id: str, question_embedding: List[float],
+               policy: Dict[str, Any]) -> Optional[dict]:
+        """
+        Find a fresh cached answer for a semantically equivalent question.
+
+        Args:
+            key: bucket_key computed before retrieval
+            chat_id: Chat being answered (for logging)
+            question_embedding: Embedding of the question
+            policy: answer_cache_policy output
+
+        Returns:
+            Cached entry ({"question", "answer", "context", "similarity", ...}) or None
+        """
+        now = time.time()
+        entries = [e for e in self._load_entries(key) if now - e.get("created_at", 0) <= policy["ttl"]]
+
+        best = None
+        if entries:
+            matrix = np.stack([np.frombuffer(base64.b64decode(e["embedding"]), dtype=np.float32) for e in entries])
+            similarities = matrix @ _unit(question_embedding)
+            index = int(np.argmax(similarities))
+            if similarities[index] >= policy["threshold"]:
+                best = dict(entries[index], similarity=float(similarities[index]))
+
+        with self._lock:
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if best is not None:
+            logger.info(f"♻️ Answer cache hit for chat {chat_id} (similarity {best['similarity']:.3f})")
+        return best
+
+    def store(self, key: str, question: str, question_embedding: List[float], answer: str,
+              context: List[dict], policy: Dict[str, Any]):
+        """Add an answer to the bucket it was looked up in (the same key), keeping at most max_entries_per_chat entries."""
+        entry = {
+            "question": question,
+            "embedding": base64.b64encode(_unit(question_embedding).tobytes()).decode("ascii"),
+            "answer": answer,
+            "context": context,
+            "created_at": time.time(),
+        }
+        with self._lock:
+            self.stores += 1
+
+        conn = get_shared_redis()
+        if conn is not None:
+            try:
+                pipe = conn.pipeline()
+                pipe.lpush(key, json.dumps(entry))
+                pipe.ltrim(key, 0, self.max_entries_per_chat - 1)
+                pipe.expire(key, policy["ttl"])
+                pipe.execute()
+                return
+            except Exception as e:
+                logger.warning(f"⚠️ Could not write answer cache to Redis: {e}")
+        with self._lock:
+            entries = [entry] + list(self._local.get(key, []))
+            self._local[key] = entries[:self.max_entries_per_chat]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": ANSWER_CACHE_ENABLED,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+semantic_answer_cache = SemanticAnswerCache(ANSWER_CACHE_MAX_ENTRIES_PER_CHAT)
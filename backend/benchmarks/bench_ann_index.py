@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Recall-vs-latency benchmark for the per-chat HNSW index (ann_index.ChatAnnIndex)
+against exact search (retrieval.score_top_k).
+
+Builds one index over a synthetic chat and sweeps the query beam width
+(expansion_search), reporting recall@k against the exact top-k and the median
+query latency of both paths. Also reports build time and the on-disk size of
+the saved index.
+
+Usage:
+    python benchmarks/bench_ann_index.py
+    python benchmarks/bench_ann_index.py --chunks 500000 --dims 512 --k 50
+
+The synthetic chat is clustered (topics plus noise) like real document
+embeddings; recall on a real chat should be measured before lowering the
+beam width.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ann_index  # noqa: E402
+from retrieval import score_top_k  # noqa: E402
+
+
+def median_seconds(fn, questions):
+    timings = []
+    results = []
+    for question in questions:
+        started = time.perf_counter()
+        results.append(fn(question))
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings)), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HNSW vs exact chunk search")
+    parser.add_argument("--chunks", type=int, default=200000)
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--questions", type=int, default=100)
+    parser.add_argument("--expansions", default="32,64,128,256,512")
+    args = parser.parse_args()
+
+    if not ann_index.USEARCH_AVAILABLE:
+        print("usearch is not installed (pip install usearch)")
+        sys.exit(1)
+
+    rng = np.random.default_rng(42)
+    # Embeddings of real documents are clustered by topic; uniform random
+    # vectors would be a pathological worst case for any ANN index
+    centroids = rng.standard_normal((max(args.chunks // 200, 1), args.dims), dtype=np.float32)
+    matrix = centroids[rng.integers(0, len(centroids), args.chunks)]
+    matrix += 1.5 * rng.standard_normal(matrix.shape, dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    # Questions near existing chunks, like real queries against their own corpus
+    anchors = matrix[rng.integers(0, args.chunks, args.questions)]
+    questions = anchors + 0.5 * rng.standard_normal(anchors.shape, dtype=np.float32) / np.sqrt(args.dims)
+
+    ids = [str(i) for i in range(args.chunks)]
+    with tempfile.TemporaryDirectory() as directory:
+        ann_index.ANN_INDEX_DIR = directory
+        started = time.perf_counter()
+        index = ann_index.ChatAnnIndex.create("bench", args.dims)
+        index.add(matrix, ids, ids, ids)
+        build_seconds = time.perf_counter() - started
+        index.save()
+        disk_mb = os.path.getsize(os.path.join(directory, "bench.usearch")) / 1e6
+        viewed = ann_index.ChatAnnIndex.load("bench", view=True)
+
+        exact_seconds, exact = median_seconds(lambda q: score_top_k(q, matrix, args.k)[0], questions)
+        expected = [set(rows.tolist()) for rows in exact]
+
+        print(f"chunks={args.chunks} dims={args.dims} k={args.k} questions={args.questions}")
+        print(f"build {build_seconds:.1f}s ({args.chunks / build_seconds:.0f} chunks/s), index on disk {disk_mb:.1f} MB, "
+              f"matrix in RAM {matrix.nbytes / 1e6:.1f} MB")
+        print(f"exact search: {exact_seconds * 1000:.2f} ms/query")
+        print(f"{'expansion':>9} | {'ms/query':>8} | {'speedup':>7} | recall@k")
+        print("-" * 42)
+        for expansion in [int(e) for e in args.expansions.split(",")]:
+            viewed.index.expansion_search = expansion
+            seconds, results = median_seconds(lambda q: viewed.search(q, args.k)[0], questions)
+            recall = np.mean([len(set(rows.tolist()) & exp) / args.k for rows, exp in zip(results, expected)])
+            print(f"{expansion:>9} | {seconds * 1000:>8.2f} | {exact_seconds / seconds:>6.1f}x | {recall:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the token-aware chunker against the previous character chunker.
+
+Builds a synthetic multi-MB document (prose paragraphs, Markdown headings,
+fenced code blocks and long unpunctuated runs, like extracted tables) and
+reports, for each chunker, throughput (MB/s and chunks/s), the chunk count
+and the token-size spread of the chunks. Sizes are doubled to show how the
+time scales with input length.
+
+Usage:
+    python benchmarks/bench_chunking.py
+    python benchmarks/bench_chunking.py --mb 2 8 --target-tokens 500 --overlap 50
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chunking import split_text  # noqa: E402
+from context_assembly import count_tokens, TIKTOKEN_AVAILABLE  # noqa: E402
+
+
+def legacy_chunk_text(full_text: str, max_chars: int = 2000) -> List[str]:
+    """read_files.chunk_text before the token-aware chunker (verbatim)."""
+    chunks = []
+    start = 0
+    while start < len(full_text):
+        end = start + max_chars
+        if end > len(full_text):
+            chunks.append(full_text[start:])
+            break
+
+        # Try to break at sentence boundary for better semantic coherence
+        # Look back up to 200 chars for a period, question mark, or exclamation
+        if end < len(full_text):
+            best_break = end
+            for i in range(end, max(start + max_chars - 200, start), -1):
+                if full_text[i-1] in '.!?\n':
+                    best_break = i
+                    break
+            end = best_break
+
+        chunks.append(full_text[start:end])
+        start = end
+    return chunks
+
+
+WORDS = ("policy employee benefit request approval manager system data report quarterly "
+         "account access review process customer service update training security").split()
+
+
+def make_document(size_bytes: int, rng: random.Random) -> str:
+    parts = []
+    size = 0
+    section = 0
+    while size < size_bytes:
+        roll = rng.random()
+        if roll < 0.08:
+            section += 1
+            part = f"{'#' * rng.randint(1, 3)} Section {section}"
+        elif roll < 0.16:
+            lines = [f"    value_{i} = compute('{rng.choice(WORDS)}', {i})" for i in range(rng.randint(5, 80))]
+            part = "```python\n" + "\n".join(lines) + "\n```"
+        elif roll < 0.22:
+            # Table-like text without sentence punctuation
+            part = " | ".join(rng.choice(WORDS) for _ in range(rng.randint(100, 600)))
+        else:
+            sentences = [
+                " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 24))).capitalize() + "."
+                for _ in range(rng.randint(2, 12))
+            ]
+            part = " ".join(sentences)
+        parts.append(part)
+        size += len(part) + 2
+    return "\n\n".join(parts)
+
+
+def run(name, fn, text):
+    started = time.perf_counter()
+    chunks = fn(text)
+    elapsed = time.perf_counter() - started
+    mb = len(text.encode("utf-8")) / 1e6
+    sample = chunks if len(chunks) <= 2000 else chunks[::len(chunks) // 2000]
+    tokens = [count_tokens(chunk) for chunk in sample]
+    print(f"  {name:>8}: {elapsed:7.3f} s  {mb / elapsed:7.2f} MB/s  {len(chunks) / elapsed:9.0f} chunks/s  "
+          f"{len(chunks):6d} chunks  tokens mean {statistics.mean(tokens):6.0f} "
+          f"p95 {sorted(tokens)[int(len(tokens) * 0.95)]:5d} max {max(tokens):5d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mb", type=float, nargs="+", default=[2.0, 4.0, 8.0], help="Document sizes in MB")
+    parser.add_argument("--target-tokens", type=int, default=500)
+    parser.add_argument("--overlap", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"tiktoken: {'yes' if TIKTOKEN_AVAILABLE else 'no (4 chars/token estimate)'}; "
+          f"target {args.target_tokens} tokens, overlap {args.overlap}")
+    for mb in args.mb:
+        text = make_document(int(mb * 1e6), random.Random(args.seed))
+        print(f"{mb:g} MB document:")
+        run("legacy", legacy_chunk_text, text)
+        run("tokens", lambda t: split_text(t, args.target_tokens, args.overlap), text)
+
+
+if __name__ == "__main__":
+    main()
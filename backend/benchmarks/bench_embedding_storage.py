@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for chunk embedding storage encodings.
+
+For each encoding ("list", "float32", "float16", "int8") reports the stored
+bytes per chunk, the time and peak memory to decode a chat's embeddings into
+the float32 scoring matrix, and the top-k recall of the decoded matrix
+against exact float32 scores. "list" decodes Python float lists (what the
+Neo4j driver returns for list properties) with np.array; the byte encodings
+go through retrieval.decode_embeddings (one np.frombuffer per chat).
+
+Usage:
+    python benchmarks/bench_embedding_storage.py
+    python benchmarks/bench_embedding_storage.py --chunks 100000 --dims 1536 --k 50
+
+The list path needs ~24 bytes per float in Python objects, so it is measured
+on --list-max chunks and scaled linearly to --chunks.
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from retrieval import encode_embedding, decode_embeddings, score_top_k  # noqa: E402
+
+
+def measure(fn):
+    """Run fn once, returning (result, seconds, peak traced MB)."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 1e6
+
+
+def recall_at_k(matrix, reference_top, questions, k):
+    hits = 0
+    for question, expected in zip(questions, reference_top):
+        rows, _ = score_top_k(question, matrix, k)
+        hits += len(set(rows.tolist()) & expected)
+    return hits / (len(questions) * k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding storage encodings")
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--list-max", type=int, default=10000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    matrix = rng.standard_normal((args.chunks, args.dims), dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    questions = rng.standard_normal((args.questions, args.dims), dtype=np.float32)
+    reference_top = [set(score_top_k(q, matrix, args.k)[0].tolist()) for q in questions]
+
+    print(f"chunks={args.chunks} dims={args.dims} k={args.k} (decode memory = peak Python allocations)")
+    print(f"{'encoding':>9} | {'bytes/chunk':>11} | {'stored MB':>9} | {'decode (s)':>10} | {'decode MB':>9} | recall@k")
+    print("-" * 76)
+
+    # Neo4j stores list properties as 8-byte doubles
+    list_rows = min(args.list_max, args.chunks)
+    scale = args.chunks / list_rows
+    lists = [row.tolist() for row in matrix[:list_rows]]
+    decoded, seconds, peak_mb = measure(lambda rows=lists: np.array(rows, dtype=np.float32))
+    list_python_mb = (sys.getsizeof(lists[0]) + sum(sys.getsizeof(x) for x in lists[0])) * args.chunks / 1e6
+    print(f"{'list':>9} | {args.dims * 8:>11} | {args.dims * 8 * args.chunks / 1e6:>9.1f} | "
+          f"{seconds * scale:>10.4f} | {peak_mb * scale + list_python_mb:>9.1f} | {'1.0000':>8}  (x{scale:.0f} extrapolated)")
+    del lists, decoded
+
+    for encoding in ("float32", "float16", "int8"):
+        blobs = [encode_embedding(row, encoding) for row in matrix]
+        decoded, seconds, peak_mb = measure(lambda b=blobs, e=encoding: decode_embeddings(b, e))
+        recall = recall_at_k(decoded, reference_top, questions, args.k)
+        stored_mb = sum(len(blob) for blob in blobs) / 1e6
+        print(f"{encoding:>9} | {len(blobs[0]):>11} | {stored_mb:>9.1f} | {seconds:>10.4f} | {peak_mb:>9.1f} | {recall:>8.4f}")
+        del blobs, decoded
+
+
+if __name__ == "__main__":
+    main()
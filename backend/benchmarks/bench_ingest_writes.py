@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Benchmark for ingestion graph writes: per-row statements vs UNWIND batches.
+
+Counts the Cypher statements (driver round trips) needed to write a
+document's chunks, HAS_CHUNK edges, NEXT links and AI relationships the old
+way (one statement per chunk, a check plus a create per relationship) and
+with graph_writes (one UNWIND statement per INGEST_WRITE_BATCH_SIZE rows).
+Without NEO4J_URI the statements go to a counting session that simulates
+--latency-ms of round-trip time each; with NEO4J_URI set both variants are
+written to and timed against that database, then deleted.
+
+Usage:
+    python benchmarks/bench_ingest_writes.py
+    python benchmarks/bench_ingest_writes.py --chunks 5000 --batch-size 500 --latency-ms 1
+    NEO4J_URI=bolt://localhost:7687 NEO4J_USERNAME=neo4j NEO4J_PASSWORD=... \\
+        python benchmarks/bench_ingest_writes.py --chunks 5000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from retrieval import chunk_embedding_params, chunk_labels  # noqa: E402
+from graph_writes import write_chunks, write_next_links, write_relationships  # noqa: E402
+
+
+class _Result:
+    def single(self):
+        return {"created": 0}
+
+
+class CountingSession:
+    """Stands in for a Neo4j session/transaction: counts statements and sleeps per round trip."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.statements = 0
+        self.rows = 0
+
+    def run(self, query, **params):
+        self.statements += 1
+        self.rows += len(params.get("rows", [None]))
+        if self.latency:
+            time.sleep(self.latency)
+        return _Result()
+
+
+def make_rows(doc_id, chunks, dims, rng):
+    embeddings = rng.standard_normal((chunks, dims)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return [
+        {
+            "chunk_id": f"{doc_id}-{i}",
+            "text": f"chunk {i} " * 50,
+            **chunk_embedding_params(embedding.tolist()),
+            "embedding_norm": 1.0,
+            "token_count": 100,
+            "order": i,
+        }
+        for i, embedding in enumerate(embeddings)
+    ]
+
+
+def make_relationships(chunks, per_chunk):
+    types = ["EXPLAINS", "SUPPORTS", "ELABORATES", "INTRODUCES", "CONCLUDES"]
+    return [
+        {"source": i, "target": i + 1 + j, "type": types[(i + j) % len(types)],
+         "description": "bench", "confidence": 0.8}
+        for i in range(chunks - per_chunk - 1)
+        for j in range(per_chunk)
+    ]
+
+
+def per_row_writes(tx, doc_id, chat_id, rows, labels, relationships):
+    """The pre-batching ingestion writes: one statement per chunk, NEXT link and (check + create) relationship."""
+    chunk_query = f"""
+    MATCH (d:Document {{id: $pdf_id}})
+    CREATE (c:{labels} {{id: $chunk_id, text: $text, embedding: $embedding, embeddingBlob: $embedding_blob,
+        embeddingEncoding: $embedding_encoding, embeddingNorm: $embedding_norm, tokenCount: $token_count,
+        chatId: $chat_id}})
+    CREATE (d)-[:HAS_CHUNK {{order: $order}}]->(c)
+    """
+    for row in rows:
+        tx.run(chunk_query, pdf_id=doc_id, chat_id=chat_id, **row)
+    for i in range(len(rows) - 1):
+        tx.run("""
+        MATCH (c1:Chunk {id: $chunk1_id}) MATCH (c2:Chunk {id: $chunk2_id})
+        CREATE (c1)-[:NEXT {order: $order}]->(c2)
+        """, chunk1_id=rows[i]["chunk_id"], chunk2_id=rows[i + 1]["chunk_id"], order=i)
+    for rel in relationships:
+        ids = {"chunk1_id": f"{doc_id}-{rel['source']}", "chunk2_id": f"{doc_id}-{rel['target']}"}
+        tx.run("MATCH (c1:Chunk {id: $chunk1_id}) MATCH (c2:Chunk {id: $chunk2_id}) RETURN c1.id", **ids)
+        tx.run(f"""
+        MATCH (c1:Chunk {{id: $chunk1_id}}) MATCH (c2:Chunk {{id: $chunk2_id}})
+        CREATE (c1)-[:{rel['type']} {{description: $description, confidence: $confidence, ai_generated: true}}]->(c2)
+        """, description=rel["description"], confidence=rel["confidence"], **ids)
+
+
+def batched_writes(tx, doc_id, chat_id, rows, labels, relationships, batch_size):
+    write_chunks(tx, doc_id, chat_id, rows, labels, batch_size=batch_size)
+    write_next_links(tx, [row["chunk_id"] for row in rows], batch_size=batch_size)
+    write_relationships(tx, doc_id, relationships, batch_size=batch_size)
+
+
+def run_counting(args, rows, relationships, labels):
+    print(f"Simulated round-trip latency: {args.latency_ms} ms per statement")
+    for name, fn in (
+        ("per-row", lambda tx: per_row_writes(tx, "bench-doc", "bench-chat", rows, labels, relationships)),
+        ("unwind", lambda tx: batched_writes(tx, "bench-doc", "bench-chat", rows, labels, relationships, args.batch_size)),
+    ):
+        session = CountingSession(args.latency_ms / 1000)
+        started = time.perf_counter()
+        fn(session)
+        elapsed = time.perf_counter() - started
+        print(f"{name:>8}: {session.statements:>6} statements  {elapsed * 1000:9.1f} ms")
+
+
+def run_neo4j(args, rows, relationships, labels):
+    from neo4j import GraphDatabase
+
+    def rows_for(doc_id):
+        return [{**row, "chunk_id": f"{doc_id}-{row['order']}"} for row in rows]
+
+    uri = os.environ["NEO4J_URI"]
+    auth = (os.getenv("NEO4J_USERNAME", "neo4j"), os.getenv("NEO4J_PASSWORD", ""))
+    print(f"Writing to {uri}")
+    with GraphDatabase.driver(uri, auth=auth) as driver:
+        with driver.session() as session:
+            for name, fn in (
+                ("per-row", lambda tx, doc_id: per_row_writes(tx, doc_id, "bench-chat", rows_for(doc_id), labels, relationships)),
+                ("unwind", lambda tx, doc_id: batched_writes(tx, doc_id, "bench-chat", rows_for(doc_id), labels, relationships, args.batch_size)),
+            ):
+                doc_id = f"bench-{name}"
+                session.run("MERGE (d:Document {id: $id}) SET d.chatId = 'bench-chat'", id=doc_id).consume()
+                started = time.perf_counter()
+                session.execute_write(fn, doc_id)
+                elapsed = time.perf_counter() - started
+                print(f"{name:>8}: {elapsed:9.2f} s")
+                session.run("MATCH (d:Document {id: $id}) OPTIONAL MATCH (d)-[:HAS_CHUNK]->(c) DETACH DELETE d, c",
+                            id=doc_id).consume()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--relationships-per-chunk", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    rows = make_rows("bench-doc", args.chunks, args.dims, rng)
+    relationships = make_relationships(args.chunks, args.relationships_per_chunk)
+    labels = chunk_labels(args.dims)
+    print(f"{args.chunks} chunks x {args.dims} dims, {len(relationships)} AI relationships, "
+          f"batch size {args.batch_size}")
+
+    if os.getenv("NEO4J_URI"):
+        run_neo4j(args, rows, relationships, labels)
+    else:
+        run_counting(args, rows, relationships, labels)
+
+
+if __name__ == "__main__":
+    main()
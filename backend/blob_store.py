@@ -0,0 +1,232 @@
+"""
+Blob store for extracted file text handed from the API to ingestion workers.
+
+Instead of putting up to 1 MB of text into RQ job arguments (kept in Redis
+for result_ttl), the API writes it here and enqueues a small reference:
+{"blob": key, "sha256": ..., "size": ..., "backend": ...}. Workers stream the
+text back with read_text, which checks the hash, and delete it once the job
+succeeds. Failed jobs keep their blob so they can be retried. There is no
+scheduled cleanup: local blobs older than BLOB_STORE_TTL are swept at most
+once an hour by a process that writes or deletes a blob, so a failed job's
+blob lingers until the next upload or completed job after it expires (use a
+bucket lifecycle rule for S3).
+
+The store is opt-in: with BLOB_STORE_BACKEND unset, text is enqueued inline
+as before. "local" needs BLOB_STORE_DIR on storage shared by the API and
+every worker host; "s3" works with any S3-compatible store
+(BLOB_STORE_S3_BUCKET, optional BLOB_STORE_S3_PREFIX and
+BLOB_STORE_S3_ENDPOINT; credentials come from the usual AWS environment).
+boto3 is only needed for "s3".
+"""
+
+import os
+import time
+import codecs
+import uuid
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Iterator
+
+try:
+    import boto3
+    BOTO3_AVAILABLE = True
+except ImportError:
+    BOTO3_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# "" (inline job arguments), "local" or "s3"
+BLOB_STORE_BACKEND = os.getenv("BLOB_STORE_BACKEND", "").lower()
+BLOB_STORE_ENABLED = BLOB_STORE_BACKEND in ("local", "s3")
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "blobs"))
+BLOB_STORE_S3_BUCKET = os.getenv("BLOB_STORE_S3_BUCKET")
+BLOB_STORE_S3_PREFIX = os.getenv("BLOB_STORE_S3_PREFIX", "trainly/extracted-text/")
+BLOB_STORE_S3_ENDPOINT = os.getenv("BLOB_STORE_S3_ENDPOINT")
+# Unclaimed local blobs (failed or cancelled jobs) are removed after this many seconds
+BLOB_STORE_TTL = int(os.getenv("BLOB_STORE_TTL", str(3 * 24 * 3600)))
+
+STREAM_CHUNK_BYTES = 1024 * 1024
+
+
+class BlobIntegrityError(Exception):
+    """A blob's content doesn't match the hash in its reference."""
+
+
+class LocalBlobStore:
+    name = "local"
+
+    def __init__(self, directory: str = BLOB_STORE_DIR, ttl: int = BLOB_STORE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.directory, key))
+        if not path.startswith(os.path.abspath(self.directory) + os.sep):
+            raise ValueError(f"Invalid blob key: {key}")
+        return path
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so a worker never reads a partial blob
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._sweep()
+
+    def stream(self, key: str) -> Iterator[bytes]:
+        with open(self._path(key), "rb") as f:
+            while True:
+                block = f.read(STREAM_CHUNK_BYTES)
+                if not block:
+                    return
+                yield block
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        self._sweep()
+
+    def _sweep(self):
+        """Remove expired blobs, at most once an hour per process."""
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < 3600:
+                return
+            self._last_sweep = now
+        removed = 0
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                try:
+                    if now - os.path.getmtime(path) > self.ttl:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    continue
+        if removed:
+            logger.info(f"🧹 Removed {removed} expired text blobs")
+
+
+class S3BlobStore:
+    name = "s3"
+
+    def __init__(self, bucket: str = BLOB_STORE_S3_BUCKET, prefix: str = BLOB_STORE_S3_PREFIX,
+                 endpoint_url: str = BLOB_STORE_S3_ENDPOINT):
+        if not BOTO3_AVAILABLE:
+            raise RuntimeError("BLOB_STORE_BACKEND=s3 requires boto3")
+        if not bucket:
+            raise RuntimeError("BLOB_STORE_BACKEND=s3 requires BLOB_STORE_S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def put(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data,
+                               ContentType="text/plain; charset=utf-8")
+
+    def stream(self, key: str) -> Iterator[bytes]:
+        body = self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)["Body"]
+        try:
+            yield from body.iter_chunks(STREAM_CHUNK_BYTES)
+        finally:
+            body.close()
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+
+_stores: Dict[str, Any] = {}
+_stores_lock = threading.Lock()
+
+
+def get_blob_store(backend: str = BLOB_STORE_BACKEND):
+    """The configured store (created once per process)."""
+    with _stores_lock:
+        if backend not in _stores:
+            _stores[backend] = S3BlobStore() if backend == "s3" else LocalBlobStore()
+        return _stores[backend]
+
+
+def is_text_ref(value: Any) -> bool:
+    return isinstance(value, dict) and "blob" in value and "sha256" in value
+
+
+def put_text(text: str) -> Dict[str, Any]:
+    """
+    Store extracted text and return the reference to enqueue instead of it.
+
+    Returns:
+        {"blob", "sha256", "size", "backend"}
+    """
+    data = text.encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()
+    # Unique per upload so cleaning up one job never removes another job's blob
+    key = f"{digest[:2]}/{digest}-{uuid.uuid4().hex}.txt"
+    store = get_blob_store()
+    store.put(key, data)
+    return {"blob": key, "sha256": digest, "size": len(data), "backend": store.name}
+
+
+def read_text(ref: Dict[str, Any]) -> str:
+    """
+    Stream a stored text back, verifying its hash.
+
+    Raises:
+        BlobIntegrityError: Size or sha256 don't match the reference
+    """
+    store = get_blob_store(ref.get("backend", BLOB_STORE_BACKEND))
+    digest = hashlib.sha256()
+    parts = []
+    for block in store.stream(ref["blob"]):
+        digest.update(block)
+        parts.append(block)
+    data = b"".join(parts)
+    if len(data) != ref.get("size", len(data)) or digest.hexdigest() != ref["sha256"]:
+        raise BlobIntegrityError(f"Blob {ref['blob']} does not match its reference")
+    return data.decode("utf-8")
+
+
+def iter_text_lines(ref: Dict[str, Any]) -> Iterator[str]:
+    """
+    Stream a stored text back line by line (without line endings), verifying its hash.
+
+    Only one STREAM_CHUNK_BYTES block and the line being assembled are held
+    at a time. The hash can only be checked once the last block is read, so
+    callers must treat BlobIntegrityError at the end as a failure of
+    everything they did with the lines.
+
+    Raises:
+        BlobIntegrityError: Size or sha256 don't match the reference
+    """
+    store = get_blob_store(ref.get("backend", BLOB_STORE_BACKEND))
+    digest = hashlib.sha256()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    size = 0
+    pending = ""
+    for block in store.stream(ref["blob"]):
+        digest.update(block)
+        size += len(block)
+        lines = (pending + decoder.decode(block)).splitlines(keepends=True)
+        # The last line may continue in the next block (including a "\r" of a "\r\n")
+        pending = lines.pop() if lines else ""
+        for line in lines:
+            yield line.splitlines()[0]
+    pending += decoder.decode(b"", final=True)
+    if size != ref.get("size", size) or digest.hexdigest() != ref["sha256"]:
+        raise BlobIntegrityError(f"Blob {ref['blob']} does not match its reference")
+    yield from pending.splitlines()
+
+
+def delete_text(ref: Dict[str, Any]):
+    """Remove a stored text (errors are logged; expired blobs are swept anyway)."""
+    try:
+        get_blob_store(ref.get("backend", BLOB_STORE_BACKEND)).delete(ref["blob"])
+    except Exception as e:
+        logger.warning(f"⚠️ Could not delete text blob {ref.get('blob')}: {e}")
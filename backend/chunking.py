@@ -0,0 +1,172 @@
+"""
+Token-aware, structure-aware text chunking for ingestion.
+
+iter_chunks walks the text once, line by line, splitting it into blocks:
+Markdown headings, fenced code blocks and paragraphs (runs of non-blank
+lines). Blocks are cut into units no larger than the token target
+(paragraphs at sentence ends, code at line ends, anything still too large
+at token boundaries) and packed greedily into chunks of up to
+CHUNK_TARGET_TOKENS. A heading starts a new chunk once the current one is
+CHUNK_MIN_FILL full and is never left dangling at the end of one. With
+CHUNK_OVERLAP_TOKENS > 0 the last units of each chunk are repeated at the
+start of the next.
+
+Each line, block and unit is visited a constant number of times, so the
+pass is linear in the text length, and iter_chunks also accepts the lines
+as a lazy iterable, holding only the current block and chunk. Tokens are counted with tiktoken (see
+context_assembly.count_tokens) or estimated at ~4 characters each.
+"""
+
+import os
+import re
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Tuple, Union
+
+from context_assembly import count_tokens, split_by_tokens
+
+# ~2000 characters of English, the size chunks had before token targeting
+CHUNK_TARGET_TOKENS = int(os.getenv("CHUNK_TARGET_TOKENS", "500"))
+# Tokens of each chunk's tail repeated at the start of the next (0 disables overlap)
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "0"))
+# Fraction of the target a chunk must reach before a heading may start a new one
+CHUNK_MIN_FILL = float(os.getenv("CHUNK_MIN_FILL", "0.5"))
+
+_HEADING = re.compile(r"#{1,6}\s")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+@dataclass
+class _Unit:
+    text: str
+    tokens: int  # Including ~1 for the separator
+    separator: str  # Joins the unit to the previous one in the same chunk
+    heading: bool = False
+
+
+def _unit(text: str, tokens: int, separator: str, heading: bool = False) -> _Unit:
+    return _Unit(text, tokens + (1 if separator else 0), separator, heading)
+
+
+def _blocks(text: Union[str, Iterable[str]]) -> Iterator[Tuple[str, str]]:
+    """(kind, text) blocks in order: "heading", "code" or "paragraph"."""
+    paragraph: List[str] = []
+    code: List[str] = []
+    fence = None
+    for line in text.splitlines() if isinstance(text, str) else text:
+        stripped = line.strip()
+        if fence is not None:
+            code.append(line)
+            if stripped.startswith(fence):
+                yield "code", "\n".join(code)
+                code = []
+                fence = None
+            continue
+        if stripped.startswith("```") or stripped.startswith("~~~"):
+            if paragraph:
+                yield "paragraph", "\n".join(paragraph)
+                paragraph = []
+            fence = stripped[:3]
+            code = [line]
+        elif _HEADING.match(stripped):
+            if paragraph:
+                yield "paragraph", "\n".join(paragraph)
+                paragraph = []
+            yield "heading", stripped
+        elif not stripped:
+            if paragraph:
+                yield "paragraph", "\n".join(paragraph)
+                paragraph = []
+        else:
+            paragraph.append(line)
+    if paragraph:
+        yield "paragraph", "\n".join(paragraph)
+    if code:
+        # Unclosed fence: keep what we have
+        yield "code", "\n".join(code)
+
+
+def _units(text: Union[str, Iterable[str]], target_tokens: int) -> Iterator[_Unit]:
+    """Blocks cut into units of at most target_tokens."""
+    for kind, block in _blocks(text):
+        tokens = count_tokens(block)
+        if kind == "heading" or tokens <= target_tokens:
+            yield _unit(block, tokens, "\n\n", heading=kind == "heading")
+            continue
+        pieces = block.split("\n") if kind == "code" else _SENTENCE_END.split(block)
+        joiner = "\n" if kind == "code" else " "
+        separator = "\n\n"
+        for piece in pieces:
+            if not piece:
+                continue
+            piece_tokens = count_tokens(piece)
+            if piece_tokens <= target_tokens:
+                yield _unit(piece, piece_tokens, separator)
+            else:
+                for i, part in enumerate(split_by_tokens(piece, target_tokens)):
+                    yield _unit(part, count_tokens(part), separator if i == 0 else "")
+            separator = joiner
+
+
+def _join(units: List[_Unit]) -> str:
+    return "".join(unit.text if i == 0 else unit.separator + unit.text for i, unit in enumerate(units))
+
+
+def iter_chunks(text: Union[str, Iterable[str]], target_tokens: int = CHUNK_TARGET_TOKENS,
+                overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                min_fill: float = CHUNK_MIN_FILL) -> Iterator[str]:
+    """
+    Split text into chunks of about target_tokens, in one pass.
+
+    Args:
+        text: Extracted document text, or its lines without line endings
+            (e.g. blob_store.iter_text_lines, so the text is never held whole)
+        target_tokens: Maximum tokens per chunk (a heading kept with its section may add a few)
+        overlap_tokens: Tokens of trailing units carried into the next chunk
+        min_fill: A heading only starts a new chunk once the current one
+            holds min_fill * target_tokens
+
+    Yields:
+        Chunk texts in document order (none for empty or whitespace-only text)
+    """
+    target_tokens = max(int(target_tokens), 1)
+    overlap_tokens = min(max(int(overlap_tokens), 0), target_tokens // 2)
+    current: List[_Unit] = []
+    tokens = 0
+    fresh = 0  # Units in current that weren't carried over as overlap
+
+    def carry_over(emitted: List[_Unit]) -> List[_Unit]:
+        carried: List[_Unit] = []
+        budget = overlap_tokens
+        for unit in reversed(emitted[1:]):
+            if unit.tokens > budget:
+                break
+            carried.append(unit)
+            budget -= unit.tokens
+        carried.reverse()
+        return carried
+
+    for unit in _units(text, target_tokens):
+        starts_section = unit.heading and tokens >= min_fill * target_tokens
+        if fresh and (starts_section or tokens + unit.tokens > target_tokens):
+            # Keep a trailing heading with the content it introduces
+            pending = [current.pop()] if current[-1].heading and len(current) > 1 else []
+            yield _join(current)
+            carried = [] if starts_section or pending else carry_over(current)
+            if sum(u.tokens for u in carried) + unit.tokens > target_tokens:
+                # The overlap would leave no room for the next unit: drop it
+                carried = []
+            current = carried + pending
+            tokens = sum(u.tokens for u in current)
+            fresh = len(pending)
+        current.append(unit)
+        tokens += unit.tokens
+        fresh += 1
+
+    if fresh:
+        yield _join(current)
+
+
+def split_text(text: str, target_tokens: int = CHUNK_TARGET_TOKENS,
+               overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    """iter_chunks as a list."""
+    return list(iter_chunks(text, target_tokens, overlap_tokens))
@@ -0,0 +1,220 @@
+"""
+Token-budgeted context assembly for LLM prompts.
+
+Instead of sending a fixed number of chunks, assemble_context fills a token
+budget derived from the selected model's context window and the response's
+max_tokens, in relevance order, and stops early when the remaining chunks
+fall below a score threshold or too far behind the best chunk. Chunk token
+counts are stored at ingest (`Chunk.tokenCount`, see count_tokens) and come
+back with hydrated chunks; older chunks fall back to counting at query time.
+
+tiktoken is optional: without it tokens are estimated at ~4 characters each.
+"""
+
+import os
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on context tokens per call, whatever the model allows
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "6000"))
+# Chunks retrieved as candidates for assembly (replaces the fixed top-8)
+CONTEXT_MAX_CHUNKS = int(os.getenv("CONTEXT_MAX_CHUNKS", "16"))
+# Chunks always kept when any were retrieved
+CONTEXT_MIN_CHUNKS = int(os.getenv("CONTEXT_MIN_CHUNKS", "1"))
+# Drop chunks scoring below this (cosine + filename boost)
+CONTEXT_MIN_SCORE = float(os.getenv("CONTEXT_MIN_SCORE", "0.2"))
+# Stop once a chunk scores this far below the best chunk
+CONTEXT_SCORE_GAP = float(os.getenv("CONTEXT_SCORE_GAP", "0.25"))
+# Tokens reserved for the system prompt, question and message framing
+PROMPT_OVERHEAD_TOKENS = int(os.getenv("PROMPT_OVERHEAD_TOKENS", "800"))
+# Per-chunk framing ("[Chunk i] From filename: ")
+CHUNK_OVERHEAD_TOKENS = 12
+
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o-mini": 128000,
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+    "grok-3": 131072,
+    "claude-3-haiku": 200000,
+    "claude-3-sonnet": 200000,
+    "claude-3-opus": 200000,
+    "claude-3.5-sonnet": 200000,
+    "gemini-pro": 32760,
+    "gemini-ultra": 32760,
+    "gemini-1.5-pro": 1000000,
+    "llama-3": 8192,
+    "llama-3.1": 128000,
+    "mistral-7b": 32768,
+    "mixtral-8x7b": 32768,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and TIKTOKEN_AVAILABLE:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logger.warning(f"⚠️ tiktoken encoding unavailable, estimating tokens from length: {e}")
+            return None
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Token count of text (tiktoken o200k_base, or ~4 characters per token without it)."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(len(text) // 4, 1)
+
+
+def split_by_tokens(text: str, max_tokens: int) -> List[str]:
+    """Cut text into consecutive pieces of at most max_tokens (encoded once; ~4 characters per token without tiktoken)."""
+    max_tokens = max(int(max_tokens), 1)
+    encoding = _get_encoding()
+    if encoding is None:
+        step = max_tokens * 4
+        return [text[i:i + step] for i in range(0, len(text), step)]
+    tokens = encoding.encode(text, disallowed_special=())
+    return [encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+
+
+def context_token_budget(model: str, max_tokens: int, question: str = "") -> int:
+    """
+    Tokens available for retrieved context in one call.
+
+    Args:
+        model: Selected model
+        max_tokens: Tokens reserved for the response
+        question: Question text (its tokens are reserved too)
+
+    Returns:
+        The budget, capped at CONTEXT_MAX_TOKENS (never negative)
+    """
+    window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    available = window - int(max_tokens) - PROMPT_OVERHEAD_TOKENS - count_tokens(question)
+    return max(min(available, CONTEXT_MAX_TOKENS), 0)
+
+
+@dataclass
+class AssembledContext:
+    """Chunks chosen for a prompt and the tokens they use."""
+    chunks: List[Dict[str, Any]]
+    tokens_used: int
+    token_budget: int
+    candidates: int
+    stop_reason: str = "exhausted"
+    skipped: List[str] = field(default_factory=list)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "chunks_used": len(self.chunks),
+            "candidates": self.candidates,
+            "tokens_used": self.tokens_used,
+            "token_budget": self.token_budget,
+            "stop_reason": self.stop_reason,
+        }
+
+
+def chunk_tokens(chunk: Dict[str, Any]) -> int:
+    """Stored token count of a chunk, counted on the fly for chunks ingested before it was stored."""
+    tokens = chunk.get("token_count")
+    if tokens is None:
+        tokens = count_tokens(chunk.get("chunk_text") or "")
+        chunk["token_count"] = tokens
+    return int(tokens)
+
+
+def assemble_context(
+    chunks: List[Dict[str, Any]],
+    token_budget: int,
+    min_score: float = CONTEXT_MIN_SCORE,
+    score_gap: float = CONTEXT_SCORE_GAP,
+    min_chunks: int = CONTEXT_MIN_CHUNKS
+) -> AssembledContext:
+    """
+    Fill a token budget with chunks in relevance order.
+
+    Retrieved chunks are ranked by score and cut at the first one below
+    min_score or more than score_gap below the best chunk (after min_chunks
+    are kept), whatever order they arrived in. The survivors are then taken
+    in their original order; a chunk that does not fit the remaining budget
+    is skipped so smaller, later chunks can still fill it. Graph-expansion
+    neighbours (rows with expanded_from, which come after the retrieved
+    chunks) are scored by relationship weight, not similarity, so they skip
+    the score cut-offs and are kept, budget permitting, whenever the chunk
+    they expand was kept.
+
+    Args:
+        chunks: Hydrated chunks in retrieval order (need not be sorted by score)
+        token_budget: See context_token_budget
+        min_score: Absolute score threshold
+        score_gap: Maximum distance below the top score
+        min_chunks: Chunks kept regardless of the score cut-offs (budget permitting)
+
+    Returns:
+        AssembledContext with the selected chunks in their original order
+    """
+    selected = []
+    skipped = []
+    used = 0
+    stop_reason = "exhausted"
+    kept_ids = set()
+
+    seeds = sorted(
+        (chunk for chunk in chunks if "expanded_from" not in chunk),
+        key=lambda chunk: float(chunk.get("score", 0.0)),
+        reverse=True
+    )
+    top_score = float(seeds[0].get("score", 0.0)) if seeds else 0.0
+    eligible = set()
+    for rank, chunk in enumerate(seeds):
+        score = float(chunk.get("score", 0.0))
+        if rank >= min_chunks:
+            if score < min_score:
+                stop_reason = "min_score"
+                break
+            if top_score - score > score_gap:
+                stop_reason = "score_gap"
+                break
+        eligible.add(chunk["chunk_id"])
+
+    for chunk in chunks:
+        if "expanded_from" in chunk:
+            if chunk["expanded_from"] not in kept_ids:
+                continue
+        elif chunk["chunk_id"] not in eligible:
+            continue
+        tokens = chunk_tokens(chunk) + CHUNK_OVERHEAD_TOKENS
+        if used + tokens > token_budget:
+            skipped.append(chunk["chunk_id"])
+            stop_reason = "budget"
+            continue
+        selected.append(chunk)
+        kept_ids.add(chunk["chunk_id"])
+        used += tokens
+
+    return AssembledContext(
+        chunks=selected,
+        tokens_used=used,
+        token_budget=token_budget,
+        candidates=len(chunks),
+        stop_reason=stop_reason,
+        skipped=skipped
+    )
@@ -0,0 +1,215 @@
+"""
+Content-addressed cache of chunk embeddings for ingestion.
+
+Re-uploads of the same file (and the same handbook shared across subchats)
+produce byte-identical chunks, so embeddings are stored under
+(model, dimensions, sha256 of the chunk text) and looked up before calling
+the embeddings API. The backend is the shared Redis connection when it is
+available, otherwise a local SQLite file under EMBEDDING_CACHE_DIR (safe to
+share between worker processes on one host). Values are the provider's raw
+embeddings as float32 bytes; normalization happens at write time as before.
+
+EMBEDDING_CACHE_BACKEND selects "auto" (default), "redis", "local" or "off".
+"""
+
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from retrieval import get_shared_redis
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_BACKEND = os.getenv("EMBEDDING_CACHE_BACKEND", "auto").lower()
+EMBEDDING_CACHE_DIR = os.getenv(
+    "EMBEDDING_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_cache")
+)
+# Entries expire after this many seconds (Redis TTL; local entries are pruned on open)
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", str(30 * 24 * 3600)))
+
+
+def chunk_cache_key(model: str, dimensions: int, text: str) -> str:
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"trainly:cemb:{model}:{dimensions}:{digest}"
+
+
+@dataclass
+class EmbeddingCacheStats:
+    """Per-job cache usage, reported in ingestion results."""
+    backend: str
+    lookups: int = 0
+    hits: int = 0
+    duplicates: int = 0
+    errors: int = 0
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "backend": self.backend,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "misses": self.lookups - self.hits,
+            "duplicates_in_file": self.duplicates,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            "errors": self.errors,
+        }
+
+
+class _LocalStore:
+    """SQLite key/value store (one file, WAL mode so several workers can share it)."""
+
+    def __init__(self, directory: str, ttl: int):
+        self.path = os.path.join(directory, "embeddings.sqlite3")
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, value BLOB, created REAL)")
+            conn.execute("DELETE FROM embeddings WHERE created < ?", (time.time() - self.ttl,))
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, value FROM embeddings WHERE key IN ({placeholders}) AND created >= ?",
+                    (*batch, time.time() - self.ttl)
+                )
+                found.update({key: value for key, value in rows})
+        return found
+
+    def put_many(self, items: Dict[str, bytes]):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, value, created) VALUES (?, ?, ?)",
+                [(key, value, now) for key, value in items.items()]
+            )
+            conn.commit()
+
+
+class _RedisStore:
+    def __init__(self, conn, ttl: int):
+        self.conn = conn
+        self.ttl = ttl
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        found = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            found.update({key: value for key, value in zip(batch, self.conn.mget(batch)) if value})
+        return found
+
+    def put_many(self, items: Dict[str, bytes]):
+        pipe = self.conn.pipeline(transaction=False)
+        for key, value in items.items():
+            pipe.set(key, value, ex=self.ttl)
+        pipe.execute()
+
+
+class ChunkEmbeddingCache:
+    """Looks chunk embeddings up by content before embedding the rest."""
+
+    def __init__(self, backend: str = EMBEDDING_CACHE_BACKEND, directory: str = EMBEDDING_CACHE_DIR,
+                 ttl: int = EMBEDDING_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._local = _LocalStore(directory, ttl)
+
+    def _store(self):
+        """(name, store) for this call; Redis is re-resolved each time so an outage falls back to local."""
+        if self.backend == "off":
+            return "off", None
+        if self.backend in ("auto", "redis"):
+            conn = get_shared_redis()
+            if conn is not None:
+                return "redis", _RedisStore(conn, self.ttl)
+            if self.backend == "redis":
+                return "off", None
+        return "local", self._local
+
+    def embed(self, texts: List[str], model: str, dimensions: int,
+              compute: Callable[[List[str]], List[List[float]]]):
+        """
+        Embeddings for texts, calling compute only for texts not in the cache.
+
+        Identical texts within one call are embedded once. Cache failures are
+        logged and treated as misses, so ingestion never fails because of them.
+
+        Args:
+            texts: Chunk texts
+            model: Embedding model (part of the key)
+            dimensions: Embedding size (part of the key)
+            compute: Embeds a list of texts, in order
+
+        Returns:
+            (embeddings in text order, EmbeddingCacheStats)
+        """
+        name, store = self._store()
+        stats = EmbeddingCacheStats(backend=name, lookups=len(texts))
+        keys = [chunk_cache_key(model, dimensions, text) for text in texts]
+
+        cached: Dict[str, bytes] = {}
+        if store is not None and keys:
+            try:
+                cached = store.get_many(list(dict.fromkeys(keys)))
+            except Exception as e:
+                logger.warning(f"⚠️ Embedding cache lookup failed ({name}): {e}")
+                stats.errors += 1
+
+        vectors: Dict[str, List[float]] = {
+            key: np.frombuffer(raw, dtype=np.float32).tolist()
+            for key, raw in cached.items()
+            if len(raw) == dimensions * 4
+        }
+        stats.hits = sum(1 for key in keys if key in vectors)
+
+        # Embed each missing text once, even if it repeats within the file
+        missing_keys = []
+        missing_texts = []
+        seen = set(vectors)
+        for key, text in zip(keys, texts):
+            if key not in seen:
+                seen.add(key)
+                missing_keys.append(key)
+                missing_texts.append(text)
+        stats.duplicates = sum(1 for key in keys if key not in vectors) - len(missing_keys)
+
+        if missing_texts:
+            computed = compute(missing_texts)
+            vectors.update(zip(missing_keys, computed))
+            if store is not None:
+                try:
+                    store.put_many({
+                        key: np.asarray(embedding, dtype=np.float32).tobytes()
+                        for key, embedding in zip(missing_keys, computed)
+                    })
+                except Exception as e:
+                    logger.warning(f"⚠️ Embedding cache write failed ({name}): {e}")
+                    stats.errors += 1
+
+        if stats.hits:
+            logger.info(f"♻️ Embedding cache: {stats.hits}/{stats.lookups} chunks reused ({name})")
+        return [vectors[key] for key in keys], stats
+
+
+chunk_embedding_cache = ChunkEmbeddingCache()
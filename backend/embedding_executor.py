@@ -0,0 +1,238 @@
+"""
+Concurrent, rate-limit-aware embedding execution for ingestion.
+
+EmbeddingExecutor splits texts into batches sized by token count (and item
+count), runs up to EMBEDDING_CONCURRENCY of them at once and reassembles the
+results in input order. 429s, 5xxs, timeouts and connection errors are
+retried with full-jitter exponential backoff that never waits less than the
+provider's Retry-After. A rate limit also pauses every in-flight worker
+until the Retry-After has passed and halves the concurrency window, which
+then grows back by one per successful batch.
+
+A batch that still fails after EMBEDDING_MAX_RETRIES raises EmbeddingError.
+The executor never substitutes zero vectors, so a bad embedding can't be
+written to the graph silently.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, List, Optional, Tuple
+
+import openai
+
+from context_assembly import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Batches in flight at once (the window shrinks on 429s and recovers on success)
+EMBEDDING_CONCURRENCY = max(int(os.getenv("EMBEDDING_CONCURRENCY", "4")), 1)
+# Tokens per embeddings request (OpenAI allows 300k; smaller batches spread load across workers)
+EMBEDDING_MAX_BATCH_TOKENS = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "60000"))
+# Inputs per embeddings request (OpenAI allows 2048)
+EMBEDDING_MAX_BATCH_ITEMS = int(os.getenv("EMBEDDING_MAX_BATCH_ITEMS", "256"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+EMBEDDING_BACKOFF_BASE = float(os.getenv("EMBEDDING_BACKOFF_BASE", "1.0"))
+EMBEDDING_BACKOFF_MAX = float(os.getenv("EMBEDDING_BACKOFF_MAX", "60.0"))
+
+
+class EmbeddingError(Exception):
+    """Embedding a batch failed after retries (or returned malformed embeddings)."""
+
+
+def plan_batches(texts: List[str], max_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
+                 max_items: int = EMBEDDING_MAX_BATCH_ITEMS) -> List[Tuple[int, int]]:
+    """
+    Split texts into contiguous batches under a token and item budget.
+
+    A single text larger than max_tokens gets a batch of its own.
+
+    Returns:
+        (start, end) index ranges covering texts in order
+    """
+    batches = []
+    start = 0
+    tokens = 0
+    for i, text in enumerate(texts):
+        text_tokens = count_tokens(text)
+        if i > start and (tokens + text_tokens > max_tokens or i - start >= max_items):
+            batches.append((start, i))
+            start = i
+            tokens = 0
+        tokens += text_tokens
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Retry-After (or retry-after-ms) from a provider error's response headers, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        # HTTP-date Retry-After values fall back to exponential backoff
+        return None
+    return None
+
+
+def is_rate_limit(error: Exception) -> bool:
+    return isinstance(error, openai.RateLimitError) or getattr(error, "status_code", None) == 429
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors, timeouts and connection failures are worth retrying."""
+    if is_rate_limit(error):
+        return True
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and status >= 500
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None,
+                  base: float = EMBEDDING_BACKOFF_BASE, cap: float = EMBEDDING_BACKOFF_MAX) -> float:
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after) + random.uniform(0, base)
+    return delay
+
+
+class EmbeddingExecutor:
+    """Runs embedding batches concurrently under a shared, rate-limit-aware window."""
+
+    def __init__(self, create: Callable[[List[str], int], List[List[float]]],
+                 concurrency: int = EMBEDDING_CONCURRENCY,
+                 max_batch_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
+                 max_batch_items: int = EMBEDDING_MAX_BATCH_ITEMS,
+                 max_retries: int = EMBEDDING_MAX_RETRIES):
+        """
+        Args:
+            create: Embeds one batch: create(texts, dimensions) -> embeddings in input order
+            concurrency: Maximum batches in flight
+            max_batch_tokens: Token budget per batch
+            max_batch_items: Input count per batch
+            max_retries: Retries per batch before EmbeddingError
+        """
+        self.create = create
+        self.concurrency = concurrency
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._window = concurrency
+        self._paused_until = 0.0
+        self._stats = {"requests": 0, "retries": 0, "rate_limited": 0}
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "window": self._window, "concurrency": self.concurrency}
+
+    def _wait_for_pause(self):
+        while True:
+            with self._lock:
+                remaining = self._paused_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def _on_success(self):
+        with self._lock:
+            self._stats["requests"] += 1
+            self._window = min(self._window + 1, self.concurrency)
+
+    def _on_failure(self, error: Exception, delay: float):
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["retries"] += 1
+            if is_rate_limit(error):
+                self._stats["rate_limited"] += 1
+                self._window = max(self._window // 2, 1)
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    def _current_window(self) -> int:
+        with self._lock:
+            return self._window
+
+    def _embed_batch(self, texts: List[str], dimensions: int) -> List[List[float]]:
+        attempt = 0
+        while True:
+            self._wait_for_pause()
+            try:
+                embeddings = self.create(texts, dimensions)
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise EmbeddingError(f"Embedding batch of {len(texts)} failed after {attempt + 1} attempts: {e}") from e
+                delay = backoff_delay(attempt, retry_after_seconds(e))
+                self._on_failure(e, delay)
+                logger.warning(f"⏳ Embedding batch failed ({e.__class__.__name__}), retry {attempt + 1} in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._on_success()
+            if len(embeddings) != len(texts):
+                raise EmbeddingError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+            for embedding in embeddings:
+                if len(embedding) != dimensions:
+                    raise EmbeddingError(f"Embedding has {len(embedding)} dimensions, expected {dimensions}")
+                if not any(embedding):
+                    raise EmbeddingError("Provider returned an all-zero embedding")
+            return embeddings
+
+    def embed(self, texts: List[str], dimensions: int,
+              max_batch_items: Optional[int] = None) -> List[List[float]]:
+        """
+        Embed texts concurrently.
+
+        Args:
+            texts: Texts to embed
+            dimensions: Embedding size the create function returns
+            max_batch_items: Override for the per-batch input count
+
+        Returns:
+            Embeddings in the same order as texts
+
+        Raises:
+            EmbeddingError: A batch failed after retries
+        """
+        if not texts:
+            return []
+        batches = plan_batches(texts, self.max_batch_tokens, max_batch_items or self.max_batch_items)
+        results: List[Optional[List[List[float]]]] = [None] * len(batches)
+        if len(batches) == 1:
+            results[0] = self._embed_batch(texts, dimensions)
+            return results[0]
+
+        pending = list(enumerate(batches))
+        pending.reverse()
+        in_flight = {}
+        done_count = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed") as pool:
+            try:
+                while pending or in_flight:
+                    # Keep at most `window` batches in flight; the window shrinks on rate limits
+                    while pending and len(in_flight) < self._current_window():
+                        index, (start, end) = pending.pop()
+                        in_flight[pool.submit(self._embed_batch, texts[start:end], dimensions)] = index
+                    finished, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        index = in_flight.pop(future)
+                        results[index] = future.result()
+                        done_count += 1
+                    logger.info(f"📊 Embedded batch {done_count}/{len(batches)}")
+            except Exception:
+                for future in in_flight:
+                    future.cancel()
+                raise
+
+        return [embedding for batch in results for embedding in batch]
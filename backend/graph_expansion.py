@@ -0,0 +1,159 @@
+"""
+Graph-neighbourhood context expansion for retrieved chunks.
+
+Ingestion links chunks with NEXT (reading order) and AI-generated semantic
+relationships (EXPLAINS, SUPPORTS, ELABORATES, INTRODUCES, CONCLUDES, each
+with a confidence). After top-k selection, expand_with_neighbours pulls the
+1-2 hop neighbours of the winning chunks in one batched Cypher query, weights
+each neighbour by the seed's score times the type weight and confidence of
+every relationship on the path, and appends the best ones to the context
+until a token budget is spent.
+"""
+
+import os
+import logging
+from typing import Any, Dict, List, Optional
+
+from retrieval import scope_params
+from context_assembly import chunk_tokens
+
+logger = logging.getLogger(__name__)
+
+# Off by default; a question request's expand_graph (RetrievalEngine.retrieve(expand_graph=...)) overrides it
+GRAPH_EXPANSION_ENABLED = os.getenv("GRAPH_EXPANSION_ENABLED", "false").lower() == "true"
+GRAPH_EXPANSION_HOPS = min(max(int(os.getenv("GRAPH_EXPANSION_HOPS", "1")), 1), 2)
+GRAPH_EXPANSION_TOKEN_BUDGET = int(os.getenv("GRAPH_EXPANSION_TOKEN_BUDGET", "1500"))
+GRAPH_EXPANSION_MAX_NEIGHBOURS = int(os.getenv("GRAPH_EXPANSION_MAX_NEIGHBOURS", "6"))
+# Neighbours weighted below this are never added
+GRAPH_EXPANSION_MIN_WEIGHT = float(os.getenv("GRAPH_EXPANSION_MIN_WEIGHT", "0.2"))
+
+# How much a relationship of each type vouches for its neighbour (times its confidence)
+RELATIONSHIP_WEIGHTS = {
+    "EXPLAINS": 1.0,
+    "SUPPORTS": 0.9,
+    "ELABORATES": 0.85,
+    "INTRODUCES": 0.7,
+    "CONCLUDES": 0.7,
+    "NEXT": 0.6,
+}
+
+
+def fetch_neighbours(
+    session,
+    seeds: List[Dict[str, Any]],
+    chat_ids: List[str],
+    hops: int = GRAPH_EXPANSION_HOPS,
+    file_ids: Optional[List[str]] = None,
+    scope_where_clause: str = "",
+    limit: int = GRAPH_EXPANSION_MAX_NEIGHBOURS * 3
+) -> List[Dict[str, Any]]:
+    """
+    Best-weighted neighbours of the seed chunks, in one query.
+
+    Neighbours must belong to chat_ids and pass the same file and scope
+    filters as retrieval, so expansion never leaks chunks from other chats.
+
+    Args:
+        session: Open Neo4j session
+        seeds: Retrieved chunks (chunk_id, score)
+        chat_ids: Chats whose chunks may be added
+        hops: Path length, 1 or 2
+        file_ids: Optional Document ids to restrict to
+        scope_where_clause: Extra " AND c.x = ..." predicate (a ScopeClause from build_scope_clause)
+        limit: Maximum neighbours returned
+
+    Returns:
+        Chunk rows (with text) sorted by weight, each with expanded_from and relationships
+    """
+    if not seeds:
+        return []
+    hops = 2 if hops >= 2 else 1
+    query = f"""
+    UNWIND $seeds AS seed
+    MATCH (s:Chunk {{id: seed.id}})
+    MATCH path = (s)-[rels*1..{hops}]-(c:Chunk)
+    WHERE NOT c.id IN $seed_ids
+      AND all(r IN rels WHERE type(r) IN $types)
+      AND c.chatId IN $chat_ids{scope_where_clause}
+    WITH c, seed, rels,
+         reduce(weight = seed.score, r IN rels | weight * $type_weights[type(r)] * coalesce(r.confidence, 1.0)) AS weight
+    ORDER BY weight DESC
+    WITH c, collect({{seed: seed.id, weight: weight, types: [r IN rels | type(r)]}})[0] AS best
+    WHERE best.weight >= $min_weight
+    MATCH (d:Document)-[:HAS_CHUNK]->(c)
+    WHERE $file_ids IS NULL OR d.id IN $file_ids
+    RETURN c.id AS id, c.text AS text, c.tokenCount AS token_count, d.filename AS filename,
+           c.chatId AS source_chat, d.id AS doc_id, best.weight AS weight, best.seed AS seed, best.types AS types
+    ORDER BY weight DESC
+    LIMIT $limit
+    """
+    results = session.run(
+        query,
+        seeds=[{"id": seed["chunk_id"], "score": max(float(seed.get("score", 0.0)), 0.0)} for seed in seeds],
+        seed_ids=[seed["chunk_id"] for seed in seeds],
+        types=list(RELATIONSHIP_WEIGHTS),
+        type_weights=RELATIONSHIP_WEIGHTS,
+        chat_ids=chat_ids,
+        file_ids=file_ids,
+        min_weight=GRAPH_EXPANSION_MIN_WEIGHT,
+        limit=limit,
+        **scope_params(scope_where_clause)
+    )
+    return [
+        {
+            "chunk_id": record["id"],
+            "chunk_text": record["text"],
+            "token_count": record["token_count"],
+            "filename": record["filename"],
+            "source_chat": record["source_chat"],
+            "doc_id": record["doc_id"],
+            "score": float(record["weight"]),
+            "expanded_from": record["seed"],
+            "relationships": record["types"],
+        }
+        for record in results
+    ]
+
+
+def select_within_budget(neighbours: List[Dict[str, Any]], token_budget: int,
+                         max_neighbours: int = GRAPH_EXPANSION_MAX_NEIGHBOURS) -> List[Dict[str, Any]]:
+    """Greedily keep the highest-weighted neighbours whose text fits the token budget."""
+    selected = []
+    spent = 0
+    for neighbour in neighbours:
+        if len(selected) >= max_neighbours:
+            break
+        tokens = chunk_tokens(neighbour)
+        if spent + tokens > token_budget:
+            continue
+        selected.append(neighbour)
+        spent += tokens
+    return selected
+
+
+def expand_with_neighbours(
+    session,
+    chunks: List[Dict[str, Any]],
+    chat_ids: List[str],
+    file_ids: Optional[List[str]] = None,
+    scope_where_clause: str = "",
+    token_budget: int = GRAPH_EXPANSION_TOKEN_BUDGET,
+    hops: int = GRAPH_EXPANSION_HOPS
+) -> List[Dict[str, Any]]:
+    """
+    Append graph neighbours of the retrieved chunks under a token budget.
+
+    Returns:
+        The retrieved chunks followed by the selected neighbours (best first)
+    """
+    if not chunks or token_budget <= 0:
+        return chunks
+    try:
+        neighbours = fetch_neighbours(session, chunks, chat_ids, hops, file_ids, scope_where_clause)
+    except Exception as e:
+        logger.warning(f"⚠️ Graph expansion failed, using retrieved chunks only: {e}")
+        return chunks
+    selected = select_within_budget(neighbours, token_budget)
+    if selected:
+        logger.info(f"🕸️ Graph expansion added {len(selected)} of {len(neighbours)} neighbour chunks")
+    return chunks + selected
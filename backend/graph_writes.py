@@ -0,0 +1,297 @@
+"""
+Batched Neo4j writes for document ingestion.
+
+Chunks (with their HAS_CHUNK edge), NEXT links and AI-generated relationships
+are written with `UNWIND $rows` statements of INGEST_WRITE_BATCH_SIZE rows,
+so a 5,000-chunk document costs a handful of round trips instead of one (or
+two) per chunk and per relationship. The functions take a transaction (or
+session) and are used from both ingestion paths inside execute_write.
+
+Chunks carry a contentHash so a replaced document can be re-ingested
+incrementally: diff_chunks matches the new chunks against the stored ones
+and apply_chunk_diff writes only what changed.
+"""
+
+import os
+import hashlib
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Tuple
+
+from graph_expansion import RELATIONSHIP_WEIGHTS
+
+logger = logging.getLogger(__name__)
+
+# Rows per UNWIND statement (larger batches mean fewer round trips but bigger messages)
+INGEST_WRITE_BATCH_SIZE = int(os.getenv("INGEST_WRITE_BATCH_SIZE", "500"))
+
+# Relationship types written from analyze_chunk_relationships output; anything
+# else is dropped because relationship types cannot be passed as parameters
+RELATIONSHIP_TYPES = tuple(RELATIONSHIP_WEIGHTS)
+
+
+def chunk_content_hash(text: str) -> str:
+    """sha256 of a chunk's text, stored as Chunk.contentHash."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _batches(rows: List[Dict[str, Any]], batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch_size = max(int(batch_size), 1)
+    for start in range(0, len(rows), batch_size):
+        yield rows[start:start + batch_size]
+
+
+def write_chunks(tx, doc_id: str, chat_id: str, rows: List[Dict[str, Any]], labels: str,
+                 scope_props_create: str = "", scope_params: Dict[str, Any] = None,
+                 batch_size: int = INGEST_WRITE_BATCH_SIZE) -> int:
+    """
+    Create a document's Chunk nodes and HAS_CHUNK edges in UNWIND batches.
+
+    Args:
+        tx: Transaction or session
+        doc_id: Document id (the Document node must exist)
+        chat_id: Chat the chunks belong to
+        rows: One dict per chunk: chunk_id, text, embedding, embedding_blob,
+            embedding_encoding, embedding_norm, token_count, content_hash, order
+        labels: Cypher labels from chunk_labels()
+        scope_props_create: ", key: $scope_key" fragment from build_scope_properties
+        scope_params: Values for scope_props_create (shared by every chunk)
+        batch_size: Rows per statement
+
+    Returns:
+        Number of chunks created
+    """
+    query = f"""
+    MATCH (d:Document {{id: $doc_id}})
+    UNWIND $rows AS row
+    CREATE (c:{labels} {{
+        id: row.chunk_id,
+        text: row.text,
+        embedding: row.embedding,
+        embeddingBlob: row.embedding_blob,
+        embeddingEncoding: row.embedding_encoding,
+        embeddingNorm: row.embedding_norm,
+        tokenCount: row.token_count,
+        contentHash: row.content_hash,
+        chatId: $chat_id{scope_props_create}
+    }})
+    CREATE (d)-[:HAS_CHUNK {{order: row.order}}]->(c)
+    RETURN count(c) AS created
+    """
+    created = 0
+    for batch in _batches(rows, batch_size):
+        record = tx.run(query, doc_id=doc_id, chat_id=chat_id, rows=batch, **(scope_params or {})).single()
+        created += record["created"] if record else 0
+    return created
+
+
+def write_next_links(tx, chunk_ids: List[str], batch_size: int = INGEST_WRITE_BATCH_SIZE) -> int:
+    """
+    Link consecutive chunks with NEXT {order} edges in UNWIND batches.
+
+    Returns:
+        Number of NEXT edges created
+    """
+    rows = [
+        {"source": chunk_ids[i], "target": chunk_ids[i + 1], "order": i}
+        for i in range(len(chunk_ids) - 1)
+    ]
+    query = """
+    UNWIND $rows AS row
+    MATCH (c1:Chunk {id: row.source})
+    MATCH (c2:Chunk {id: row.target})
+    CREATE (c1)-[:NEXT {order: row.order}]->(c2)
+    RETURN count(*) AS created
+    """
+    created = 0
+    for batch in _batches(rows, batch_size):
+        record = tx.run(query, rows=batch).single()
+        created += record["created"] if record else 0
+    return created
+
+
+def write_relationships(tx, doc_id: str, relationships: List[Dict[str, Any]],
+                        batch_size: int = INGEST_WRITE_BATCH_SIZE) -> int:
+    """
+    Create AI-generated chunk relationships, one UNWIND statement per type and batch.
+
+    Relationships whose chunks don't exist are skipped by the MATCH (no
+    separate existence check), and unknown types are dropped.
+
+    Args:
+        tx: Transaction or session
+        doc_id: Document whose chunks ({doc_id}-{index}) are linked
+        relationships: analyze_chunk_relationships output (source, target, type, description, confidence)
+
+    Returns:
+        Number of relationships created
+    """
+    by_type: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for rel in relationships:
+        rel_type = rel.get("type")
+        if rel_type not in RELATIONSHIP_TYPES:
+            logger.warning(f"⚠️ Skipping relationship with unknown type {rel_type!r}")
+            continue
+        by_type[rel_type].append({
+            "source": f"{doc_id}-{rel['source']}",
+            "target": f"{doc_id}-{rel['target']}",
+            "description": rel.get("description", ""),
+            "confidence": float(rel.get("confidence", 0.0)),
+        })
+
+    created = 0
+    for rel_type, rows in by_type.items():
+        query = f"""
+        UNWIND $rows AS row
+        MATCH (c1:Chunk {{id: row.source}})
+        MATCH (c2:Chunk {{id: row.target}})
+        CREATE (c1)-[:{rel_type} {{
+            description: row.description,
+            confidence: row.confidence,
+            ai_generated: true
+        }}]->(c2)
+        RETURN count(*) AS created
+        """
+        for batch in _batches(rows, batch_size):
+            record = tx.run(query, rows=batch).single()
+            created += record["created"] if record else 0
+    return created
+
+
+@dataclass
+class ChunkDiff:
+    """How a document's stored chunks map onto its re-chunked text."""
+    kept: List[Tuple[str, int]] = field(default_factory=list)
+    added: List[int] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    order: List[str] = field(default_factory=list)
+
+    def stats(self) -> Dict[str, int]:
+        return {"kept": len(self.kept), "added": len(self.added), "removed": len(self.removed)}
+
+
+def fetch_document_chunks(session, doc_id: str) -> Tuple[List[Dict[str, Any]], Any]:
+    """
+    Stored chunks of a document with their content hashes, in order.
+
+    Chunks written before contentHash existed are hashed from their text.
+
+    Returns:
+        (chunks with chunk_id, content_hash and order, the document's embeddingDimensions)
+        or ([], None) when the document doesn't exist
+    """
+    records = list(session.run(
+        """
+        MATCH (d:Document {id: $doc_id})
+        OPTIONAL MATCH (d)-[h:HAS_CHUNK]->(c:Chunk)
+        RETURN d.embeddingDimensions AS dimensions, c.id AS chunk_id, h.order AS order,
+               c.contentHash AS content_hash, CASE WHEN c.contentHash IS NULL THEN c.text END AS text
+        ORDER BY h.order
+        """,
+        doc_id=doc_id
+    ))
+    if not records:
+        return [], None
+    chunks = [
+        {
+            "chunk_id": record["chunk_id"],
+            "order": record["order"],
+            "content_hash": record["content_hash"] or chunk_content_hash(record["text"] or ""),
+        }
+        for record in records
+        if record["chunk_id"] is not None
+    ]
+    return chunks, records[0]["dimensions"]
+
+
+def diff_chunks(existing: List[Dict[str, Any]], texts: List[str], new_chunk_id) -> ChunkDiff:
+    """
+    Match re-chunked text against a document's stored chunks by content hash.
+
+    Each stored chunk is reused at most once (repeated text pairs up in
+    order); new text gets a chunk id from new_chunk_id(index), and stored
+    chunks left unmatched are removed.
+
+    Args:
+        existing: fetch_document_chunks output
+        texts: The document's new chunk texts, in order
+        new_chunk_id: Callable giving the id for a new chunk at an index
+
+    Returns:
+        ChunkDiff with order holding the final chunk ids in reading order
+    """
+    available: Dict[str, List[str]] = defaultdict(list)
+    for chunk in existing:
+        available[chunk["content_hash"]].append(chunk["chunk_id"])
+
+    diff = ChunkDiff()
+    for i, text in enumerate(texts):
+        candidates = available.get(chunk_content_hash(text))
+        if candidates:
+            chunk_id = candidates.pop(0)
+            diff.kept.append((chunk_id, i))
+        else:
+            chunk_id = new_chunk_id(i)
+            diff.added.append(i)
+        diff.order.append(chunk_id)
+    diff.removed = [chunk_id for ids in available.values() for chunk_id in ids]
+    return diff
+
+
+def apply_chunk_diff(tx, doc_id: str, chat_id: str, diff: ChunkDiff, added_rows: List[Dict[str, Any]],
+                     labels: str, scope_props_create: str = "", scope_params: Dict[str, Any] = None,
+                     scope_props_update: str = "", batch_size: int = INGEST_WRITE_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Patch a document's chunks in one transaction: delete removed chunks,
+    renumber kept ones, create added ones and relink the NEXT chain.
+
+    Args:
+        tx: Transaction (run inside execute_write so the patch is atomic)
+        doc_id: Document being replaced
+        chat_id: Its chat
+        diff: diff_chunks output
+        added_rows: write_chunks rows for diff.added
+        labels: Cypher labels from chunk_labels()
+        scope_props_create: Scope properties for new chunks (see write_chunks)
+        scope_params: Scope values
+        scope_props_update: ", c.key = $scope_key" fragment so kept chunks take the new scope values
+
+    Returns:
+        Counts of removed, renumbered, created chunks and NEXT links
+    """
+    scope_params = scope_params or {}
+    for batch in _batches([{"chunk_id": chunk_id} for chunk_id in diff.removed], batch_size):
+        tx.run(
+            """
+            UNWIND $rows AS row
+            MATCH (:Document {id: $doc_id})-[:HAS_CHUNK]->(c:Chunk {id: row.chunk_id})
+            DETACH DELETE c
+            """,
+            doc_id=doc_id, rows=batch
+        ).consume()
+
+    kept_rows = [{"chunk_id": chunk_id, "order": order} for chunk_id, order in diff.kept]
+    for batch in _batches(kept_rows, batch_size):
+        tx.run(
+            f"""
+            UNWIND $rows AS row
+            MATCH (:Document {{id: $doc_id}})-[h:HAS_CHUNK]->(c:Chunk {{id: row.chunk_id}})
+            SET h.order = row.order{scope_props_update}
+            """,
+            doc_id=doc_id, rows=batch, **scope_params
+        ).consume()
+
+    created = write_chunks(tx, doc_id, chat_id, added_rows, labels, scope_props_create, scope_params, batch_size)
+
+    # The chain is rebuilt rather than patched: kept chunks may have new neighbours
+    tx.run(
+        """
+        MATCH (:Document {id: $doc_id})-[:HAS_CHUNK]->(c:Chunk)-[r:NEXT]->(:Chunk)
+        DELETE r
+        """,
+        doc_id=doc_id
+    ).consume()
+    links = write_next_links(tx, diff.order, batch_size)
+
+    return {"removed": len(diff.removed), "renumbered": len(diff.kept), "created": created, "next_links": links}
@@ -0,0 +1,212 @@
+"""
+Stage-pipelined ingestion: chunking, embedding and Neo4j writes overlap.
+
+run_ingest_pipeline feeds chunks in groups of INGEST_PIPELINE_GROUP_SIZE
+through bounded queues to INGEST_PIPELINE_EMBED_WORKERS embedding threads
+and one writer thread. While one group is being written the next ones are
+being embedded, so end-to-end time approaches that of the slowest stage. At
+most INGEST_PIPELINE_QUEUE_SIZE groups wait between stages, so the embeddings
+held at once depend on the group size rather than on the file size. The chunk
+texts are only as lazy as the chunks iterable: process_file_job passes
+chunking.iter_chunks over blob_store.iter_text_lines, so for a stored text
+chunking is the first stage and peak memory stays flat as the file grows.
+Text extraction itself happens in the API before the job is enqueued and
+is not a stage.
+
+Groups may be written out of order; each row carries its absolute order, and
+callers link NEXT edges once every group is written. The first failure in any
+stage stops the others and is re-raised from run_ingest_pipeline; groups
+already written stay written, so callers clean up (process_file_job deletes
+the partial document).
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Chunks per pipeline group (one embedding call set and one write transaction)
+INGEST_PIPELINE_GROUP_SIZE = int(os.getenv("INGEST_PIPELINE_GROUP_SIZE", "128"))
+# Groups allowed to wait between two stages
+INGEST_PIPELINE_QUEUE_SIZE = int(os.getenv("INGEST_PIPELINE_QUEUE_SIZE", "2"))
+# Groups embedded at once (each may itself use several concurrent API batches)
+INGEST_PIPELINE_EMBED_WORKERS = int(os.getenv("INGEST_PIPELINE_EMBED_WORKERS", "2"))
+
+_DONE = object()
+
+# Counters summed across groups (hit_rate is recomputed from them)
+_CACHE_COUNTERS = ("lookups", "hits", "misses", "duplicates_in_file", "errors")
+
+
+@dataclass
+class PipelineResult:
+    """What the pipeline wrote and where its time went."""
+    chunks: int = 0
+    written: int = 0
+    groups: int = 0
+    embedding_cache: Dict[str, Any] = field(default_factory=dict)
+    stage_seconds: Dict[str, float] = field(default_factory=dict)
+
+    def merge_cache_stats(self, stats: Dict[str, Any]):
+        if not stats:
+            return
+        merged = self.embedding_cache
+        merged.setdefault("backend", stats.get("backend"))
+        for key in _CACHE_COUNTERS:
+            merged[key] = merged.get(key, 0) + stats.get(key, 0)
+        merged["hit_rate"] = round(merged["hits"] / merged["lookups"], 4) if merged["lookups"] else 0.0
+
+
+def _group(chunks: Iterable[str], size: int) -> Iterable[Tuple[int, List[str]]]:
+    start = 0
+    group: List[str] = []
+    for chunk in chunks:
+        group.append(chunk)
+        if len(group) >= size:
+            yield start, group
+            start += len(group)
+            group = []
+    if group:
+        yield start, group
+
+
+def run_ingest_pipeline(
+    chunks: Iterable[str],
+    embed: Callable[[List[str]], Tuple[List[List[float]], Dict[str, Any]]],
+    write: Callable[[int, List[str], List[List[float]]], int],
+    group_size: int = INGEST_PIPELINE_GROUP_SIZE,
+    embed_workers: int = INGEST_PIPELINE_EMBED_WORKERS,
+    queue_size: int = INGEST_PIPELINE_QUEUE_SIZE,
+    on_progress: Optional[Callable[[int], None]] = None
+) -> PipelineResult:
+    """
+    Chunk, embed and write a document as overlapping stages.
+
+    Args:
+        chunks: Chunk texts in order (a generator keeps chunking lazy)
+        embed: Embeds one group: embed(texts) -> (embeddings, cache stats dict)
+        write: Writes one group: write(start_order, texts, embeddings) -> chunks written
+        group_size: Chunks per group
+        embed_workers: Groups embedded concurrently
+        queue_size: Groups buffered between stages
+        on_progress: Called with the running count of written chunks
+
+    Returns:
+        PipelineResult
+
+    Raises:
+        The first exception raised by any stage
+    """
+    embed_queue: queue.Queue = queue.Queue(maxsize=max(queue_size, 1))
+    write_queue: queue.Queue = queue.Queue(maxsize=max(queue_size, 1))
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    result = PipelineResult()
+    lock = threading.Lock()
+    busy = {"chunk": 0.0, "embed": 0.0, "write": 0.0}
+
+    def put(target: queue.Queue, item) -> bool:
+        # Bounded put that gives up once another stage has failed
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(source: queue.Queue):
+        while not stop.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def fail(error: BaseException):
+        with lock:
+            errors.append(error)
+        stop.set()
+
+    def chunk_stage():
+        try:
+            iterator = iter(_group(chunks, max(group_size, 1)))
+            while True:
+                started = time.perf_counter()
+                item = next(iterator, None)
+                busy["chunk"] += time.perf_counter() - started
+                if item is None or not put(embed_queue, item):
+                    break
+                with lock:
+                    result.chunks += len(item[1])
+                    result.groups += 1
+        except BaseException as e:
+            fail(e)
+        finally:
+            for _ in range(embed_workers):
+                put(embed_queue, _DONE)
+
+    def embed_stage():
+        try:
+            while True:
+                item = get(embed_queue)
+                if item is _DONE:
+                    break
+                start, texts = item
+                started = time.perf_counter()
+                embeddings, cache_stats = embed(texts)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    busy["embed"] += elapsed
+                    result.merge_cache_stats(cache_stats)
+                if not put(write_queue, (start, texts, embeddings)):
+                    break
+        except BaseException as e:
+            fail(e)
+        finally:
+            put(write_queue, _DONE)
+
+    def write_stage():
+        finished_embedders = 0
+        try:
+            while finished_embedders < embed_workers:
+                item = get(write_queue)
+                if item is _DONE:
+                    if stop.is_set():
+                        break
+                    finished_embedders += 1
+                    continue
+                start, texts, embeddings = item
+                started = time.perf_counter()
+                written = write(start, texts, embeddings)
+                busy["write"] += time.perf_counter() - started
+                result.written += written
+                if on_progress is not None:
+                    on_progress(result.written)
+        except BaseException as e:
+            fail(e)
+
+    embed_workers = max(embed_workers, 1)
+    started = time.perf_counter()
+    threads = [threading.Thread(target=chunk_stage, name="ingest-chunk", daemon=True)]
+    threads += [
+        threading.Thread(target=embed_stage, name=f"ingest-embed-{i}", daemon=True) for i in range(embed_workers)
+    ]
+    threads.append(threading.Thread(target=write_stage, name="ingest-write", daemon=True))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    result.stage_seconds = {stage: round(seconds, 3) for stage, seconds in busy.items()}
+    result.stage_seconds["total"] = round(time.perf_counter() - started, 3)
+    logger.info(f"🚰 Ingest pipeline wrote {result.written} chunks in {result.groups} groups: {result.stage_seconds}")
+    return result
@@ -13,7 +13,6 @@ from pydantic import BaseModel
 from typing import List, Optional, Union, Dict, Any
 import openai
 from openai import OpenAI
-import numpy as np
 from neo4j import GraphDatabase
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
@@ -44,6 +43,13 @@ def merge_settings_with_overrides(chat_id: str, published_settings: dict) -> dic
         "temperature": "temperature",
         "maxTokens": "maxTokens",
         "selectedModel": "selectedModel",
+        "answerCacheEnabled": "answerCacheEnabled",
+        "answerCacheThreshold": "answerCacheThreshold",
+        "answerCacheTtlSeconds": "answerCacheTtlSeconds",
+        "embeddingDimensions": "embeddingDimensions",
+        "mmrEnabled": "mmrEnabled",
+        "mmrLambda": "mmrLambda",
+        "mmrCandidatePool": "mmrCandidatePool",
     }
     for o_key, p_key in key_map.items():
         if o_key in overrides:
@@ -55,6 +61,35 @@ from sanitization import (
     SanitizedChatId, SanitizedApiKey, sanitize_request_data,
     sanitize_with_xss_detection, detect_xss, sanitize_filename
 )
+from retrieval import (
+    ensure_vector_index, ensure_fulltext_indexes, bump_chat_version, set_redis_provider,
+    set_embedding_provider, normalize_embeddings, backfill_normalized_embeddings,
+    chunk_embedding_params, migrate_embedding_storage, EMBEDDING_ENCODINGS, EMBEDDING_STORAGE,
+    EMBEDDING_STORE_LIST, EMBEDDING_DIMENSIONS, SUPPORTED_EMBEDDING_DIMENSIONS, chunk_labels,
+    get_chat_target_dimensions, set_chat_target_dimensions, sync_chat_ann_index,
+    chat_chunks_deleted, chat_deleted,
+    question_embedding_cache, embedding_matrix_cache, build_scope_clause, ensure_scope_index,
+    drop_scope_index, shared_tier_cache, mmr_policy, RETRIEVAL_CANDIDATE_POOL, MMR_MAX_CANDIDATE_POOL,
+    BOOST_SIMPLE
+)
+from retrieval_engine import RetrievalEngine
+from context_assembly import (
+    count_tokens, context_token_budget, assemble_context, CONTEXT_MAX_CHUNKS
+)
+from ann_index import ann_index_cache
+from embedding_executor import EmbeddingExecutor, EmbeddingError
+from embedding_cache import chunk_embedding_cache
+from ingest_pipeline import run_ingest_pipeline
+from chunking import split_text, iter_chunks, CHUNK_TARGET_TOKENS, CHUNK_OVERLAP_TOKENS
+from blob_store import put_text, read_text, iter_text_lines, delete_text, is_text_ref, BLOB_STORE_ENABLED
+from graph_writes import (
+    write_chunks, write_next_links, write_relationships, chunk_content_hash, fetch_document_chunks,
+    diff_chunks, apply_chunk_diff, INGEST_WRITE_BATCH_SIZE
+)
+from answer_cache import (
+    semantic_answer_cache, answer_cache_policy, settings_fingerprint,
+    ANSWER_CACHE_CREDIT_MULTIPLIER
+)
 
 # ==============================================================================
 # Redis Queue Setup for Background File Processing
@@ -127,6 +162,9 @@ def get_file_queue():
         return file_queue
     return None
 
+# Chat content versions (embedding matrix cache invalidation) are shared through Redis
+set_redis_provider(get_redis_connection)
+
 # Secure Privacy-First API Models
 class AppAuthorizationRequest(BaseModel):
     end_user_id: str
@@ -175,6 +213,7 @@ class ChunkScore(BaseModel):
 class AnswerWithContext(BaseModel):
     answer: str = ""
     context: List[ChunkScore] = []
+    context_usage: Optional[Dict[str, Any]] = None  # Chunks / tokens used by token-budgeted context assembly
 
 class QuestionRequest(BaseModel):
     question: str
@@ -185,6 +224,7 @@ class QuestionRequest(BaseModel):
     max_tokens: Optional[int] = 1000  # Default max tokens
     scope_filters: Optional[Dict[str, Union[str, int, bool]]] = {}  # Optional scope filters
     unhinged_mode: Optional[bool] = False  # Use Grok's unhinged AI model
+    expand_graph: Optional[bool] = None  # Add graph neighbours of retrieved chunks (None = GRAPH_EXPANSION_ENABLED)
 
 class CreateNodesAndEmbeddingsRequest(BaseModel):
     pdf_text: str
@@ -192,6 +232,7 @@ class CreateNodesAndEmbeddingsRequest(BaseModel):
     chat_id: str
     filename: str
     scope_values: Optional[Dict[str, Union[str, int, bool]]] = {}
+    replace: Optional[bool] = False  # Incrementally re-ingest the existing document pdf_id
 
 # API Models for external access
 class ApiQuestionRequest(BaseModel):
@@ -202,12 +243,17 @@ class ApiQuestionRequest(BaseModel):
     max_tokens: Optional[int] = None      # Will use chat's saved max_tokens if not provided
     scope_filters: Optional[Dict[str, Union[str, int, bool]]] = {}  # Optional scope filters
 
+class ApiBatchQuestionRequest(BaseModel):
+    questions: List[str]
+    stream: bool = False  # True returns NDJSON, one line per answer as it completes
+
 class ApiAnswerResponse(BaseModel):
     answer: str
     context: List[ChunkScore]
     chat_id: str
     model: str
     usage: dict
+    cached: bool = False
 
 
 class ChatSettingsUpdateRequest(BaseModel):
@@ -215,6 +261,13 @@ class ChatSettingsUpdateRequest(BaseModel):
     temperature: Optional[float] = None
     max_tokens: Optional[int] = None
     selected_model: Optional[str] = None
+    answer_cache_enabled: Optional[bool] = None  # Opt-in semantic answer cache
+    answer_cache_threshold: Optional[float] = None  # Cosine similarity needed for a hit
+    answer_cache_ttl_seconds: Optional[int] = None
+    embedding_dimensions: Optional[int] = None  # 256/512/1024/1536; existing documents are re-embedded in the background
+    mmr_enabled: Optional[bool] = None  # Diversity re-ranking of retrieved chunks
+    mmr_lambda: Optional[float] = None  # 1.0 = pure relevance, 0.0 = pure diversity
+    mmr_candidate_pool: Optional[int] = None  # Candidates MMR chooses the top-k from
 
 # ==============================================================================
 # Custom Scoping System
@@ -271,17 +324,6 @@ def validate_scope_value(value: Union[str, int, bool], scope_type: str) -> bool:
         return isinstance(value, bool)
     return False
 
-def sanitize_scope_value(value: Union[str, int, bool]) -> str:
-    """Sanitize scope value for Neo4j query"""
-    if isinstance(value, str):
-        # Sanitize string values for Neo4j
-        safe_value = value.replace('\\', '\\\\').replace("'", "\\'").replace('"', '\\"')
-        return f"'{safe_value}'"
-    elif isinstance(value, bool):
-        return "true" if value else "false"
-    else:
-        return str(value)
-
 def build_scope_properties(scope_values: Dict[str, Union[str, int, bool]],
                           scope_config: Optional[AppScopeConfig] = None,
                           node_var: str = None,
@@ -337,11 +379,11 @@ def build_scope_properties(scope_values: Dict[str, Union[str, int, bool]],
 def build_scope_where_clause(scope_filters: Dict[str, Union[str, int, bool]],
                              node_var: str = "c",
                              scope_config: Optional[AppScopeConfig] = None) -> str:
-    """Build WHERE clause for scope filtering"""
+    """Build WHERE clause for scope filtering (values are passed as query parameters, see ScopeClause)"""
     if not scope_filters:
         return ""
 
-    conditions = []
+    valid_filters = {}
     for key, value in scope_filters.items():
         if not validate_scope_name(key):
             continue
@@ -352,10 +394,9 @@ def build_scope_where_clause(scope_filters: Dict[str, Union[str, int, bool]],
             if scope_def and not validate_scope_value(value, scope_def.type):
                 continue
 
-        sanitized_value = sanitize_scope_value(value)
-        conditions.append(f"{node_var}.{key} = {sanitized_value}")
+        valid_filters[key] = value
 
-    return " AND " + " AND ".join(conditions) if conditions else ""
+    return build_scope_clause(valid_filters, node_var)
 
 async def get_scope_config(chat_id: str) -> Optional[AppScopeConfig]:
     """Get scope configuration for a chat from Convex"""
@@ -2059,6 +2100,57 @@ async def consume_credits_for_actual_usage(
     logger.info(f"💳 Consumed {actual_credits} credits for {total_actual_tokens} actual tokens ({model})")
     return actual_credits
 
+async def consume_credits_for_cached_answer(
+    user_id: str,
+    model: str,
+    question: str,
+    response: str,
+    chat_id: str = None,
+    skip_developer_lookup: bool = False
+) -> float:
+    """
+    Consume credits for an answer served from the semantic answer cache.
+
+    Metered separately from LLM answers: same token estimate, scaled by
+    ANSWER_CACHE_CREDIT_MULTIPLIER and recorded with a "Cached answer" description.
+
+    Args:
+        user_id: User ID to charge credits from
+        model: Model the cached answer was generated with
+        question: User's question
+        response: Cached answer
+        chat_id: Optional chat ID for logging
+        skip_developer_lookup: If True, use user_id directly without developer lookup (for API calls)
+    """
+    import math
+    total_tokens = math.ceil(len(question) / 4) + math.ceil(len(response) / 4)
+    cached_credits = (total_tokens / 1000) * MODEL_MULTIPLIERS.get(model, 1) * ANSWER_CACHE_CREDIT_MULTIPLIER
+
+    actual_user_id = user_id
+    if chat_id and not skip_developer_lookup:
+        developer_id = await get_developer_id_from_chat(chat_id)
+        if developer_id != chat_id:
+            actual_user_id = developer_id
+
+    success = await consume_user_credits(
+        actual_user_id,
+        cached_credits,
+        model,
+        total_tokens,
+        chat_id,
+        f"Cached answer ({model}) - {total_tokens} tokens (chat: {chat_id})"
+    )
+
+    if not success:
+        credit_info = await check_user_credits(actual_user_id, cached_credits)
+        if not credit_info["has_sufficient"]:
+            raise InsufficientCreditsError(cached_credits, credit_info["remaining"])
+        else:
+            raise Exception("Failed to consume credits for unknown reason")
+
+    logger.info(f"💳 Consumed {cached_credits} credits for cached answer ({model})")
+    return cached_credits
+
 async def ensure_developer_has_credits(developer_user_id: str, min_credits: int = 1000):
     """Ensure developer has credits, initialize with default amount if needed"""
     try:
@@ -2112,97 +2204,135 @@ def sanitize_for_neo4j(text: str) -> str:
     safe_text = safe_text.replace('\r', '\\r')
     return safe_text
 
-def chunk_text(full_text: str, max_chars: int = 2000) -> List[str]:
+def chunk_text(full_text: str, target_tokens: int = CHUNK_TARGET_TOKENS,
+               overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
     """
     Chunk text into pieces for embedding.
 
-    PERFORMANCE OPTIMIZATION: Increased from 500 to 2000 chars.
-    This reduces thousands of embedding calls to hundreds for large files.
+    PERFORMANCE OPTIMIZATION: One linear pass (see chunking.iter_chunks) that
+    targets a token count instead of 2000 raw characters, breaks at
+    paragraphs, Markdown headings, code fences and sentence ends, and can
+    overlap consecutive chunks.
 
     Args:
         full_text: The full text to chunk
-        max_chars: Maximum characters per chunk (default 2000, was 500)
+        target_tokens: Maximum tokens per chunk (default CHUNK_TARGET_TOKENS, ~2000 chars)
+        overlap_tokens: Tokens repeated from the end of each chunk (default CHUNK_OVERLAP_TOKENS)
 
     Returns:
-        List of text chunks
-    """
-    chunks = []
-    start = 0
-    while start < len(full_text):
-        end = start + max_chars
-        if end > len(full_text):
-            chunks.append(full_text[start:])
-            break
-
-        # Try to break at sentence boundary for better semantic coherence
-        # Look back up to 200 chars for a period, question mark, or exclamation
-        if end < len(full_text):
-            best_break = end
-            for i in range(end, max(start + max_chars - 200, start), -1):
-                if full_text[i-1] in '.!?\n':
-                    best_break = i
-                    break
-            end = best_break
+        List of text chunks (empty for whitespace-only text, which callers reject)
+    """
+    return split_text(full_text, target_tokens, overlap_tokens)
 
-        chunks.append(full_text[start:end])
-        start = end
-    return chunks
+EMBEDDING_MODEL = "text-embedding-3-small"
 
-def get_embedding(text: str) -> List[float]:
-    """Get embedding for a single text. Use get_embeddings_batch for multiple texts."""
+def _create_embedding(text: str) -> List[float]:
     response = openai.embeddings.create(
-        model="text-embedding-3-small",
+        model=EMBEDDING_MODEL,
         input=text
     )
     return response.data[0].embedding
 
-def get_embeddings_batch(texts: List[str], batch_size: int = 32) -> List[List[float]]:
+def get_embedding(text: str) -> List[float]:
+    """
+    Get embedding for a single text. Use get_embeddings_batch for multiple texts.
+
+    Served from the two-tier question embedding cache (in-process LRU, then
+    Redis) when the same normalized text was embedded before.
+    """
+    return question_embedding_cache.get_or_compute(EMBEDDING_MODEL, text, _create_embedding)
+
+# Keyword-only retrieval embeds the question lazily if the full-text index finds nothing
+set_embedding_provider(get_embedding)
+
+async def build_scope_clause_for_chat(chat_id: str, scope_filters: Dict[str, Any]) -> str:
+    """Scope predicate for a chat's chunks, validated against its scope configuration."""
+    scope_config = await get_scope_config(chat_id)
+    return build_scope_where_clause(scope_filters, "c", scope_config)
+
+# Shared retrieval hot path for every question-answering endpoint (one long-lived driver)
+retrieval_engine = RetrievalEngine(
+    driver_factory=lambda: GraphDatabase.driver(neo4j_uri, auth=(neo4j_user, neo4j_password)),
+    embed=get_embedding,
+    parent_chat_resolver=get_parent_chat_id_from_app,
+    scope_clause_builder=build_scope_clause_for_chat
+)
+
+@app.on_event("shutdown")
+def close_retrieval_engine():
+    retrieval_engine.close()
+
+def get_question_embeddings(questions: List[str]) -> List[List[float]]:
+    """
+    Embeddings for many questions: cache hits first, one batched API call for the rest.
+
+    Returns:
+        Full-size embeddings in question order
+    """
+    embeddings: List[Optional[List[float]]] = [
+        question_embedding_cache.get(EMBEDDING_MODEL, question) for question in questions
+    ]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        computed = get_embeddings_batch([questions[i] for i in missing], batch_size=max(len(missing), 1))
+        for i, embedding in zip(missing, computed):
+            embeddings[i] = embedding
+            question_embedding_cache.put(EMBEDDING_MODEL, questions[i], embedding)
+    return embeddings
+
+_embedding_client = None
+
+def _create_embeddings(texts: List[str], dimensions: int) -> List[List[float]]:
+    """One embeddings API call (no client-side retries: embedding_executor owns those)."""
+    global _embedding_client
+    if _embedding_client is None:
+        _embedding_client = openai.OpenAI(api_key=openai.api_key or os.getenv("OPENAI_API_KEY"), max_retries=0)
+    request = {"model": EMBEDDING_MODEL, "input": texts}
+    if dimensions != EMBEDDING_DIMENSIONS:
+        request["dimensions"] = dimensions
+    response = _embedding_client.embeddings.create(**request)
+    # Embeddings come back in order
+    return [item.embedding for item in response.data]
+
+# Shared by ingestion, re-embedding and batch questions so rate-limit back-off applies process-wide
+embedding_executor = EmbeddingExecutor(_create_embeddings)
+
+def get_embeddings_batch(texts: List[str], batch_size: Optional[int] = None,
+                         dimensions: int = EMBEDDING_DIMENSIONS) -> List[List[float]]:
     """
-    Get embeddings for multiple texts in batches.
+    Get embeddings for multiple texts in concurrent batches.
 
-    PERFORMANCE OPTIMIZATION: Batches embedding calls instead of one-by-one.
-    Reduces API overhead dramatically - e.g., 1000 chunks becomes ~32 API calls
-    instead of 1000.
+    PERFORMANCE OPTIMIZATION: Batches are sized by token count and up to
+    EMBEDDING_CONCURRENCY run at once, retrying 429s and 5xxs with
+    Retry-After-aware backoff (see embedding_executor).
 
     Args:
         texts: List of texts to embed
-        batch_size: Number of texts per API call (default 32, max ~100 for OpenAI)
+        batch_size: Optional cap on texts per API call (default EMBEDDING_MAX_BATCH_ITEMS)
+        dimensions: Embedding size; smaller sizes use the model's native shortening
 
     Returns:
         List of embeddings in the same order as input texts
-    """
-    all_embeddings = []
 
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i + batch_size]
-        try:
-            response = openai.embeddings.create(
-                model="text-embedding-3-small",
-                input=batch
-            )
-            # Embeddings come back in order
-            batch_embeddings = [item.embedding for item in response.data]
-            all_embeddings.extend(batch_embeddings)
-
-            # Log progress for large batches
-            if len(texts) > batch_size:
-                logger.info(f"📊 Embedded batch {i//batch_size + 1}/{(len(texts) + batch_size - 1)//batch_size}")
-        except Exception as e:
-            logger.error(f"Batch embedding failed at index {i}: {e}")
-            # Fallback to individual calls for this batch
-            for text in batch:
-                try:
-                    embedding = get_embedding(text)
-                    all_embeddings.append(embedding)
-                except Exception as inner_e:
-                    logger.error(f"Individual embedding failed: {inner_e}")
-                    # Return zeros as fallback (better than crashing)
-                    all_embeddings.append([0.0] * 1536)
+    Raises:
+        EmbeddingError: A batch could not be embedded; no zero-vector fallbacks are written
+    """
+    # The API rejects empty inputs
+    texts = [text if text and text.strip() else " " for text in texts]
+    return embedding_executor.embed(texts, dimensions, max_batch_items=batch_size)
 
-    return all_embeddings
+def embed_chunks(chunks: List[str], dimensions: int = EMBEDDING_DIMENSIONS):
+    """
+    Embeddings for ingested chunks, reusing cached embeddings of identical chunk text.
 
-def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+    Returns:
+        (embeddings in chunk order, cache stats dict for the job result)
+    """
+    embeddings, cache_stats = chunk_embedding_cache.embed(
+        chunks, EMBEDDING_MODEL, dimensions,
+        lambda texts: get_embeddings_batch(texts, dimensions=dimensions)
+    )
+    return embeddings, cache_stats.to_dict()
 
 # ==============================================================================
 # Queue-Based File Processing System
@@ -2315,10 +2445,11 @@ def process_file_job(
     file_queue_id: str,
     chat_id: str,
     filename: str,
-    text_content: str,
+    text_content: Union[str, Dict[str, Any]],
     file_size: int,
     scope_values: Optional[Dict[str, Union[str, int, bool]]] = None,
-    file_id: Optional[str] = None
+    file_id: Optional[str] = None,
+    replace: bool = False
 ):
     """
     Pure processor function for file ingestion - called by RQ worker.
@@ -2330,14 +2461,20 @@ def process_file_job(
     4. Creates nodes in Neo4j
     5. Updates status to READY or FAILED
 
+    With replace=True and an existing document file_id, the new chunks are
+    diffed against the stored ones by content hash: only new or changed
+    chunks are embedded and written, unchanged chunks are kept (renumbered),
+    removed ones deleted, and the NEXT chain relinked in one transaction.
+
     Args:
         file_queue_id: The Convex file_upload_queue document ID for status updates
         chat_id: The chat this file belongs to
         filename: The filename
-        text_content: The extracted text content
+        text_content: Blob store reference to the extracted text (see job_text_arg), or the text itself
         file_size: The file size in bytes
         scope_values: Optional custom scope values for the file
         file_id: Optional pre-generated file ID (if not provided, will be generated)
+        replace: Incrementally replace the existing document file_id
     """
     import time as time_module
     start_time = time_module.time()
@@ -2352,37 +2489,70 @@ def process_file_job(
     neo4j_password_local = os.getenv("NEO4J_PASSWORD")
 
     print(f"🔄 Processing file job: {filename} for chat {chat_id}")
-    print(f"   Text length: {len(text_content)} chars, File size: {file_size} bytes")
 
     # Generate file ID if not provided
     if not file_id:
         file_id = f"{chat_id}_{filename}_{int(time_module.time())}"
 
+    text_ref = text_content if is_text_ref(text_content) else None
+
     try:
         # Step 1: Update status to PROCESSING
         update_convex_file_status_sync(file_queue_id, "processing", 10)
 
-        # Step 2: Chunk the text (with larger chunk size for performance)
-        print(f"📄 Chunking text...")
-        chunks = chunk_text(text_content, max_chars=2000)  # Increased from 500!
-        num_chunks = len(chunks)
-        print(f"   Created {num_chunks} chunks (2000 chars each)")
+        # Step 2: Chunk the text. A fresh ingest of a stored text streams it from the
+        # blob store through the chunker into the pipeline, so neither the whole text
+        # nor the chunk list is held; replacements diff the full chunk list
+        text_stats = {"chars": 0}
+        if text_ref is not None and not replace:
+            def streamed_lines():
+                for line in iter_text_lines(text_ref):
+                    text_stats["chars"] += len(line) + 1
+                    yield line
+
+            text_size_bytes = text_ref["size"]
+            chunks = iter_chunks(streamed_lines())
+            num_chunks = None  # Known once the pipeline has run
+            print(f"📄 Streaming {text_size_bytes} bytes of text through the chunker, File size: {file_size} bytes")
+        else:
+            if text_ref is not None:
+                text_content = read_text(text_ref)
+            text_stats["chars"] = len(text_content)
+            text_size_bytes = len(text_content.encode('utf-8'))
+            print(f"   Text length: {len(text_content)} chars, File size: {file_size} bytes")
+
+            print(f"📄 Chunking text...")
+            chunks = chunk_text(text_content)
+            num_chunks = len(chunks)
+            if not chunks:
+                # Whitespace-only extracts chunk to nothing; fail instead of writing an empty Document
+                raise ValueError(f"No indexable text extracted from {filename}")
+            print(f"   Created {num_chunks} chunks (~{CHUNK_TARGET_TOKENS} tokens each)")
 
         update_convex_file_status_sync(file_queue_id, "processing", 20)
 
-        # Step 3: Get embeddings in batches (major performance improvement!)
-        print(f"🧠 Getting embeddings in batches...")
-        embeddings = get_embeddings_batch(chunks, batch_size=32)
-        print(f"   Got {len(embeddings)} embeddings")
-
-        update_convex_file_status_sync(file_queue_id, "processing", 50)
-
-        # Step 4: Create nodes in Neo4j
-        print(f"📊 Creating nodes in Neo4j...")
+        embedding_dimensions = get_chat_target_dimensions(chat_id)
+
+        # Replace mode: find which chunks of the stored document can be kept
+        chunk_diff = None
+        if replace:
+            with GraphDatabase.driver(neo4j_uri_local, auth=(neo4j_user_local, neo4j_password_local)) as driver:
+                with driver.session() as session:
+                    existing_chunks, stored_dimensions = fetch_document_chunks(session, file_id)
+            revision = int(time_module.time() * 1000)
+            new_chunk_id = lambda i: f"{file_id}-{revision}-{i}"
+            if (stored_dimensions or EMBEDDING_DIMENSIONS) == embedding_dimensions:
+                chunk_diff = diff_chunks(existing_chunks, chunks, new_chunk_id)
+            else:
+                # Stored at another embedding size: nothing can be reused
+                chunk_diff = diff_chunks([], chunks, new_chunk_id)
+                chunk_diff.removed = [chunk["chunk_id"] for chunk in existing_chunks]
+            print(f"♻️ Replacing {file_id}: {chunk_diff.stats()}")
 
         # Build scope properties if provided
         scope_props_set = ""
         scope_props_create = ""
+        scope_props_update = ""
         scope_params = {}
         if scope_values:
             for key, value in scope_values.items():
@@ -2390,100 +2560,171 @@ def process_file_job(
                 param_name = f"scope_{safe_key}"
                 scope_props_set += f", d.{safe_key} = ${param_name}"
                 scope_props_create += f", {safe_key}: ${param_name}"
+                scope_props_update += f", c.{safe_key} = ${param_name}"
                 scope_params[param_name] = value
 
+        labels = chunk_labels(embedding_dimensions)
+
+        def chunk_rows(chunk_ids, orders, texts, embeddings):
+            """Chunk rows for write_chunks (embeddings stored unit-normalized for dot-product scoring)"""
+            unit_embeddings, embedding_norms = normalize_embeddings(embeddings)
+            return [
+                {
+                    "chunk_id": chunk_id,
+                    "text": text,
+                    **chunk_embedding_params(embedding),
+                    "embedding_norm": embedding_norm,
+                    "token_count": count_tokens(text),
+                    "content_hash": chunk_content_hash(text),
+                    "order": order,
+                }
+                for chunk_id, order, text, embedding, embedding_norm
+                in zip(chunk_ids, orders, texts, unit_embeddings, embedding_norms)
+            ]
+
         with GraphDatabase.driver(neo4j_uri_local, auth=(neo4j_user_local, neo4j_password_local)) as driver:
             with driver.session() as session:
                 # Create document node using explicit write transaction
                 current_timestamp = int(time_module.time() * 1000)
-                text_size_bytes = len(text_content.encode('utf-8'))
+                doc_props = f"""d.chatId = $chat_id,
+                        d.filename = $filename,
+                        d.uploadDate = $upload_date,
+                        d.sizeBytes = $size_bytes,
+                        d.embeddingDimensions = $embedding_dimensions{scope_props_set}"""
+                doc_params = {
+                    "pdf_id": file_id,
+                    "chat_id": chat_id,
+                    "filename": filename,
+                    "upload_date": current_timestamp,
+                    "size_bytes": text_size_bytes,
+                    "embedding_dimensions": embedding_dimensions,
+                    **scope_params
+                }
 
                 def create_document_tx(tx):
+                    # An existing Document keeps its metadata until the new chunks are written
                     doc_query = f"""
+                    OPTIONAL MATCH (existing:Document {{id: $pdf_id}})
+                    WITH existing IS NOT NULL AS existed
                     MERGE (d:Document {{id: $pdf_id}})
-                    SET d.chatId = $chat_id,
-                        d.filename = $filename,
-                        d.uploadDate = $upload_date,
-                        d.sizeBytes = $size_bytes{scope_props_set}
-                    RETURN d
+                    ON CREATE SET {doc_props}
+                    RETURN d, existed
                     """
-                    result = tx.run(doc_query,
-                        pdf_id=file_id,
-                        chat_id=chat_id,
-                        filename=filename,
-                        upload_date=current_timestamp,
-                        size_bytes=text_size_bytes,
-                        **scope_params
-                    )
-                    return result.single()
+                    return tx.run(doc_query, **doc_params).single()
+
+                def update_document_tx(tx):
+                    tx.run(f"MATCH (d:Document {{id: $pdf_id}}) SET {doc_props}", **doc_params).consume()
 
                 doc_result = session.execute_write(create_document_tx)
                 print(f"   Created document node: {file_id} (confirmed: {doc_result is not None})")
 
-                update_convex_file_status_sync(file_queue_id, "processing", 60)
-
-                # Create chunk nodes with embeddings using explicit write transactions
-                def create_chunks_tx(tx, chunks_data):
-                    """Create all chunks in a single transaction"""
-                    created_count = 0
-                    for chunk_data in chunks_data:
-                        chunk_query = f"""
-                        MATCH (d:Document {{id: $pdf_id}})
-                        CREATE (c:Chunk {{
-                            id: $chunk_id,
-                            text: $text,
-                            embedding: $embedding,
-                            chatId: $chat_id{scope_props_create}
-                        }})
-                        CREATE (d)-[:HAS_CHUNK {{order: $order}}]->(c)
-                        RETURN c
-                        """
-                        tx.run(chunk_query, **chunk_data)
-                        created_count += 1
-                    return created_count
-
-                # Prepare chunk data
-                chunks_data = []
-                for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                    chunk_id = f"{file_id}-{i}"
-                    chunks_data.append({
-                        "pdf_id": file_id,
-                        "chunk_id": chunk_id,
-                        "text": chunk,
-                        "embedding": embedding,
-                        "chat_id": chat_id,
-                        "order": i,
-                        **scope_params
-                    })
+                update_convex_file_status_sync(file_queue_id, "processing", 30)
 
-                # Execute in write transaction
-                created_count = session.execute_write(create_chunks_tx, chunks_data)
-                print(f"   Created {created_count} chunk nodes (confirmed)")
-
-                # Step 5: Create sequential relationships using explicit transaction
-                if num_chunks > 1:
-                    print(f"🔗 Creating sequential relationships...")
-
-                    def create_relationships_tx(tx, file_id, num_chunks):
-                        for i in range(num_chunks - 1):
-                            link_query = """
-                            MATCH (c1:Chunk {id: $chunk1_id})
-                            MATCH (c2:Chunk {id: $chunk2_id})
-                            CREATE (c1)-[:NEXT {order: $order}]->(c2)
-                            """
-                            tx.run(link_query,
-                                chunk1_id=f"{file_id}-{i}",
-                                chunk2_id=f"{file_id}-{i+1}",
-                                order=i
-                            )
-                        return num_chunks - 1
+                if chunk_diff is not None:
+                    # Step 3: Embed only the new or changed chunks
+                    added_texts = [chunks[i] for i in chunk_diff.added]
+                    print(f"🧠 Getting embeddings for {len(added_texts)} changed chunks ({embedding_dimensions} dimensions)...")
+                    embeddings, embedding_cache_stats = embed_chunks(added_texts, embedding_dimensions)
+
+                    update_convex_file_status_sync(file_queue_id, "processing", 60)
+
+                    # Steps 4-5 for a replacement: one transaction patches chunks, order and NEXT links
+                    chunks_data = chunk_rows(
+                        [chunk_diff.order[i] for i in chunk_diff.added], chunk_diff.added, added_texts, embeddings
+                    )
+                    patch_counts = session.execute_write(
+                        apply_chunk_diff, file_id, chat_id, chunk_diff, chunks_data,
+                        labels, scope_props_create, scope_params, scope_props_update
+                    )
+                    print(f"   Patched document chunks: {patch_counts}")
+                else:
+                    # Steps 3-4: chunk, embed and write chunk groups as overlapping pipeline stages
+                    print(f"🧠 Embedding ({embedding_dimensions} dimensions) and writing chunks in a pipeline...")
+                    progress = {"reported": 30}
+                    # Streamed texts are chunked as they go: estimate the count for progress
+                    expected_chunks = num_chunks or max(text_size_bytes // (CHUNK_TARGET_TOKENS * 4), 1)
+                    # New chunk ids never collide with the chunks of a document that already exists
+                    chunk_prefix = f"{file_id}-{current_timestamp}" if doc_result["existed"] else file_id
+                    written_ids = []
+
+                    def embed_group(texts):
+                        return embed_chunks(texts, embedding_dimensions)
+
+                    def write_group(start, texts, embeddings):
+                        orders = range(start, start + len(texts))
+                        ids = [f"{chunk_prefix}-{i}" for i in orders]
+                        rows = chunk_rows(ids, orders, texts, embeddings)
+                        # One transaction per group, batched UNWIND writes
+                        written = session.execute_write(
+                            write_chunks, file_id, chat_id, rows, labels, scope_props_create, scope_params
+                        )
+                        written_ids.extend(ids)
+                        return written
+
+                    def report_progress(written):
+                        percent = 30 + min(int(60 * written / expected_chunks), 60)
+                        if percent - progress["reported"] >= 10:
+                            progress["reported"] = percent
+                            update_convex_file_status_sync(file_queue_id, "processing", percent)
+
+                    def remove_partial_document_tx(tx):
+                        # Only this job's chunks: an existing document keeps what it had
+                        tx.run(
+                            "UNWIND $ids AS id MATCH (c:Chunk {id: id}) DETACH DELETE c", ids=written_ids
+                        ).consume()
+                        if not doc_result["existed"]:
+                            tx.run("MATCH (d:Document {id: $doc_id}) DETACH DELETE d", doc_id=file_id).consume()
 
-                    rels_created = session.execute_write(create_relationships_tx, file_id, num_chunks)
-                    print(f"   Created {rels_created} NEXT relationships")
+                    try:
+                        pipeline_result = run_ingest_pipeline(chunks, embed_group, write_group, on_progress=report_progress)
+                        num_chunks = pipeline_result.chunks
+                        if not num_chunks:
+                            # Whitespace-only extracts chunk to nothing; fail instead of keeping an empty Document
+                            raise ValueError(f"No indexable text extracted from {filename}")
+                        embedding_cache_stats = pipeline_result.embedding_cache
+                        print(f"   Created {pipeline_result.written} chunk nodes (confirmed, stage seconds {pipeline_result.stage_seconds})")
+
+                        # Step 5: Create sequential relationships using explicit transaction
+                        if num_chunks > 1:
+                            print(f"🔗 Creating sequential relationships...")
+                            rels_created = session.execute_write(
+                                write_next_links, [f"{chunk_prefix}-{i}" for i in range(num_chunks)]
+                            )
+                            print(f"   Created {rels_created} NEXT relationships")
+                    except Exception:
+                        # Groups commit separately: remove what was written (and the Document this job created)
+                        try:
+                            session.execute_write(remove_partial_document_tx)
+                            print(f"🧹 Removed partially written document {file_id}")
+                        except Exception as cleanup_error:
+                            logger.error(f"❌ Could not remove partially written document {file_id}: {cleanup_error}")
+                        raise
+
+                if doc_result["existed"]:
+                    # The write succeeded: now the existing Document can take the new metadata
+                    session.execute_write(update_document_tx)
+
+                # Make sure the new chunks are searchable through the vector and full-text indexes
+                ensure_vector_index(session, embedding_dimensions)
+                ensure_fulltext_indexes(session)
+
+                # Invalidate cached embedding matrices for this chat, then extend
+                # its HNSW index (only chats above ANN_INDEX_MIN_CHUNKS have one)
+                bump_chat_version(chat_id)
+                try:
+                    if chunk_diff is not None:
+                        # Kept chunks are already indexed and removed ones must go: rebuild
+                        if chunk_diff.added or chunk_diff.removed:
+                            sync_chat_ann_index(session, chat_id, rebuild=True)
+                    else:
+                        # Appending by document would re-add an existing document's older chunks
+                        sync_chat_ann_index(session, chat_id, doc_id=None if doc_result["existed"] else file_id)
+                except Exception as e:
+                    logger.warning(f"⚠️ ANN index update failed for chat {chat_id}: {e}")
 
         # Step 6: Calculate knowledge units (tokens from extracted text)
         # Rough estimate: 1 token ≈ 4 characters for English text
-        estimated_tokens = len(text_content) // 4
+        estimated_tokens = text_stats["chars"] // 4
         knowledge_units = estimated_tokens / 1000  # 1 KU = 1000 tokens
 
         # Step 7: Update status to COMPLETED
@@ -2493,16 +2734,22 @@ def process_file_job(
 
         update_convex_file_status_sync(
             file_queue_id, "completed", 100,
-            extracted_text_length=len(text_content),
+            extracted_text_length=text_stats["chars"],
             knowledge_units=knowledge_units,
             nodes_created=num_chunks
         )
 
+        # The text is in the graph now; failed jobs keep their blob for retries
+        if text_ref is not None:
+            delete_text(text_ref)
+
         return {
             "status": "success",
             "file_id": file_id,
-            "chunks_created": num_chunks,
+            "chunks_created": num_chunks if chunk_diff is None else len(chunk_diff.added),
             "knowledge_units": knowledge_units,
+            "embedding_cache": embedding_cache_stats,
+            "replace": chunk_diff.stats() if chunk_diff is not None else None,
             "elapsed_seconds": elapsed
         }
 
@@ -2518,6 +2765,23 @@ def process_file_job(
 
         return {"status": "failed", "error": str(e)}
 
+def job_text_arg(text: str) -> Union[str, Dict[str, Any]]:
+    """
+    Store extracted text in the blob store and return the reference to enqueue.
+
+    Keeps up to 1 MB of text per file out of the RQ job arguments (and out of
+    Redis for result_ttl). The text is passed inline, as before the blob store,
+    unless BLOB_STORE_BACKEND is set (a local store only works when workers
+    share its directory) or when the blob store is unavailable.
+    """
+    if not BLOB_STORE_ENABLED:
+        return text
+    try:
+        return put_text(text)
+    except Exception as e:
+        logger.warning(f"⚠️ Blob store unavailable, passing extracted text inline: {e}")
+        return text
+
 def enqueue_file_processing(
     file_queue_id: str,
     chat_id: str,
@@ -2525,11 +2789,15 @@ def enqueue_file_processing(
     text_content: str,
     file_size: int,
     scope_values: Optional[Dict[str, Union[str, int, bool]]] = None,
-    file_id: Optional[str] = None
+    file_id: Optional[str] = None,
+    replace: bool = False
 ) -> Optional[str]:
     """
     Enqueue a file for background processing.
 
+    replace=True re-ingests the existing document file_id incrementally
+    (see process_file_job).
+
     Returns the job ID if queued successfully, None if Redis unavailable
     (in which case caller should fall back to sync processing).
     """
@@ -2545,10 +2813,11 @@ def enqueue_file_processing(
             file_queue_id,
             chat_id,
             filename,
-            text_content,
+            job_text_arg(text_content),  # Blob reference, not the text itself
             file_size,
             scope_values,
             file_id,
+            replace,
             job_timeout=1800,  # 30 minute timeout
             result_ttl=86400,  # Keep result for 24 hours
         )
@@ -2558,6 +2827,157 @@ def enqueue_file_processing(
         logger.error(f"❌ Failed to enqueue job: {e}")
         return None
 
+# Re-embedding is throttled so a large chat doesn't starve the embeddings quota
+REEMBED_CHUNKS_PER_MINUTE = int(os.getenv("REEMBED_CHUNKS_PER_MINUTE", "3000"))
+
+def reembed_chat_job(chat_id: str, dimensions: int, batch_size: int = 32):
+    """
+    Re-embed a chat's documents at a new embedding size - called by RQ worker.
+
+    Documents are processed one at a time: their chunks are embedded in
+    throttled batches, then the embeddings, ChunkDim labels and
+    d.embeddingDimensions are swapped in one write transaction and the chat
+    version is bumped, so retrieval sees each document at exactly one size.
+    Stops early if the chat's target size changed again (a newer job takes over).
+
+    Args:
+        chat_id: Chat to move
+        dimensions: Target embedding size (one of SUPPORTED_EMBEDDING_DIMENSIONS)
+        batch_size: Chunks per embeddings API call
+    """
+    import time as time_module
+    start_time = time_module.time()
+
+    load_dotenv()
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+    neo4j_uri_local = os.getenv("NEO4J_URI")
+    neo4j_user_local = os.getenv("NEO4J_USER")
+    neo4j_password_local = os.getenv("NEO4J_PASSWORD")
+
+    if dimensions not in SUPPORTED_EMBEDDING_DIMENSIONS:
+        return {"status": "failed", "error": f"Unsupported embedding dimensions: {dimensions}"}
+
+    print(f"🔁 Re-embedding chat {chat_id} at {dimensions} dimensions")
+    seconds_per_batch = 60.0 * batch_size / REEMBED_CHUNKS_PER_MINUTE if REEMBED_CHUNKS_PER_MINUTE > 0 else 0.0
+    reduced_labels = ":".join(f"ChunkDim{size}" for size in SUPPORTED_EMBEDDING_DIMENSIONS if size != EMBEDDING_DIMENSIONS)
+    target_label = chunk_labels(dimensions).split(":", 1)[1] if dimensions != EMBEDDING_DIMENSIONS else None
+
+    update_query = f"""
+    MATCH (d:Document {{id: $doc_id}})
+    SET d.embeddingDimensions = $dimensions
+    WITH d
+    UNWIND $rows AS row
+    MATCH (d)-[:HAS_CHUNK]->(c:Chunk {{id: row.chunk_id}})
+    SET c.embedding = row.embedding,
+        c.embeddingBlob = row.embedding_blob,
+        c.embeddingEncoding = row.embedding_encoding,
+        c.embeddingNorm = row.embedding_norm
+    REMOVE c:{reduced_labels}
+    {f"SET c:{target_label}" if target_label else ""}
+    """
+
+    documents_done = 0
+    chunks_done = 0
+    try:
+        with GraphDatabase.driver(neo4j_uri_local, auth=(neo4j_user_local, neo4j_password_local)) as driver:
+            with driver.session() as session:
+                ensure_vector_index(session, dimensions)
+                documents = [
+                    record["doc_id"] for record in session.run(
+                        """
+                        MATCH (d:Document) WHERE d.chatId = $chat_id
+                          AND coalesce(d.embeddingDimensions, $default_dimensions) <> $dimensions
+                        RETURN d.id AS doc_id
+                        """,
+                        chat_id=chat_id, dimensions=dimensions, default_dimensions=EMBEDDING_DIMENSIONS
+                    )
+                ]
+                print(f"   {len(documents)} documents to re-embed")
+
+                for doc_id in documents:
+                    if get_chat_target_dimensions(chat_id) != dimensions:
+                        print(f"⏹️ Target size for chat {chat_id} changed, stopping")
+                        break
+
+                    chunks = list(session.run(
+                        """
+                        MATCH (d:Document {id: $doc_id})-[:HAS_CHUNK]->(c:Chunk)
+                        RETURN c.id AS chunk_id, c.text AS text
+                        """,
+                        doc_id=doc_id
+                    ))
+                    embeddings = []
+                    for i in range(0, len(chunks), batch_size):
+                        batch_started = time_module.time()
+                        texts = [record["text"] or "" for record in chunks[i:i + batch_size]]
+                        embeddings.extend(get_embeddings_batch(texts, batch_size=batch_size, dimensions=dimensions))
+                        remaining = seconds_per_batch - (time_module.time() - batch_started)
+                        if remaining > 0:
+                            time_module.sleep(remaining)
+
+                    unit_embeddings, embedding_norms = normalize_embeddings(embeddings)
+                    rows = [
+                        {"chunk_id": record["chunk_id"], **chunk_embedding_params(embedding), "embedding_norm": norm}
+                        for record, embedding, norm in zip(chunks, unit_embeddings, embedding_norms)
+                    ]
+                    session.execute_write(
+                        lambda tx: tx.run(update_query, doc_id=doc_id, dimensions=dimensions, rows=rows).consume()
+                    )
+                    bump_chat_version(chat_id)
+                    documents_done += 1
+                    chunks_done += len(rows)
+                    print(f"   Re-embedded {doc_id} ({len(rows)} chunks)")
+
+                if documents_done:
+                    # The HNSW index holds the old vectors; rebuild it at the new size
+                    try:
+                        sync_chat_ann_index(session, chat_id, rebuild=True)
+                    except Exception as e:
+                        logger.warning(f"⚠️ ANN index rebuild failed for chat {chat_id}: {e}")
+
+        elapsed = time_module.time() - start_time
+        print(f"✅ Re-embedded {documents_done} documents ({chunks_done} chunks) of chat {chat_id} in {elapsed:.2f}s")
+        return {
+            "status": "success",
+            "chat_id": chat_id,
+            "dimensions": dimensions,
+            "documents_reembedded": documents_done,
+            "chunks_reembedded": chunks_done,
+            "elapsed_seconds": elapsed
+        }
+
+    except Exception as e:
+        print(f"❌ Re-embedding failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return {"status": "failed", "error": str(e), "documents_reembedded": documents_done}
+
+def enqueue_chat_reembed(chat_id: str, dimensions: int) -> Optional[str]:
+    """
+    Enqueue a re-embed job moving a chat to a new embedding size.
+
+    Returns the job ID, or None if Redis is unavailable.
+    """
+    queue = get_file_queue()
+
+    if queue is None:
+        logger.warning("⚠️ Redis queue not available, cannot enqueue re-embed job")
+        return None
+
+    try:
+        job = queue.enqueue(
+            reembed_chat_job,
+            chat_id,
+            dimensions,
+            job_timeout=6 * 3600,  # Throttled, large chats take a while
+            result_ttl=86400,
+        )
+        logger.info(f"📤 Enqueued re-embed job: {job.id} for chat {chat_id} ({dimensions} dimensions)")
+        return job.id
+    except Exception as e:
+        logger.error(f"❌ Failed to enqueue re-embed job: {e}")
+        return None
+
 # ==============================================================================
 # API Authentication Functions
 # ==============================================================================
@@ -2956,6 +3376,8 @@ async def v1_user_query(
         temperature = 0.7
         max_tokens = response_tokens
         custom_prompt = None
+        parent_chat_id = None
+        effective_parent_settings = None
 
         # Apply PUBLISHED parent chat settings if available
         if app_config_from_convex:
@@ -2981,6 +3403,7 @@ async def v1_user_query(
                         parent_settings = app_data.get("parentChatSettings", {}) if app_data else {}
 
                         if parent_settings:
+                            effective_parent_settings = merge_settings_with_overrides(parent_chat_id, parent_settings) if parent_chat_id else parent_settings
                             selected_model = parent_settings.get("selectedModel", selected_model)
                             temperature = parent_settings.get("temperature", temperature)
                             max_tokens = int(min(parent_settings.get("maxTokens", max_tokens), response_tokens))
@@ -2997,19 +3420,53 @@ async def v1_user_query(
             except Exception as e:
                 logger.warning(f"⚠️ Could not load published parent settings, using defaults: {e}")
 
-        # Use the existing answer_question function but with the user's subchat and inherited settings
-        question_request = QuestionRequest(
-            question=sanitized_question,
-            chat_id=subchat["chatStringId"],  # Use the permanent subchat
-            selected_model=selected_model,    # Use inherited or default model
-            temperature=temperature,          # Use inherited or default temperature
-            max_tokens=max_tokens,           # Use inherited or default max_tokens
-            custom_prompt=custom_prompt,     # Use inherited custom prompt
-            scope_filters=parsed_scope_filters  # Apply scope filters for data filtering
-        )
+        # Semantic answer cache, opted in through the parent chat's settings.
+        # Entries are per subchat so users never see answers built from another user's files.
+        subchat_id = subchat["chatStringId"]
+        cache_policy = answer_cache_policy(effective_parent_settings)
+        cached_answer = None
+        if cache_policy:
+            cache_chat_ids = [subchat_id, parent_chat_id] if parent_chat_id else [subchat_id]
+            cache_fingerprint = settings_fingerprint(
+                effective_parent_settings, max_tokens=max_tokens, scope_filters=parsed_scope_filters
+            )
+            cache_embedding = get_embedding(sanitized_question)
+            # Keyed before retrieval, so an answer built while the content changes is stored under the old version
+            cache_key = semantic_answer_cache.bucket_key(subchat_id, cache_chat_ids, cache_fingerprint)
+            cached_answer = semantic_answer_cache.lookup(cache_key, subchat_id, cache_embedding, cache_policy)
+
+        if cached_answer:
+            await consume_credits_for_cached_answer(
+                user_id=user_identity["user_id"],
+                model=selected_model,
+                question=sanitized_question,
+                response=cached_answer["answer"],
+                chat_id=subchat_id
+            )
+            result = AnswerWithContext(
+                answer=cached_answer["answer"],
+                context=[ChunkScore(**chunk) for chunk in cached_answer["context"]]
+            )
+        else:
+            # Use the existing answer_question function but with the user's subchat and inherited settings
+            question_request = QuestionRequest(
+                question=sanitized_question,
+                chat_id=subchat_id,               # Use the permanent subchat
+                selected_model=selected_model,    # Use inherited or default model
+                temperature=temperature,          # Use inherited or default temperature
+                max_tokens=max_tokens,           # Use inherited or default max_tokens
+                custom_prompt=custom_prompt,     # Use inherited custom prompt
+                scope_filters=parsed_scope_filters  # Apply scope filters for data filtering
+            )
 
-        # Get the answer using existing logic
-        result = await answer_question(question_request)
+            # Get the answer using existing logic
+            result = await answer_question(question_request)
+
+            if cache_policy:
+                semantic_answer_cache.store(
+                    cache_key, sanitized_question, cache_embedding,
+                    result.answer, [chunk.dict() for chunk in result.context], cache_policy
+                )
 
         # Track the query for analytics
         await track_api_query(
@@ -3026,6 +3483,7 @@ async def v1_user_query(
             "answer": result.answer,
             "chat_id": subchat["chatStringId"],
             "user_id": user_identity["user_id"],
+            "cached": cached_answer is not None,
             "citations": [
                 {
                     "snippet": chunk.chunk_text[:200] + "...",
@@ -3180,7 +3638,7 @@ async def v1_user_file_upload(
                     file_queue_id,
                     subchat["chatStringId"],
                     sanitized_filename,
-                    sanitized_text,
+                    job_text_arg(sanitized_text),  # Blob reference, not the text itself
                     file_size,
                     parsed_scope_values,
                     pdf_id,
@@ -3463,7 +3921,7 @@ async def v1_user_bulk_file_upload(
                     file_queue_id,
                     subchat["chatStringId"],
                     sanitized_filename,
-                    sanitized_text,
+                    job_text_arg(sanitized_text),  # Blob reference, not the text itself
                     file_size,
                     parsed_scope_values,
                     pdf_id,
@@ -3740,6 +4198,7 @@ async def v1_delete_user_file(
 
                 delete_result = session.run(delete_query, file_id=sanitized_file_id, chat_id=subchat["chatStringId"])
                 summary = delete_result.consume()
+                chat_chunks_deleted(session, subchat["chatStringId"])
 
                 if summary.counters.nodes_deleted == 0:
                     raise HTTPException(
@@ -3901,17 +4360,64 @@ async def api_answer_question(
         # This ensures developers control exactly what the API uses
         logger.info(f"🎯 Using PUBLISHED settings: model={chat_settings['selected_model']}, temp={chat_settings['temperature']}, max_tokens={chat_settings['max_tokens']}, has_custom_prompt={bool(chat_settings['custom_prompt'])}, unhinged_mode={published_settings.get('unhingedMode', False)}")
 
-        # Create minimal payload - all settings will come from published_settings
-        internal_payload = QuestionRequest(
-            question=payload.question,
-            chat_id=chat_id
-        )
+        # Semantic answer cache (opt-in per chat through answerCacheEnabled)
+        merged_settings = merge_settings_with_overrides(sanitized_chat_id, published_settings)
+        cache_policy = answer_cache_policy(merged_settings)
+        cache_question = None
+        cached_answer = None
+        if cache_policy:
+            cache_question = sanitize_with_xss_detection(
+                payload.question,
+                allow_html=False,
+                max_length=5000,
+                context="answer_question"
+            )
+        if cache_question:
+            parent_chat_id = await retrieval_engine.resolve_parent_chat_id(sanitized_chat_id)
+            cache_chat_ids = [sanitized_chat_id, parent_chat_id] if parent_chat_id else [sanitized_chat_id]
+            cache_fingerprint = settings_fingerprint(merged_settings)
+            cache_embedding = get_embedding(cache_question)
+            # Keyed before retrieval, so an answer built while the content changes is stored under the old version
+            cache_key = semantic_answer_cache.bucket_key(sanitized_chat_id, cache_chat_ids, cache_fingerprint)
+            cached_answer = semantic_answer_cache.lookup(cache_key, sanitized_chat_id, cache_embedding, cache_policy)
+
+        if cached_answer:
+            try:
+                await consume_credits_for_cached_answer(
+                    user_id=chat_owner_id,
+                    model=merged_settings.get("selectedModel", "gpt-4o-mini"),
+                    question=cache_question,
+                    response=cached_answer["answer"],
+                    chat_id=sanitized_chat_id,
+                    skip_developer_lookup=True  # Use chat owner, same as uncached answers
+                )
+            except InsufficientCreditsError as e:
+                raise HTTPException(
+                    status_code=402,
+                    detail=f"Insufficient credits. Required: {e.required:.2f}, Available: {e.available:.2f}. Please add credits to continue."
+                )
+            result = AnswerWithContext(
+                answer=cached_answer["answer"],
+                context=[ChunkScore(**chunk) for chunk in cached_answer["context"]]
+            )
+        else:
+            # Create minimal payload - all settings will come from published_settings
+            internal_payload = QuestionRequest(
+                question=payload.question,
+                chat_id=chat_id
+            )
 
-        # Use the existing answer_question logic with published settings
-        result = await answer_question_with_published_context(
-            internal_payload,
-            published_settings
-        )
+            # Use the existing answer_question logic with published settings
+            result = await answer_question_with_published_context(
+                internal_payload,
+                published_settings
+            )
+
+            if cache_question:
+                semantic_answer_cache.store(
+                    cache_key, cache_question, cache_embedding,
+                    result.answer, [chunk.dict() for chunk in result.context], cache_policy
+                )
 
         # Format for external API
         api_response = ApiAnswerResponse(
@@ -3919,6 +4425,7 @@ async def api_answer_question(
             context=result.context,
             chat_id=chat_id,
             model=payload.selected_model or "gpt-4o-mini",
+            cached=cached_answer is not None,
             usage={
                 "prompt_tokens": len(payload.question) // 4,  # Rough estimate
                 "completion_tokens": len(result.answer) // 4,
@@ -3942,34 +4449,52 @@ async def api_answer_question(
         logger.error(f"❌ API answer_question failed for chat {chat_id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to process question. Please try again.")
 
-@app.post("/v1/{chat_id}/answer_question_stream")
-async def api_answer_question_stream(
+# Batch question answering (evaluation / back-office jobs)
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "200"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+
+@app.post("/v1/{chat_id}/answer_questions_batch")
+async def api_answer_questions_batch(
     chat_id: str,
-    payload: ApiQuestionRequest,
+    payload: ApiBatchQuestionRequest,
     request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(get_verified_chat_access)
 ):
     """
-    External API endpoint for streaming answers.
+    Answer many questions about a chat's knowledge base in one request.
 
-    Returns Server-Sent Events stream for real-time applications.
+    All questions are embedded in one embeddings call and scored against the
+    chat's cached embedding matrix with one matrix product; chunk text is read
+    in one query. The LLM calls run with bounded concurrency
+    (BATCH_LLM_CONCURRENCY) using the chat's published settings, and each
+    answer is charged like a single /answer_question call.
 
     Usage:
-    POST https://api.trainlyai.com/v1/{chat_id}/answer_question_stream
+    POST https://api.trainlyai.com/v1/{chat_id}/answer_questions_batch
     Authorization: Bearer tk_your_api_key
-    Accept: text/event-stream
-    """
 
+    {
+        "questions": ["What is machine learning?", "Who wrote the report?"],
+        "stream": false
+    }
+
+    Returns {"results": [...]} in question order, or with "stream": true an
+    NDJSON stream with one {"index", "question", "answer", "context"} (or
+    "error") line per question as it completes.
+    """
     try:
-        # Verify API key and chat access first
         api_key = credentials.credentials
 
-        # Sanitize chat_id first
         sanitized_chat_id = sanitize_chat_id(chat_id)
         if not sanitized_chat_id:
             raise HTTPException(status_code=400, detail="Invalid chat_id format")
 
-        # Rate limiting
+        if not payload.questions:
+            raise HTTPException(status_code=400, detail="questions must not be empty")
+        if len(payload.questions) > BATCH_MAX_QUESTIONS:
+            raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+
+        # A batch counts as one request against the rate limit; credits are charged per answer
         if not check_rate_limit(api_key, request.client.host):
             raise HTTPException(
                 status_code=429,
@@ -3977,38 +4502,169 @@ async def api_answer_question_stream(
                 headers={"Retry-After": "60"}
             )
 
-        # Verify API key and chat access
         is_valid = await verify_api_key_and_chat(api_key, sanitized_chat_id)
-
         if not is_valid:
             raise HTTPException(
                 status_code=401,
                 detail="Invalid API key or chat not accessible. Please check: 1) Chat exists, 2) API access is enabled in chat settings, 3) API key is correct."
             )
 
-        # Get PUBLISHED chat settings AND conversation history from Convex
-        chat_settings = {}
-        conversation_history = []
-        published_settings = None
         async with httpx.AsyncClient() as client:
-            # First get published settings
             published_response = await client.post(
                 f"{os.getenv('CONVEX_URL', 'https://agile-ermine-199.convex.cloud')}/api/run/chats/getPublishedSettings",
                 json={
-                    "args": {"chatId": chat_id},
+                    "args": {"chatId": sanitized_chat_id},
                     "format": "json"
                 },
                 headers={"Content-Type": "application/json"}
             )
+        published_settings = published_response.json().get("value") if published_response.status_code == 200 else None
+        if not published_settings:
+            raise HTTPException(
+                status_code=400,
+                detail="This chat has no published settings. Please publish your chat settings first to enable API access."
+            )
+        merged_settings = merge_settings_with_overrides(sanitized_chat_id, published_settings)
 
-            # Also get chat content for conversation history
-            chat_response = await client.post(
-                f"{os.getenv('CONVEX_URL', 'https://agile-ermine-199.convex.cloud')}/api/run/chats/getChatByIdExposed",
-                json={
-                    "args": {"id": chat_id},
-                    "format": "json"
-                },
-                headers={"Content-Type": "application/json"}
+        # Questions that fail sanitization get an error entry instead of failing the batch
+        questions = [
+            sanitize_with_xss_detection(question, allow_html=False, max_length=5000, context="answer_question")
+            for question in payload.questions
+        ]
+        valid = [i for i, question in enumerate(questions) if question]
+
+        published_context_files = merged_settings.get("context", [])
+        published_file_ids = [file["fileId"] for file in published_context_files] if published_context_files else None
+
+        retrieved: Dict[int, List[Dict[str, Any]]] = {}
+        if valid:
+            embeddings = await asyncio.to_thread(get_question_embeddings, [questions[i] for i in valid])
+            results = await retrieval_engine.retrieve_batch(
+                [questions[i] for i in valid], embeddings, sanitized_chat_id, top_k=CONTEXT_MAX_CHUNKS,
+                file_ids=published_file_ids, fallback_to_all_files=True, boost_style=BOOST_SIMPLE
+            )
+            retrieved = {i: result.chunks for i, result in zip(valid, results)}
+        logger.info(f"📦 Batch of {len(payload.questions)} questions for chat {sanitized_chat_id}: {len(valid)} valid, retrieval done")
+
+        semaphore = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+
+        async def answer_one(index: int) -> Dict[str, Any]:
+            if index not in retrieved:
+                return {"index": index, "question": payload.questions[index], "error": "Invalid input format or potentially malicious content detected"}
+            async with semaphore:
+                try:
+                    result = await answer_question_with_published_context(
+                        QuestionRequest(question=questions[index], chat_id=sanitized_chat_id),
+                        published_settings,
+                        retrieved_chunks=retrieved[index]
+                    )
+                except HTTPException as e:
+                    return {"index": index, "question": questions[index], "error": e.detail}
+            return {
+                "index": index,
+                "question": questions[index],
+                "answer": result.answer,
+                "context": [chunk.dict() for chunk in result.context],
+                "context_usage": result.context_usage,
+            }
+
+        tasks = [asyncio.create_task(answer_one(i)) for i in range(len(payload.questions))]
+
+        if payload.stream:
+            async def generate():
+                try:
+                    for finished in asyncio.as_completed(tasks):
+                        yield json.dumps(await finished) + "\n"
+                finally:
+                    for task in tasks:
+                        task.cancel()
+
+            return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+        answers = await asyncio.gather(*tasks)
+        logger.info(f"✅ Batch answered {sum(1 for a in answers if 'answer' in a)}/{len(answers)} questions for chat {sanitized_chat_id}")
+        return {
+            "chat_id": sanitized_chat_id,
+            "model": merged_settings.get("selectedModel", "gpt-4o-mini"),
+            "results": answers
+        }
+
+    except HTTPException:
+        raise
+    except EmbeddingError as e:
+        logger.error(f"❌ Embedding questions failed for chat {chat_id}: {str(e)}")
+        raise HTTPException(status_code=503, detail="Embedding service is busy. Please retry shortly.")
+    except Exception as e:
+        logger.error(f"❌ API answer_questions_batch failed for chat {chat_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to process questions. Please try again.")
+
+@app.post("/v1/{chat_id}/answer_question_stream")
+async def api_answer_question_stream(
+    chat_id: str,
+    payload: ApiQuestionRequest,
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(get_verified_chat_access)
+):
+    """
+    External API endpoint for streaming answers.
+
+    Returns Server-Sent Events stream for real-time applications.
+
+    Usage:
+    POST https://api.trainlyai.com/v1/{chat_id}/answer_question_stream
+    Authorization: Bearer tk_your_api_key
+    Accept: text/event-stream
+    """
+
+    try:
+        # Verify API key and chat access first
+        api_key = credentials.credentials
+
+        # Sanitize chat_id first
+        sanitized_chat_id = sanitize_chat_id(chat_id)
+        if not sanitized_chat_id:
+            raise HTTPException(status_code=400, detail="Invalid chat_id format")
+
+        # Rate limiting
+        if not check_rate_limit(api_key, request.client.host):
+            raise HTTPException(
+                status_code=429,
+                detail="Rate limit exceeded. Maximum 60 requests per minute.",
+                headers={"Retry-After": "60"}
+            )
+
+        # Verify API key and chat access
+        is_valid = await verify_api_key_and_chat(api_key, sanitized_chat_id)
+
+        if not is_valid:
+            raise HTTPException(
+                status_code=401,
+                detail="Invalid API key or chat not accessible. Please check: 1) Chat exists, 2) API access is enabled in chat settings, 3) API key is correct."
+            )
+
+        # Get PUBLISHED chat settings AND conversation history from Convex
+        chat_settings = {}
+        conversation_history = []
+        published_settings = None
+        async with httpx.AsyncClient() as client:
+            # First get published settings
+            published_response = await client.post(
+                f"{os.getenv('CONVEX_URL', 'https://agile-ermine-199.convex.cloud')}/api/run/chats/getPublishedSettings",
+                json={
+                    "args": {"chatId": chat_id},
+                    "format": "json"
+                },
+                headers={"Content-Type": "application/json"}
+            )
+
+            # Also get chat content for conversation history
+            chat_response = await client.post(
+                f"{os.getenv('CONVEX_URL', 'https://agile-ermine-199.convex.cloud')}/api/run/chats/getChatByIdExposed",
+                json={
+                    "args": {"id": chat_id},
+                    "format": "json"
+                },
+                headers={"Content-Type": "application/json"}
             )
 
             if published_response.status_code == 200 and chat_response.status_code == 200:
@@ -4161,6 +4817,13 @@ async def api_health_check():
             "services": {
                 "neo4j": "connected",
                 "openai": "configured" if openai.api_key else "not_configured"
+            },
+            "caches": {
+                "question_embeddings": question_embedding_cache.stats(),
+                "embedding_matrices": embedding_matrix_cache.stats(),
+                "ann_indexes": ann_index_cache.stats(),
+                "shared_parent_tier": shared_tier_cache.stats(),
+                "answers": semantic_answer_cache.stats()
             }
         }
     except Exception as e:
@@ -4224,6 +4887,7 @@ async def create_nodes_and_embeddings(payload: CreateNodesAndEmbeddingsRequest):
     - Enqueues the heavy processing to Redis queue
     - Returns immediately with job status
     - Poll file status endpoint for completion
+    - replace=true with an existing pdf_id embeds and writes only the changed chunks
     """
     # Sanitize inputs early
     sanitized_text = sanitize_with_xss_detection(
@@ -4246,6 +4910,7 @@ async def create_nodes_and_embeddings(payload: CreateNodesAndEmbeddingsRequest):
     file_queue_id = f"fq_{sanitized_pdf_id}"
     file_size = len(sanitized_text.encode('utf-8'))
     scope_values = payload.scope_values if hasattr(payload, 'scope_values') else {}
+    replace = bool(payload.replace) and bool(payload.pdf_id)
 
     # Try to enqueue for background processing
     queue = get_file_queue()
@@ -4257,10 +4922,11 @@ async def create_nodes_and_embeddings(payload: CreateNodesAndEmbeddingsRequest):
                 file_queue_id,
                 sanitized_chat_id,
                 sanitized_filename,
-                sanitized_text,
+                job_text_arg(sanitized_text),  # Blob reference, not the text itself
                 file_size,
                 scope_values,
                 sanitized_pdf_id,
+                replace,
                 job_timeout=1800,  # 30 minute timeout
                 result_ttl=86400,  # Keep result for 24 hours
             )
@@ -4274,7 +4940,8 @@ async def create_nodes_and_embeddings(payload: CreateNodesAndEmbeddingsRequest):
                 "file_queue_id": file_queue_id,
                 "job_id": job.id,
                 "chat_id": sanitized_chat_id,
-                "filename": sanitized_filename
+                "filename": sanitized_filename,
+                "replace": replace
             }
 
         except Exception as e:
@@ -4332,10 +4999,16 @@ async def create_nodes_and_embeddings_internal(pdf_text: str, pdf_id: str, chat_
             scope_props_create, _ = build_scope_properties(scope_values, None, for_set_clause=False)
             logger.info(f"📊 Adding custom scopes to nodes (unvalidated): {scope_values}")
 
+    # Whitespace-only extracts chunk to nothing; reject them before creating a Document
+    chunks = chunk_text(pdf_text)
+    if not chunks:
+        raise HTTPException(status_code=400, detail="No indexable text found in the file")
+
     try:
         with GraphDatabase.driver(neo4j_uri, auth=(neo4j_user, neo4j_password)) as driver:
             with driver.session() as session:
                 print(f"✅ Creating document: {pdf_id} ({filename}) in chat {chat_id}")
+                embedding_dimensions = get_chat_target_dimensions(chat_id)
 
                 # Create Document node with metadata and custom scopes
                 current_timestamp = int(time.time() * 1000)  # Unix timestamp in milliseconds
@@ -4344,7 +5017,8 @@ async def create_nodes_and_embeddings_internal(pdf_text: str, pdf_id: str, chat_
                 SET d.chatId = $chat_id,
                     d.filename = $filename,
                     d.uploadDate = $upload_date,
-                    d.sizeBytes = $size_bytes{scope_props_set}
+                    d.sizeBytes = $size_bytes,
+                    d.embeddingDimensions = $embedding_dimensions{scope_props_set}
                 RETURN d
                 """
                 # Calculate text size in bytes for storage tracking
@@ -4357,6 +5031,7 @@ async def create_nodes_and_embeddings_internal(pdf_text: str, pdf_id: str, chat_
                     "filename": filename,
                     "upload_date": current_timestamp,
                     "size_bytes": text_size_bytes,
+                    "embedding_dimensions": embedding_dimensions,
                     **scope_params  # Add scope parameters
                 }
 
@@ -4364,52 +5039,35 @@ async def create_nodes_and_embeddings_internal(pdf_text: str, pdf_id: str, chat_
                 print(f"Created document node with scopes: {result.single()}")
 
                 # Create chunks and embeddings
-                chunks = chunk_text(pdf_text)  # Now uses 2000 chars (was 500)
                 print(f"Creating {len(chunks)} chunks for document {pdf_id}")
 
                 # PERFORMANCE OPTIMIZATION: Get all embeddings in batches
                 print(f"🧠 Getting embeddings in batches...")
-                embeddings = get_embeddings_batch(chunks, batch_size=32)
+                embeddings, embedding_cache_stats = embed_chunks(chunks, embedding_dimensions)
                 print(f"   Got {len(embeddings)} embeddings")
 
-                # Create all chunks with their pre-computed embeddings
-                chunk_ids = []
-                for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                    chunk_id = f"{pdf_id}-{i}"
-                    chunk_ids.append(chunk_id)
-
-                    query = f"""
-                    MATCH (d:Document {{id: $pdf_id}})
-                    CREATE (c:Chunk {{
-                        id: $chunk_id,
-                        text: $text,
-                        embedding: $embedding,
-                        chatId: $chat_id{scope_props_create}
-                    }})
-                    CREATE (d)-[:HAS_CHUNK {{order: $order}}]->(c)
-                    RETURN c
-                    """
-
-                    # Merge base params with scope params
-                    chunk_params = {
-                        "pdf_id": pdf_id,
-                        "chunk_id": chunk_id,
+                # Create all chunks with their pre-computed embeddings (stored unit-normalized),
+                # in batched UNWIND writes inside one transaction
+                unit_embeddings, embedding_norms = normalize_embeddings(embeddings)
+                chunk_rows = [
+                    {
+                        "chunk_id": f"{pdf_id}-{i}",
                         "text": chunk,
-                        "embedding": embedding,
-                        "chat_id": chat_id,
+                        **chunk_embedding_params(embedding),
+                        "embedding_norm": embedding_norm,
+                        "token_count": count_tokens(chunk),
+                        "content_hash": chunk_content_hash(chunk),
                         "order": i,
-                        **scope_params  # Add scope parameters
                     }
-
-                    result = session.run(query, **chunk_params)
-
-                    chunk_result = result.single()
-                    if chunk_result:
-                        if i % 10 == 0:  # Log every 10th chunk to reduce noise
-                            print(f"Created chunk {i}/{len(chunks)}")
-                    else:
-                        print(f"Failed to create chunk {i}")
-                        raise Exception(f"Failed to create chunk {i}")
+                    for i, (chunk, embedding, embedding_norm) in enumerate(zip(chunks, unit_embeddings, embedding_norms))
+                ]
+                created_count = session.execute_write(
+                    write_chunks, pdf_id, chat_id, chunk_rows, chunk_labels(embedding_dimensions),
+                    scope_props_create, scope_params
+                )
+                if created_count != len(chunks):
+                    raise Exception(f"Created {created_count} of {len(chunks)} chunks")
+                print(f"Created {created_count} chunks ({INGEST_WRITE_BATCH_SIZE} per batch)")
 
                 # Analyze content and create intelligent relationships
                 if len(chunks) > 1:
@@ -4419,61 +5077,28 @@ async def create_nodes_and_embeddings_internal(pdf_text: str, pdf_id: str, chat_
                     ai_relationships = analyze_chunk_relationships(chunks)
 
                     print(f"Creating {len(ai_relationships)} intelligent relationships...")
-                    successful_links = 0
-
-                    for rel in ai_relationships:
-                        try:
-                            source_idx = rel["source"]
-                            target_idx = rel["target"]
-                            rel_type = rel["type"]
-                            description = rel.get("description", "")
-                            confidence = rel.get("confidence", 0.0)
-
-                            # Verify both chunks exist
-                            check_query = """
-                            MATCH (c1:Chunk {id: $chunk1_id})
-                            MATCH (c2:Chunk {id: $chunk2_id})
-                            RETURN c1.id as id1, c2.id as id2
-                            """
-
-                            check_result = session.run(check_query,
-                                                     chunk1_id=f"{pdf_id}-{source_idx}",
-                                                     chunk2_id=f"{pdf_id}-{target_idx}")
-
-                            if check_result.single():
-                                # Both chunks exist, create the intelligent relationship
-                                link_query = f"""
-                                MATCH (c1:Chunk {{id: $chunk1_id}})
-                                MATCH (c2:Chunk {{id: $chunk2_id}})
-                                CREATE (c1)-[:{rel_type} {{
-                                    description: $description,
-                                    confidence: $confidence,
-                                    ai_generated: true
-                                }}]->(c2)
-                                RETURN c1.id as source, c2.id as target
-                                """
-
-                                link_result = session.run(link_query,
-                                                         chunk1_id=f"{pdf_id}-{source_idx}",
-                                                         chunk2_id=f"{pdf_id}-{target_idx}",
-                                                         description=description,
-                                                         confidence=confidence)
-
-                                if link_result.single():
-                                    print(f"✅ Created {rel_type} relationship: {source_idx} -> {target_idx} (confidence: {confidence:.2f})")
-                                    successful_links += 1
-                                else:
-                                    print(f"❌ Failed to create {rel_type} relationship: {source_idx} -> {target_idx}")
-                            else:
-                                print(f"❌ One or both chunks missing for relationship {source_idx} -> {target_idx}")
-
-                        except Exception as link_error:
-                            print(f"❌ Error creating relationship {rel.get('type', 'UNKNOWN')} {source_idx} -> {target_idx}: {link_error}")
+                    try:
+                        successful_links = session.execute_write(write_relationships, pdf_id, ai_relationships)
+                    except Exception as link_error:
+                        print(f"❌ Error creating intelligent relationships: {link_error}")
+                        successful_links = 0
 
                     print(f"Successfully created {successful_links} out of {len(ai_relationships)} intelligent relationships")
                 else:
                     print("Only one chunk, no relationships needed")
 
+                # Make sure the new chunks are searchable through the vector and full-text indexes
+                ensure_vector_index(session, embedding_dimensions)
+                ensure_fulltext_indexes(session)
+
+                # Invalidate cached embedding matrices for this chat, then extend
+                # its HNSW index (only chats above ANN_INDEX_MIN_CHUNKS have one)
+                bump_chat_version(chat_id)
+                try:
+                    sync_chat_ann_index(session, chat_id, doc_id=pdf_id)
+                except Exception as e:
+                    logger.warning(f"⚠️ ANN index update failed for chat {chat_id}: {e}")
+
         # Final verification - count what we created
         with GraphDatabase.driver(neo4j_uri, auth=(neo4j_user, neo4j_password)) as driver:
             with driver.session() as session:
@@ -4488,15 +5113,21 @@ async def create_nodes_and_embeddings_internal(pdf_text: str, pdf_id: str, chat_
                 counts = result.single()
                 print(f"Final counts - Documents: {counts['docs']}, Chunks: {counts['chunks']}, Linked chunks: {counts['linked_chunks']}")
 
-        return {"status": "success", "message": f"Created {len(chunks)} chunks with relationships"}
+        return {
+            "status": "success",
+            "message": f"Created {len(chunks)} chunks with relationships",
+            "embedding_cache": embedding_cache_stats
+        }
     except Exception as e:
         print(f"Error in create_nodes_and_embeddings: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-async def answer_question_with_published_context(payload: QuestionRequest, published_settings: dict):
+async def answer_question_with_published_context(payload: QuestionRequest, published_settings: dict,
+                                                 retrieved_chunks: Optional[List[Dict[str, Any]]] = None):
     """
     Answer question using published settings for API calls.
     All settings (model, prompt, temperature, unhinged mode, context files, etc.) come from published_settings.
+    retrieved_chunks skips retrieval when the caller already ranked and hydrated the chunks (batch endpoint).
     """
     try:
         # Enhanced sanitization with XSS detection
@@ -4537,183 +5168,39 @@ async def answer_question_with_published_context(payload: QuestionRequest, publi
 
         logger.info(f"🔍 Processing question for chat {chat_id} using published context files")
 
-        # Generate question embedding
-        question_embedding = get_embedding(question)
-
-        # Check if this is a subchat and get parent chat ID for file inheritance
-        parent_chat_id = None
-        if chat_id.startswith("subchat_"):
-            # Extract app_id from subchat format: subchat_{app_id}_{user_id}_{timestamp}
-            # The app_id format is: app_xxxxx_xxxxx, so we need to find where "user_" starts
-            parts = chat_id.split("_")
-
-            # Find the index where "user" appears to determine app_id boundary
-            user_index = -1
-            for i, part in enumerate(parts):
-                if part == "user" and i > 1:  # "user" should not be the first or second part
-                    user_index = i
-                    break
-
-            if user_index > 1:
-                # Reconstruct app_id from parts[1] to parts[user_index-1]
-                app_id = "_".join(parts[1:user_index])
-                parent_chat_id = await get_parent_chat_id_from_app(app_id)
-                if parent_chat_id:
-                    logger.info(f"🔗 Subchat {chat_id} inheriting ALL files from parent chat {parent_chat_id}")
-
-        # Fetch chunks from Neo4j, filtering by published context files if provided
-        with GraphDatabase.driver(neo4j_uri, auth=(neo4j_user, neo4j_password)) as driver:
-            with driver.session() as session:
-                if published_context_files:
-                    # Filter to only use chunks from published files
-                    published_file_ids = [file["fileId"] for file in published_context_files]
-                    file_ids_str = "', '".join(published_file_ids)
-                    logger.info(f"🔍 Published file IDs to search for: {published_file_ids}")
-
-                    if parent_chat_id:
-                        # Include chunks from both subchat and parent chat
-                        query = f"""
-                        MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
-                        WHERE (c.chatId = '{chat_id}' OR c.chatId = '{parent_chat_id}') AND d.id IN ['{file_ids_str}']
-                        RETURN c.id AS id, c.text AS text, c.embedding AS embedding, d.filename AS filename, c.chatId AS source_chat, d.id AS doc_id
-                        """
-                        logger.info(f"📋 Using published files from subchat and parent: {len(published_context_files)} files")
-                    else:
-                        query = f"""
-                        MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
-                        WHERE c.chatId = '{chat_id}' AND d.id IN ['{file_ids_str}']
-                        RETURN c.id AS id, c.text AS text, c.embedding AS embedding, d.filename AS filename, c.chatId AS source_chat, d.id AS doc_id
-                        """
-                        logger.info(f"📋 Using published files only: {len(published_context_files)} files")
-
-                    # Debug: Check what documents actually exist in this chat
-                    debug_query = f"""
-                    MATCH (d:Document)
-                    WHERE d.chatId = '{chat_id}'
-                    RETURN d.id AS doc_id, d.filename AS filename
-                    LIMIT 10
-                    """
-                    debug_results = session.run(debug_query)
-                    existing_docs = list(debug_results)
-                    logger.info(f"🔍 Documents that exist in chat {chat_id}: {[(r['doc_id'], r['filename']) for r in existing_docs]}")
-                else:
-                    # Use all files (fallback for backwards compatibility)
-                    if parent_chat_id:
-                        # Include chunks from both subchat and parent chat
-                        query = f"""
-                        MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
-                        WHERE c.chatId = '{chat_id}' OR c.chatId = '{parent_chat_id}'
-                        RETURN c.id AS id, c.text AS text, c.embedding AS embedding, d.filename AS filename, c.chatId AS source_chat
-                        """
-                        logger.info(f"📋 Using ALL files from subchat and parent chat {parent_chat_id}")
-                    else:
-                        query = f"""
-                        MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
-                        WHERE c.chatId = '{chat_id}'
-                        RETURN c.id AS id, c.text AS text, c.embedding AS embedding, d.filename AS filename, c.chatId AS source_chat
-                        """
-                        logger.info(f"📋 Using all available subchat files (no parent chat)")
-
-                results = session.run(query)
-
-                # Calculate similarities with filename boost
-                chunk_scores = []
-                question_lower = question.lower()
-                chunks_found_count = 0
-                records_with_embeddings = 0
-
-                for record in results:
-                    chunks_found_count += 1
-                    chunk_embedding = record["embedding"]
-                    if chunk_embedding:
-                        records_with_embeddings += 1
-                        similarity = cosine_similarity(
-                            np.array(question_embedding),
-                            np.array(chunk_embedding)
-                        )
-
-                        # Boost score if filename is mentioned in question
-                        filename_lower = record["filename"].lower() if record["filename"] else ""
-                        filename_boost = 0.1 if any(word in filename_lower for word in question_lower.split()) else 0
-
-                        chunk_scores.append({
-                            "chunk_id": record["id"],
-                            "chunk_text": record["text"],
-                            "score": similarity + filename_boost,
-                            "filename": record["filename"]
-                        })
-
-                logger.info(f"🔍 Found {chunks_found_count} chunks from query, {records_with_embeddings} with valid embeddings, {len(chunk_scores)} scored")
-
-                # Sort by similarity score and get top chunks
-                chunk_scores.sort(key=lambda x: x["score"], reverse=True)
-                top_chunks = chunk_scores[:8]  # Get top 8 chunks
-
-                # If no chunks found with published files filter, fall back to all files
-                if not top_chunks and published_context_files and chunks_found_count == 0:
-                    # Only fallback if the query returned 0 chunks (not just low similarity)
-                    logger.warning(f"⚠️ Published files filter returned 0 chunks. Published file IDs: {published_file_ids}")
-                    # Check if there are chunks in the chat that aren't in the published files list
-                    check_all_query = f"""
-                    MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
-                    WHERE c.chatId = '{chat_id}'
-                    RETURN count(c) as total_chunks
-                    """
-                    check_result = session.run(check_all_query)
-                    total_record = check_result.single()
-                    total_chunks = total_record['total_chunks'] if total_record else 0
-                    logger.info(f"🔍 Total chunks in chat (without filter): {total_chunks}")
-
-                    if total_chunks > 0:
-                        logger.info(f"🔄 Falling back to all files in chat (published filter returned 0 chunks but {total_chunks} exist)")
-                        # Fall back to querying all files
-                        if parent_chat_id:
-                            fallback_query = f"""
-                            MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
-                            WHERE c.chatId = '{chat_id}' OR c.chatId = '{parent_chat_id}'
-                            RETURN c.id AS id, c.text AS text, c.embedding AS embedding, d.filename AS filename, c.chatId AS source_chat
-                            """
-                        else:
-                            fallback_query = f"""
-                            MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
-                            WHERE c.chatId = '{chat_id}'
-                            RETURN c.id AS id, c.text AS text, c.embedding AS embedding, d.filename AS filename, c.chatId AS source_chat
-                            """
-
-                        fallback_results = session.run(fallback_query)
-                        chunk_scores = []
-                        for record in fallback_results:
-                            chunk_embedding = record["embedding"]
-                            if chunk_embedding:
-                                similarity = cosine_similarity(
-                                    np.array(question_embedding),
-                                    np.array(chunk_embedding)
-                                )
-                                filename_lower = record["filename"].lower() if record["filename"] else ""
-                                filename_boost = 0.1 if any(word in filename_lower for word in question_lower.split()) else 0
-                                chunk_scores.append({
-                                    "chunk_id": record["id"],
-                                    "chunk_text": record["text"],
-                                    "score": similarity + filename_boost,
-                                    "filename": record["filename"]
-                                })
-
-                        chunk_scores.sort(key=lambda x: x["score"], reverse=True)
-                        top_chunks = chunk_scores[:8]
-                        logger.info(f"✅ Fallback query found {len(top_chunks)} chunks")
-
-                if not top_chunks:
-                    logger.warning(f"No relevant chunks found for question in chat {chat_id}, AI will respond without context")
-
-                # Prepare context for the AI model
-                context_text = "\n\n".join([
-                    f"[Chunk {i}] From {chunk['filename']}: {chunk['chunk_text']}"
-                    for i, chunk in enumerate(top_chunks)
-                ]) if top_chunks else ""
-
-                # Build the prompt - adjust based on whether we have context
-                if top_chunks:
-                    system_prompt = custom_prompt if custom_prompt else f"""You are a helpful AI assistant with access to a knowledge graph built from the user's documents. You have the following context from their documents:
+        # Published context files restrict retrieval; subchats also search their parent chat
+        published_file_ids = [file["fileId"] for file in published_context_files] if published_context_files else None
+        if published_file_ids:
+            logger.info(f"📋 Using published files only: {len(published_file_ids)} files")
+
+        if retrieved_chunks is None:
+            # Optional MMR diversity re-ranking of the candidate pool (chat settings)
+            mmr = mmr_policy(merged_settings)
+            retrieval = await retrieval_engine.retrieve(
+                question, chat_id, top_k=CONTEXT_MAX_CHUNKS, file_ids=published_file_ids,
+                fallback_to_all_files=True, boost_style=BOOST_SIMPLE,
+                candidate_pool=mmr["candidate_pool"] if mmr else RETRIEVAL_CANDIDATE_POOL,
+                mmr_lambda=mmr["lambda"] if mmr else None, expand_graph=payload.expand_graph
+            )
+            retrieved_chunks = retrieval.chunks
+        # Fill the model's context budget in relevance order instead of a fixed chunk count
+        context = assemble_context(retrieved_chunks, context_token_budget(selected_model, max_tokens, question))
+        top_chunks = context.chunks
+        logger.info(f"🔍 Using {len(top_chunks)} of {context.candidates} scored chunks "
+                    f"({context.tokens_used}/{context.token_budget} context tokens, stop: {context.stop_reason})")
+
+        if not top_chunks:
+            logger.warning(f"No relevant chunks found for question in chat {chat_id}, AI will respond without context")
+
+        # Prepare context for the AI model
+        context_text = "\n\n".join([
+            f"[Chunk {i}] From {chunk['filename']}: {chunk['chunk_text']}"
+            for i, chunk in enumerate(top_chunks)
+        ]) if top_chunks else ""
+
+        # Build the prompt - adjust based on whether we have context
+        if top_chunks:
+            system_prompt = custom_prompt if custom_prompt else f"""You are a helpful AI assistant with access to a knowledge graph built from the user's documents. You have the following context from their documents:
 
 IMPORTANT INSTRUCTIONS:
 1. ALWAYS prioritize using the provided context to answer the user's question
@@ -4729,150 +5216,151 @@ For example:
 - "The document shows [^2] that species interactions..."
 
 RESPOND IN MARKDOWN FORMAT WITH CITATIONS"""
-                else:
-                    system_prompt = custom_prompt if custom_prompt else """You are a helpful AI assistant. The user has asked a question but there is no relevant context available from their uploaded documents. Please answer the question to the best of your ability using your general knowledge.
+        else:
+            system_prompt = custom_prompt if custom_prompt else """You are a helpful AI assistant. The user has asked a question but there is no relevant context available from their uploaded documents. Please answer the question to the best of your ability using your general knowledge.
 
 Note: If the user is asking about specific documents or uploaded content, let them know that you don't have access to relevant context from their documents.
 
 RESPOND IN MARKDOWN FORMAT"""
 
-                # Create messages for the AI model
-                if top_chunks:
-                    messages = [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": f"Context:\n{context_text}\n\nQuestion: {question}"}
-                    ]
-                else:
-                    messages = [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": f"Question: {question}"}
-                    ]
-
-                # Check credits BEFORE making expensive OpenAI call
-                # Get chat owner ID (same as frontend) for credit charging
-                # This ensures API and frontend charge the same account
-                user_id_to_charge = None
-                try:
-                    async with httpx.AsyncClient() as client:
-                        chat_response = await client.post(
-                            f"{os.getenv('CONVEX_URL', 'https://agile-ermine-199.convex.cloud')}/api/run/chats/getChatByIdExposed",
-                            json={"args": {"id": chat_id}, "format": "json"},
-                            headers={"Content-Type": "application/json"}
-                        )
-                        if chat_response.status_code == 200:
-                            chat_data = chat_response.json()
-                            if chat_data.get("value"):
-                                user_id_to_charge = chat_data["value"].get("userId")
-                                logger.info(f"💳 Found chat owner {user_id_to_charge} for chat {chat_id}")
-                except Exception as e:
-                    logger.warning(f"Failed to get chat owner: {e}, using chat_id as fallback")
+        # Create messages for the AI model
+        if top_chunks:
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"Context:\n{context_text}\n\nQuestion: {question}"}
+            ]
+        else:
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"Question: {question}"}
+            ]
 
-                if not user_id_to_charge:
-                    logger.warning(f"⚠️ Could not find chat owner ID for {chat_id}, using chat_id as fallback")
-                    user_id_to_charge = chat_id
+        # Check credits BEFORE making expensive OpenAI call
+        # Get chat owner ID (same as frontend) for credit charging
+        # This ensures API and frontend charge the same account
+        user_id_to_charge = None
+        try:
+            async with httpx.AsyncClient() as client:
+                chat_response = await client.post(
+                    f"{os.getenv('CONVEX_URL', 'https://agile-ermine-199.convex.cloud')}/api/run/chats/getChatByIdExposed",
+                    json={"args": {"id": chat_id}, "format": "json"},
+                    headers={"Content-Type": "application/json"}
+                )
+                if chat_response.status_code == 200:
+                    chat_data = chat_response.json()
+                    if chat_data.get("value"):
+                        user_id_to_charge = chat_data["value"].get("userId")
+                        logger.info(f"💳 Found chat owner {user_id_to_charge} for chat {chat_id}")
+        except Exception as e:
+            logger.warning(f"Failed to get chat owner: {e}, using chat_id as fallback")
 
-                try:
-                    # Estimate tokens for credit validation (rough estimate)
-                    estimated_tokens = len(question) // 4 + max_tokens  # Prompt + max response
-                    required_credits = calculate_credits_used(estimated_tokens, selected_model)
+        if not user_id_to_charge:
+            logger.warning(f"⚠️ Could not find chat owner ID for {chat_id}, using chat_id as fallback")
+            user_id_to_charge = chat_id
 
-                    # Check if chat owner has sufficient credits (same as frontend)
-                    credit_info = await check_user_credits(user_id_to_charge, required_credits)
-                    if not credit_info["has_sufficient"]:
-                        logger.error(f"💳 Insufficient credits: need {required_credits}, have {credit_info['remaining']}")
-                        raise InsufficientCreditsError(required_credits, credit_info["remaining"])
+        try:
+            # Estimate tokens for credit validation (rough estimate)
+            estimated_tokens = len(question) // 4 + max_tokens  # Prompt + max response
+            required_credits = calculate_credits_used(estimated_tokens, selected_model)
 
-                    logger.info(f"💳 Credit check passed for chat owner {user_id_to_charge}: {credit_info['remaining']} credits available, need ~{required_credits}")
-                except InsufficientCreditsError as e:
-                    # Convert to HTTPException for proper API error response
-                    logger.error(f"💳 Insufficient credits: need {e.required}, have {e.available}")
-                    raise HTTPException(
-                        status_code=402,
-                        detail=f"Insufficient credits. Required: {e.required:.2f}, Available: {e.available:.2f}. Please add credits to continue."
-                    )
-                except Exception as e:
-                    logger.error(f"💳 Error checking credits: {e}")
-                    # For API calls, we should fail if we can't check credits (security)
-                    raise HTTPException(
-                        status_code=500,
-                        detail="Failed to verify credit balance. Please try again."
-                    )
+            # Check if chat owner has sufficient credits (same as frontend)
+            credit_info = await check_user_credits(user_id_to_charge, required_credits)
+            if not credit_info["has_sufficient"]:
+                logger.error(f"💳 Insufficient credits: need {required_credits}, have {credit_info['remaining']}")
+                raise InsufficientCreditsError(required_credits, credit_info["remaining"])
 
-                # Call OpenAI API or Grok API based on unhinged mode
-                if unhinged_mode:
-                    # Create a separate OpenAI client for Grok (xAI)
-                    xai_api_key = os.getenv("XAI_API_KEY", "")
-                    if not xai_api_key:
-                        logger.warning("⚠️ Unhinged mode requested but XAI_API_KEY not set, falling back to OpenAI")
-                        client = openai.OpenAI()
-                        response = client.chat.completions.create(
-                            model=selected_model,
-                            messages=messages,
-                            temperature=temperature,
-                            max_tokens=max_tokens
-                        )
-                    else:
-                        # Use xAI's Grok API
-                        grok_client = OpenAI(
-                            api_key=xai_api_key,
-                            base_url="https://api.x.ai/v1"
-                        )
-                        logger.info("🔥 Using Grok's unhinged AI model")
-                        response = grok_client.chat.completions.create(
-                            model="grok-3",  # Use Grok's latest model
-                            messages=messages,
-                            temperature=temperature,
-                            max_tokens=max_tokens
-                        )
-                else:
-                    # Use regular OpenAI
-                    client = openai.OpenAI()
-                    response = client.chat.completions.create(
-                        model=selected_model,
-                        messages=messages,
-                        temperature=temperature,
-                        max_tokens=max_tokens
-                    )
+            logger.info(f"💳 Credit check passed for chat owner {user_id_to_charge}: {credit_info['remaining']} credits available, need ~{required_credits}")
+        except InsufficientCreditsError as e:
+            # Convert to HTTPException for proper API error response
+            logger.error(f"💳 Insufficient credits: need {e.required}, have {e.available}")
+            raise HTTPException(
+                status_code=402,
+                detail=f"Insufficient credits. Required: {e.required:.2f}, Available: {e.available:.2f}. Please add credits to continue."
+            )
+        except Exception as e:
+            logger.error(f"💳 Error checking credits: {e}")
+            # For API calls, we should fail if we can't check credits (security)
+            raise HTTPException(
+                status_code=500,
+                detail="Failed to verify credit balance. Please try again."
+            )
 
-                answer = response.choices[0].message.content
+        # Call OpenAI API or Grok API based on unhinged mode
+        if unhinged_mode:
+            # Create a separate OpenAI client for Grok (xAI)
+            xai_api_key = os.getenv("XAI_API_KEY", "")
+            if not xai_api_key:
+                logger.warning("⚠️ Unhinged mode requested but XAI_API_KEY not set, falling back to OpenAI")
+                client = openai.OpenAI()
+                response = client.chat.completions.create(
+                    model=selected_model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
+            else:
+                # Use xAI's Grok API
+                grok_client = OpenAI(
+                    api_key=xai_api_key,
+                    base_url="https://api.x.ai/v1"
+                )
+                logger.info("🔥 Using Grok's unhinged AI model")
+                response = grok_client.chat.completions.create(
+                    model="grok-3",  # Use Grok's latest model
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
+        else:
+            # Use regular OpenAI
+            client = openai.OpenAI()
+            response = client.chat.completions.create(
+                model=selected_model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
 
-                # Consume credits based on actual usage (use chat owner, same as frontend)
-                # Skip developer lookup since we already have the correct user_id_to_charge
-                try:
-                    credits_consumed = await consume_credits_for_actual_usage(
-                        user_id=user_id_to_charge,
-                        model=selected_model,
-                        question=question,
-                        response=answer,
-                        chat_id=chat_id,
-                        skip_developer_lookup=True  # Use chat owner, not developer
-                    )
-                    logger.info(f"💳 Consumed {credits_consumed} credits for {selected_model} based on actual usage (chat: {chat_id}, user: {user_id_to_charge})")
-                except InsufficientCreditsError as e:
-                    # This should be very rare since we checked before the call
-                    # But handle gracefully - return answer but log the issue
-                    logger.error(f"💳 CREDIT ERROR after API call: need {e.required}, have {e.available}")
-                    logger.warning(f"💳 Allowing response despite insufficient credits - this should be monitored")
-                except Exception as e:
-                    logger.error(f"💳 Error consuming credits: {e}")
-                    # Still return the answer even if credit consumption fails
-                    logger.warning(f"💳 Allowing response despite credit consumption error")
+        answer = response.choices[0].message.content
 
-                # Format context for response
-                formatted_context = [
-                    ChunkScore(
-                        chunk_id=chunk["chunk_id"],
-                        chunk_text=chunk["chunk_text"],
-                        score=chunk["score"]
-                    ) for chunk in top_chunks
-                ]
+        # Consume credits based on actual usage (use chat owner, same as frontend)
+        # Skip developer lookup since we already have the correct user_id_to_charge
+        try:
+            credits_consumed = await consume_credits_for_actual_usage(
+                user_id=user_id_to_charge,
+                model=selected_model,
+                question=question,
+                response=answer,
+                chat_id=chat_id,
+                skip_developer_lookup=True  # Use chat owner, not developer
+            )
+            logger.info(f"💳 Consumed {credits_consumed} credits for {selected_model} based on actual usage (chat: {chat_id}, user: {user_id_to_charge})")
+        except InsufficientCreditsError as e:
+            # This should be very rare since we checked before the call
+            # But handle gracefully - return answer but log the issue
+            logger.error(f"💳 CREDIT ERROR after API call: need {e.required}, have {e.available}")
+            logger.warning(f"💳 Allowing response despite insufficient credits - this should be monitored")
+        except Exception as e:
+            logger.error(f"💳 Error consuming credits: {e}")
+            # Still return the answer even if credit consumption fails
+            logger.warning(f"💳 Allowing response despite credit consumption error")
+
+        # Format context for response
+        formatted_context = [
+            ChunkScore(
+                chunk_id=chunk["chunk_id"],
+                chunk_text=chunk["chunk_text"],
+                score=chunk["score"]
+            ) for chunk in top_chunks
+        ]
 
-                logger.info(f"✅ Successfully answered question for chat {chat_id} using {len(top_chunks)} chunks")
+        logger.info(f"✅ Successfully answered question for chat {chat_id} using {len(top_chunks)} chunks")
 
-                return AnswerWithContext(
-                    answer=answer,
-                    context=formatted_context
-                )
+        return AnswerWithContext(
+            answer=answer,
+            context=formatted_context,
+            context_usage=context.stats()
+        )
 
     except Exception as e:
         logger.error(f"❌ Error in answer_question_with_published_context: {str(e)}")
@@ -4947,147 +5435,39 @@ async def answer_question(payload: QuestionRequest):
             logger.warning(f"Failed to retrieve conversation history for chat {chat_id}: {e}")
             conversation_history = []
 
-        # Generate question embedding
-        question_embedding = get_embedding(question)
-
-        # Get scope configuration and filters
-        scope_config = await get_scope_config(chat_id)
+        # Retrieve context: subchat -> parent inheritance and scope filters
         scope_filters = payload.scope_filters if hasattr(payload, 'scope_filters') else {}
-        scope_where_clause = build_scope_where_clause(scope_filters, "c", scope_config)
-
         if scope_filters:
             logger.info(f"📊 Applying scope filters: {scope_filters}")
 
-        # Check if this is a subchat and get parent chat ID for file inheritance
-        parent_chat_id = None
-        logger.info(f"🔍 Checking if {chat_id} is a subchat...")
-        if chat_id.startswith("subchat_"):
-            # Extract app_id from subchat format: subchat_{app_id}_{user_id}_{timestamp}
-            # The app_id format is: app_xxxxx_xxxxx, so we need to find where "user_" starts
-            parts = chat_id.split("_")
-            logger.info(f"🔍 Subchat detected: {chat_id}, parts: {parts}")
-
-            # Find the index where "user" appears to determine app_id boundary
-            user_index = -1
-            for i, part in enumerate(parts):
-                if part == "user" and i > 1:  # "user" should not be the first or second part
-                    user_index = i
-                    break
-
-            if user_index > 1:
-                # Reconstruct app_id from parts[1] to parts[user_index-1]
-                app_id = "_".join(parts[1:user_index])
-                logger.info(f"🔍 Extracted app_id: {app_id}, calling get_parent_chat_id_from_app...")
-                parent_chat_id = await get_parent_chat_id_from_app(app_id)
-                logger.info(f"🔍 get_parent_chat_id_from_app returned: {parent_chat_id}")
-                if parent_chat_id:
-                    logger.info(f"🔗 Subchat {chat_id} inheriting ALL files from parent chat {parent_chat_id}")
-                else:
-                    logger.warning(f"⚠️ No parent chat ID found for app {app_id}")
-            else:
-                logger.warning(f"⚠️ Malformed subchat ID - could not find user boundary: {chat_id}")
-        else:
-            logger.info(f"ℹ️ Not a subchat: {chat_id}")
+        # Top 10 chunks for cleaner citations; graph-expansion neighbours of those 10 follow them
+        retrieval = await retrieval_engine.retrieve(
+            question, chat_id, top_k=10, scope_filters=scope_filters, expand_graph=payload.expand_graph
+        )
+        top_chunks = [
+            ChunkScore(
+                chunk_id=chunk["chunk_id"],
+                chunk_text=chunk["chunk_text"],
+                score=float(chunk["score"])
+            )
+            for chunk in retrieval.chunks
+        ]
 
-        # Fetch chunks from Neo4j with document metadata for filename-based queries
-        with GraphDatabase.driver(neo4j_uri, auth=(neo4j_user, neo4j_password)) as driver:
-            with driver.session() as session:
-                # Enhanced query to include document filename for better context matching
-                if parent_chat_id:
-                    # Include chunks from both subchat and parent chat (all files)
-                    query = f"""
-                    MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
-                    WHERE (c.chatId = '{chat_id}' OR c.chatId = '{parent_chat_id}'){scope_where_clause}
-                    RETURN c.id AS id, c.text AS text, c.embedding AS embedding, d.filename AS filename, c.chatId AS source_chat
-                    """
-                    logger.info(f"📋 Including ALL files from subchat and parent chat {parent_chat_id} with scope filters")
-                else:
-                    query = f"""
-                    MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
-                    WHERE c.chatId = '{chat_id}'{scope_where_clause}
-                    RETURN c.id AS id, c.text AS text, c.embedding AS embedding, d.filename AS filename, c.chatId AS source_chat
-                    """
-                    logger.info(f"📋 Using subchat files only with scope filters")
-                results = session.run(query)
-
-
-                # Calculate similarities with filename boost
-                chunk_scores = []
-                question_lower = question.lower()
-
-                for record in results:
-                    chunk_id = record["id"]
-                    chunk_text = record["text"]
-                    chunk_embedding = record["embedding"]
-                    filename = record["filename"] or ""
-
-                    # Calculate semantic similarity
-                    # Ensure both are numpy arrays with correct dimensions
-                    q_emb = np.array(question_embedding)
-                    c_emb = np.array(chunk_embedding) if isinstance(chunk_embedding, list) else chunk_embedding
-                    semantic_score = cosine_similarity(q_emb, c_emb)
-
-                    # Add filename relevance boost
-                    filename_boost = 0.0
-                    if filename:
-                        filename_lower = filename.lower()
-                        # Remove file extension for better matching
-                        filename_base = filename_lower.replace('.pdf', '').replace('.docx', '').replace('.txt', '')
-
-                        # Check for filename mentions in question
-                        filename_words = filename_base.replace('_', ' ').replace('-', ' ').split()
-                        question_words = question_lower.replace('_', ' ').replace('-', ' ').split()
-
-                        # Boost score if filename words appear in question
-                        for fname_word in filename_words:
-                            if len(fname_word) > 2:  # Skip very short words
-                                for q_word in question_words:
-                                    if fname_word in q_word or q_word in fname_word:
-                                        filename_boost += 0.1
-
-                        # Additional boost for exact filename matches
-                        if any(fname_word in question_lower for fname_word in filename_words if len(fname_word) > 3):
-                            filename_boost += 0.2
-
-                    # Combine semantic similarity with filename relevance
-                    final_score = semantic_score + filename_boost
-
-                    chunk_scores.append(ChunkScore(
-                        chunk_id=chunk_id,
-                        chunk_text=chunk_text,
-                        score=float(final_score)
-                    ))
+        # Generate answer using GPT-4 with citations
+        top_chunks_for_citations = top_chunks
 
-                # Sort and get top chunks
-                chunk_scores.sort(key=lambda x: x.score, reverse=True)
-                top_k = 50
-                top_chunks = chunk_scores[:top_k]
+        # Document names come back with the retrieved chunks
+        chunk_document_info = {chunk["chunk_id"]: chunk["filename"] for chunk in retrieval.chunks if chunk.get("filename")}
 
-                # Generate answer using GPT-4 with citations
-                # Limit to top 10 chunks for cleaner citations
-                top_chunks_for_citations = top_chunks[:10]
+        context_with_ids = "\n\n---\n\n".join([
+            f"[CHUNK_{i}] (from document: {chunk_document_info.get(chunk.chunk_id, 'Unknown')}) {chunk.chunk_text}"
+            for i, chunk in enumerate(top_chunks_for_citations)
+        ])
 
-                # Get document information for each chunk to provide better context
-                chunk_document_info = {}
-                for chunk in top_chunks_for_citations:
-                    doc_query = f"""
-                    MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk {{id: '{chunk.chunk_id}'}})
-                    RETURN d.filename AS filename
-                    """
-                    doc_result = session.run(doc_query)
-                    doc_record = doc_result.single()
-                    if doc_record:
-                        chunk_document_info[chunk.chunk_id] = doc_record['filename']
-
-                context_with_ids = "\n\n---\n\n".join([
-                    f"[CHUNK_{i}] (from document: {chunk_document_info.get(chunk.chunk_id, 'Unknown')}) {chunk.chunk_text}"
-                    for i, chunk in enumerate(top_chunks_for_citations)
-                ])
-
-                # Use custom prompt if provided, otherwise use default system prompt
-                if custom_prompt:
-                    # Use custom prompt but ensure context is included
-                    system_prompt = f"""
+        # Use custom prompt if provided, otherwise use default system prompt
+        if custom_prompt:
+            # Use custom prompt but ensure context is included
+            system_prompt = f"""
                     {custom_prompt}
 
                     You have the following context with chunk IDs (0-{len(top_chunks_for_citations)-1}):
@@ -5097,9 +5477,9 @@ async def answer_question(payload: QuestionRequest):
                     When you reference information from the context, add a citation using this format: [^{{i}}] where {{i}} is the chunk number (0-{len(top_chunks_for_citations)-1})
                     Only use citations [^0] through [^{len(top_chunks_for_citations)-1}]. Do not use citation numbers higher than {len(top_chunks_for_citations)-1}
                     """.strip()
-                else:
-                    # Default system prompt
-                    system_prompt = f"""
+        else:
+            # Default system prompt
+            system_prompt = f"""
                     You are a helpful assistant. You have the following context with chunk IDs (0-{len(top_chunks_for_citations)-1}):
 
                     {context_with_ids}
@@ -5119,106 +5499,106 @@ async def answer_question(payload: QuestionRequest):
                     RESPOND IN MARKDOWN FORMAT WITH CITATIONS
                     """.strip()
 
-                # Estimate tokens for credit validation (rough estimate)
-                estimated_tokens = len(question) // 4 + max_tokens  # Prompt + max response
+        # Estimate tokens for credit validation (rough estimate)
+        estimated_tokens = len(question) // 4 + max_tokens  # Prompt + max response
 
-                # Get user ID from chat data for proper credit consumption
-                user_id = None
-                try:
-                    # Get chat data to find the user ID
-                    async with httpx.AsyncClient() as client:
-                        chat_response = await client.post(
-                            CONVEX_URL,
-                            json={
-                                "args": {"id": chat_id},
-                                "format": "json"
-                            }
-                        )
+        # Get user ID from chat data for proper credit consumption
+        user_id = None
+        try:
+            # Get chat data to find the user ID
+            async with httpx.AsyncClient() as client:
+                chat_response = await client.post(
+                    CONVEX_URL,
+                    json={
+                        "args": {"id": chat_id},
+                        "format": "json"
+                    }
+                )
 
-                        if chat_response.status_code == 200:
-                            chat_data = chat_response.json()
-                            if chat_data.get("value"):
-                                user_id = chat_data["value"].get("userId")
-                                logger.info(f"🔍 Found user ID for chat {chat_id}: {user_id}")
+                if chat_response.status_code == 200:
+                    chat_data = chat_response.json()
+                    if chat_data.get("value"):
+                        user_id = chat_data["value"].get("userId")
+                        logger.info(f"🔍 Found user ID for chat {chat_id}: {user_id}")
 
-                    if not user_id:
-                        logger.warning(f"Could not find user ID for chat {chat_id}, using chat_id as fallback")
-                        user_id = chat_id
+            if not user_id:
+                logger.warning(f"Could not find user ID for chat {chat_id}, using chat_id as fallback")
+                user_id = chat_id
 
-                except Exception as e:
-                    logger.warning(f"Failed to get user ID from chat: {e}, using chat_id as fallback")
-                    user_id = chat_id
-
-                # Build messages with conversation history for context
-                messages = [{"role": "system", "content": system_prompt}]
-
-                # Add conversation history (limit based on chat setting to avoid token limits)
-                if history_limit > 0:
-                    history_limit_int = int(history_limit)  # Ensure it's an integer for slicing
-                    recent_history = conversation_history[-history_limit_int:] if len(conversation_history) > history_limit_int else conversation_history
-                    messages.extend(recent_history)
-
-                # Add current question
-                messages.append({"role": "user", "content": question})
-
-                # Make AI call first to get actual token usage
-                # Use Grok's unhinged AI if unhinged mode is enabled
-                if unhinged_mode:
-                    # Create a separate OpenAI client for Grok (xAI)
-                    xai_api_key = os.getenv("XAI_API_KEY", "")
-                    if not xai_api_key:
-                        logger.warning("⚠️ Unhinged mode requested but XAI_API_KEY not set, falling back to OpenAI")
-                        completion = openai.chat.completions.create(
-                            model=selected_model,
-                            messages=messages,
-                            temperature=temperature,
-                            max_tokens=max_tokens
-                        )
-                    else:
-                        # Use xAI's Grok API
-                        grok_client = OpenAI(
-                            api_key=xai_api_key,
-                            base_url="https://api.x.ai/v1"
-                        )
-                        logger.info("🔥 Using Grok's unhinged AI model")
-                        completion = grok_client.chat.completions.create(
-                            model="grok-3",  # Use Grok's latest model (grok-beta deprecated)
-                            messages=messages,
-                            temperature=temperature,
-                            max_tokens=max_tokens
-                        )
-                else:
-                    # Use regular OpenAI
-                    completion = openai.chat.completions.create(
-                        model=selected_model,
-                        messages=messages,
-                        temperature=temperature,
-                        max_tokens=max_tokens
-                    )
+        except Exception as e:
+            logger.warning(f"Failed to get user ID from chat: {e}, using chat_id as fallback")
+            user_id = chat_id
 
-                answer = completion.choices[0].message.content.strip()
+        # Build messages with conversation history for context
+        messages = [{"role": "system", "content": system_prompt}]
 
-                # Now consume credits based on actual usage
-                try:
-                    credits_consumed = await consume_credits_for_actual_usage(
-                        user_id=user_id,
-                        model=selected_model,
-                        question=question,
-                        response=answer,
-                        chat_id=chat_id
-                    )
-                    logger.info(f"💳 Consumed {credits_consumed} credits for {selected_model} based on actual usage")
-                except InsufficientCreditsError as e:
-                    # Note: This is unusual since we've already made the AI call
-                    # But we still need to handle the case where the developer runs out of credits
-                    logger.error(f"💳 CREDIT ERROR after API call: need {e.required}, have {e.available}")
-                    # We could either:
-                    # 1. Return the answer anyway (developer gets a free response)
-                    # 2. Return an error (lose the API response)
-                    # For now, we'll return the answer but log the issue
-                    logger.warning(f"💳 Allowing response due to insufficient credits - this should be monitored")
+        # Add conversation history (limit based on chat setting to avoid token limits)
+        if history_limit > 0:
+            history_limit_int = int(history_limit)  # Ensure it's an integer for slicing
+            recent_history = conversation_history[-history_limit_int:] if len(conversation_history) > history_limit_int else conversation_history
+            messages.extend(recent_history)
 
-                return AnswerWithContext(answer=answer, context=top_chunks_for_citations)
+        # Add current question
+        messages.append({"role": "user", "content": question})
+
+        # Make AI call first to get actual token usage
+        # Use Grok's unhinged AI if unhinged mode is enabled
+        if unhinged_mode:
+            # Create a separate OpenAI client for Grok (xAI)
+            xai_api_key = os.getenv("XAI_API_KEY", "")
+            if not xai_api_key:
+                logger.warning("⚠️ Unhinged mode requested but XAI_API_KEY not set, falling back to OpenAI")
+                completion = openai.chat.completions.create(
+                    model=selected_model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
+            else:
+                # Use xAI's Grok API
+                grok_client = OpenAI(
+                    api_key=xai_api_key,
+                    base_url="https://api.x.ai/v1"
+                )
+                logger.info("🔥 Using Grok's unhinged AI model")
+                completion = grok_client.chat.completions.create(
+                    model="grok-3",  # Use Grok's latest model (grok-beta deprecated)
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
+        else:
+            # Use regular OpenAI
+            completion = openai.chat.completions.create(
+                model=selected_model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+
+        answer = completion.choices[0].message.content.strip()
+
+        # Now consume credits based on actual usage
+        try:
+            credits_consumed = await consume_credits_for_actual_usage(
+                user_id=user_id,
+                model=selected_model,
+                question=question,
+                response=answer,
+                chat_id=chat_id
+            )
+            logger.info(f"💳 Consumed {credits_consumed} credits for {selected_model} based on actual usage")
+        except InsufficientCreditsError as e:
+            # Note: This is unusual since we've already made the AI call
+            # But we still need to handle the case where the developer runs out of credits
+            logger.error(f"💳 CREDIT ERROR after API call: need {e.required}, have {e.available}")
+            # We could either:
+            # 1. Return the answer anyway (developer gets a free response)
+            # 2. Return an error (lose the API response)
+            # For now, we'll return the answer but log the issue
+            logger.warning(f"💳 Allowing response due to insufficient credits - this should be monitored")
+
+        return AnswerWithContext(answer=answer, context=top_chunks_for_citations)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -5250,114 +5630,39 @@ async def answer_question_stream_with_published_context(payload: QuestionRequest
 
         logger.info(f"🔍 Processing streaming question for chat {chat_id} using published context files")
 
-        # Generate question embedding
-        question_embedding = get_embedding(question)
-
-        # Check if this is a subchat and get parent chat ID for file inheritance
-        parent_chat_id = None
-        if chat_id.startswith("subchat_"):
-            # Extract app_id from subchat format: subchat_{app_id}_{user_id}_{timestamp}
-            # The app_id format is: app_xxxxx_xxxxx, so we need to find where "user_" starts
-            parts = chat_id.split("_")
-
-            # Find the index where "user" appears to determine app_id boundary
-            user_index = -1
-            for i, part in enumerate(parts):
-                if part == "user" and i > 1:  # "user" should not be the first or second part
-                    user_index = i
-                    break
-
-            if user_index > 1:
-                # Reconstruct app_id from parts[1] to parts[user_index-1]
-                app_id = "_".join(parts[1:user_index])
-                parent_chat_id = await get_parent_chat_id_from_app(app_id)
-                if parent_chat_id:
-                    logger.info(f"🔗 Subchat {chat_id} inheriting ALL files from parent chat {parent_chat_id} (streaming)")
-
-        # Fetch chunks from Neo4j, filtering by published context files if provided
-        with GraphDatabase.driver(neo4j_uri, auth=(neo4j_user, neo4j_password)) as driver:
-            with driver.session() as session:
-                if published_context_files:
-                    # Filter to only use chunks from published files
-                    published_file_ids = [file["fileId"] for file in published_context_files]
-                    file_ids_str = "', '".join(published_file_ids)
-
-                    if parent_chat_id:
-                        # Include chunks from both subchat and parent chat
-                        query = f"""
-                        MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
-                        WHERE (c.chatId = '{chat_id}' OR c.chatId = '{parent_chat_id}') AND d.id IN ['{file_ids_str}']
-                        RETURN c.id AS id, c.text AS text, c.embedding AS embedding, d.filename AS filename, c.chatId AS source_chat
-                        """
-                        logger.info(f"📋 Using published files from subchat and parent (streaming): {len(published_context_files)} files")
-                    else:
-                        query = f"""
-                        MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
-                        WHERE c.chatId = '{chat_id}' AND d.id IN ['{file_ids_str}']
-                        RETURN c.id AS id, c.text AS text, c.embedding AS embedding, d.filename AS filename, c.chatId AS source_chat
-                        """
-                        logger.info(f"📋 Using published files only: {len(published_context_files)} files")
-                else:
-                    # Use all files (fallback for backwards compatibility)
-                    if parent_chat_id:
-                        # Include chunks from both subchat and parent chat
-                        query = f"""
-                        MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
-                        WHERE c.chatId = '{chat_id}' OR c.chatId = '{parent_chat_id}'
-                        RETURN c.id AS id, c.text AS text, c.embedding AS embedding, d.filename AS filename, c.chatId AS source_chat
-                        """
-                        logger.info(f"📋 Using ALL files from subchat and parent chat {parent_chat_id} (streaming)")
-                    else:
-                        query = f"""
-                        MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
-                        WHERE c.chatId = '{chat_id}'
-                        RETURN c.id AS id, c.text AS text, c.embedding AS embedding, d.filename AS filename, c.chatId AS source_chat
-                        """
-                        logger.info(f"📋 Using all available subchat files (streaming)")
-
-                results = session.run(query)
-
-                # Calculate similarities
-                chunk_scores = []
-                question_lower = question.lower()
-
-                for record in results:
-                    chunk_embedding = record["embedding"]
-                    if chunk_embedding:
-                        similarity = cosine_similarity(
-                            np.array(question_embedding),
-                            np.array(chunk_embedding)
-                        )
-
-                        # Boost score if filename is mentioned in question
-                        filename_lower = record["filename"].lower() if record["filename"] else ""
-                        filename_boost = 0.1 if any(word in filename_lower for word in question_lower.split()) else 0
-
-                        chunk_scores.append({
-                            "chunk_id": record["id"],
-                            "chunk_text": record["text"],
-                            "score": similarity + filename_boost,
-                            "filename": record["filename"]
-                        })
-
-                # Sort by similarity score and get top chunks
-                chunk_scores.sort(key=lambda x: x["score"], reverse=True)
-                top_chunks = chunk_scores[:8]
-
-                if not top_chunks:
-                    logger.warning(f"No relevant chunks found for streaming question in chat {chat_id}, AI will respond without context")
-                    # Still proceed to call OpenAI, but without context (consistent with non-streaming endpoint)
-                    context_text = ""
-                else:
-                    # Prepare context for the AI model
-                    context_text = "\n\n".join([
-                        f"[Chunk {i}] From {chunk['filename']}: {chunk['chunk_text']}"
-                        for i, chunk in enumerate(top_chunks)
-                    ])
+        # Published context files restrict retrieval; subchats also search their parent chat
+        published_file_ids = [file["fileId"] for file in published_context_files] if published_context_files else None
+        if published_file_ids:
+            logger.info(f"📋 Using published files only (streaming): {len(published_file_ids)} files")
+
+        # Optional MMR diversity re-ranking of the candidate pool (chat settings)
+        mmr = mmr_policy(merged_settings)
+        retrieval = await retrieval_engine.retrieve(
+            question, chat_id, top_k=CONTEXT_MAX_CHUNKS, file_ids=published_file_ids,
+            fallback_to_all_files=True, boost_style=BOOST_SIMPLE,
+            candidate_pool=mmr["candidate_pool"] if mmr else RETRIEVAL_CANDIDATE_POOL,
+            mmr_lambda=mmr["lambda"] if mmr else None, expand_graph=payload.expand_graph
+        )
+        # Fill the model's context budget in relevance order instead of a fixed chunk count
+        context = assemble_context(retrieval.chunks, context_token_budget(selected_model, max_tokens, question))
+        top_chunks = context.chunks
+        logger.info(f"🔍 Streaming with {len(top_chunks)} of {context.candidates} scored chunks "
+                    f"({context.tokens_used}/{context.token_budget} context tokens, stop: {context.stop_reason})")
+
+        if not top_chunks:
+            logger.warning(f"No relevant chunks found for streaming question in chat {chat_id}, AI will respond without context")
+            # Still proceed to call OpenAI, but without context (consistent with non-streaming endpoint)
+            context_text = ""
+        else:
+            # Prepare context for the AI model
+            context_text = "\n\n".join([
+                f"[Chunk {i}] From {chunk['filename']}: {chunk['chunk_text']}"
+                for i, chunk in enumerate(top_chunks)
+            ])
 
-                # Build the prompt
-                if top_chunks:
-                    system_prompt = custom_prompt if custom_prompt else f"""You are a helpful AI assistant with access to a knowledge graph built from the user's documents. You have the following context from their documents:
+        # Build the prompt
+        if top_chunks:
+            system_prompt = custom_prompt if custom_prompt else f"""You are a helpful AI assistant with access to a knowledge graph built from the user's documents. You have the following context from their documents:
 
 IMPORTANT INSTRUCTIONS:
 1. ALWAYS prioritize using the provided context to answer the user's question
@@ -5373,226 +5678,226 @@ For example:
 - "The document shows [^2] that species interactions..."
 
 RESPOND IN MARKDOWN FORMAT WITH CITATIONS"""
-                else:
-                    system_prompt = custom_prompt if custom_prompt else """You are a helpful AI assistant. The user has asked a question but there is no relevant context available from their uploaded documents. Please answer the question to the best of your ability using your general knowledge.
+        else:
+            system_prompt = custom_prompt if custom_prompt else """You are a helpful AI assistant. The user has asked a question but there is no relevant context available from their uploaded documents. Please answer the question to the best of your ability using your general knowledge.
+
+Note: If the user is asking about specific documents or uploaded content, let them know that you don't have access to relevant context from their documents.
+
+RESPOND IN MARKDOWN FORMAT"""
+
+        # Create messages for the AI model
+        if top_chunks:
+            user_content = f"Context:\n{context_text}\n\nQuestion: {question}"
+        else:
+            user_content = f"Question: {question}"
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content}
+        ]
+
+        # Check credits BEFORE making expensive OpenAI call
+        # Get chat owner ID (same as frontend) for credit charging
+        # This ensures API and frontend charge the same account
+        user_id_to_charge = None
+        try:
+            async with httpx.AsyncClient() as client:
+                chat_response = await client.post(
+                    f"{os.getenv('CONVEX_URL', 'https://agile-ermine-199.convex.cloud')}/api/run/chats/getChatByIdExposed",
+                    json={"args": {"id": chat_id}, "format": "json"},
+                    headers={"Content-Type": "application/json"}
+                )
+                if chat_response.status_code == 200:
+                    chat_data = chat_response.json()
+                    if chat_data.get("value"):
+                        user_id_to_charge = chat_data["value"].get("userId")
+                        logger.info(f"💳 Found chat owner {user_id_to_charge} for streaming chat {chat_id}")
+        except Exception as e:
+            logger.warning(f"Failed to get chat owner for streaming: {e}, using chat_id as fallback")
+
+        if not user_id_to_charge:
+            logger.warning(f"⚠️ Could not find chat owner ID for streaming {chat_id}, using chat_id as fallback")
+            user_id_to_charge = chat_id
 
-Note: If the user is asking about specific documents or uploaded content, let them know that you don't have access to relevant context from their documents.
+        try:
+            # Estimate tokens for credit validation (rough estimate)
+            estimated_tokens = len(question) // 4 + max_tokens  # Prompt + max response
+            required_credits = calculate_credits_used(estimated_tokens, selected_model)
 
-RESPOND IN MARKDOWN FORMAT"""
+            # Check if chat owner has sufficient credits (same as frontend)
+            credit_info = await check_user_credits(user_id_to_charge, required_credits)
+            if not credit_info["has_sufficient"]:
+                logger.error(f"💳 Insufficient credits for streaming: need {required_credits}, have {credit_info['remaining']}")
+                raise InsufficientCreditsError(required_credits, credit_info["remaining"])
 
-                # Create messages for the AI model
-                if top_chunks:
-                    user_content = f"Context:\n{context_text}\n\nQuestion: {question}"
-                else:
-                    user_content = f"Question: {question}"
+            logger.info(f"💳 Credit check passed for streaming chat owner {user_id_to_charge}: {credit_info['remaining']} credits available, need ~{required_credits}")
+        except InsufficientCreditsError as e:
+            # Convert to HTTPException for proper API error response
+            logger.error(f"💳 Insufficient credits for streaming: need {e.required}, have {e.available}")
+            raise HTTPException(
+                status_code=402,
+                detail=f"Insufficient credits. Required: {e.required:.2f}, Available: {e.available:.2f}. Please add credits to continue."
+            )
+        except Exception as e:
+            logger.error(f"💳 Error checking credits for streaming: {e}")
+            # For API calls, we should fail if we can't check credits (security)
+            raise HTTPException(
+                status_code=500,
+                detail="Failed to verify credit balance. Please try again."
+            )
 
-                messages = [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_content}
-                ]
+        # Stream response from OpenAI or Grok based on unhinged mode
+        if unhinged_mode:
+            # Create a separate OpenAI client for Grok (xAI)
+            xai_api_key = os.getenv("XAI_API_KEY", "")
+            if not xai_api_key:
+                logger.warning("⚠️ Unhinged mode requested but XAI_API_KEY not set, falling back to OpenAI")
+                client = openai.OpenAI()
+                logger.info(f"🔄 Creating OpenAI stream (unhinged fallback) with model={selected_model}, messages={len(messages)}")
+                stream = client.chat.completions.create(
+                    model=selected_model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True
+                )
+                logger.info(f"✅ OpenAI stream created successfully (unhinged fallback)")
+            else:
+                # Use xAI's Grok API
+                grok_client = OpenAI(
+                    api_key=xai_api_key,
+                    base_url="https://api.x.ai/v1"
+                )
+                logger.info("🔥 Using Grok's unhinged AI model (streaming)")
+                logger.info(f"🔄 Creating Grok stream with model=grok-3, messages={len(messages)}")
+                stream = grok_client.chat.completions.create(
+                    model="grok-3",  # Use Grok's latest model
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True
+                )
+                logger.info(f"✅ Grok stream created successfully")
+        else:
+            # Use regular OpenAI
+            client = openai.OpenAI()
+            logger.info(f"🔄 Creating OpenAI stream with model={selected_model}, messages={len(messages)}")
+            stream = client.chat.completions.create(
+                model=selected_model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True
+            )
+            logger.info(f"✅ OpenAI stream created successfully")
 
-                # Check credits BEFORE making expensive OpenAI call
-                # Get chat owner ID (same as frontend) for credit charging
-                # This ensures API and frontend charge the same account
-                user_id_to_charge = None
-                try:
-                    async with httpx.AsyncClient() as client:
-                        chat_response = await client.post(
-                            f"{os.getenv('CONVEX_URL', 'https://agile-ermine-199.convex.cloud')}/api/run/chats/getChatByIdExposed",
-                            json={"args": {"id": chat_id}, "format": "json"},
-                            headers={"Content-Type": "application/json"}
-                        )
-                        if chat_response.status_code == 200:
-                            chat_data = chat_response.json()
-                            if chat_data.get("value"):
-                                user_id_to_charge = chat_data["value"].get("userId")
-                                logger.info(f"💳 Found chat owner {user_id_to_charge} for streaming chat {chat_id}")
-                except Exception as e:
-                    logger.warning(f"Failed to get chat owner for streaming: {e}, using chat_id as fallback")
+        async def generate():
+            try:
+                chunk_count = 0
+                full_response_content = []  # Collect all content for credit consumption
+                logger.info(f"🚀 Starting to iterate over stream...")
+                logger.info(f"📝 Messages being sent: {len(messages)} messages")
+                logger.info(f"📝 First message preview: {str(messages[0])[:100] if messages else 'No messages'}")
+
+                # Use a queue to collect chunks from the synchronous stream in a thread
+                chunk_queue = asyncio.Queue()
+                stream_done = asyncio.Event()
+
+                def collect_chunks():
+                    """Collect chunks from synchronous stream in a separate thread"""
+                    try:
+                        for chunk in stream:
+                            chunk_queue.put_nowait(chunk)
+                    except Exception as e:
+                        logger.error(f"Error collecting chunks: {e}")
+                        chunk_queue.put_nowait(None)  # Signal error
+                    finally:
+                        stream_done.set()
 
-                if not user_id_to_charge:
-                    logger.warning(f"⚠️ Could not find chat owner ID for streaming {chat_id}, using chat_id as fallback")
-                    user_id_to_charge = chat_id
+                # Start collecting chunks in a thread pool
+                loop = asyncio.get_event_loop()
+                loop.run_in_executor(None, collect_chunks)
 
-                try:
-                    # Estimate tokens for credit validation (rough estimate)
-                    estimated_tokens = len(question) // 4 + max_tokens  # Prompt + max response
-                    required_credits = calculate_credits_used(estimated_tokens, selected_model)
+                # Process chunks as they arrive
+                while not stream_done.is_set() or not chunk_queue.empty():
+                    try:
+                        # Wait for chunk with timeout to avoid blocking indefinitely
+                        chunk = await asyncio.wait_for(chunk_queue.get(), timeout=0.1)
 
-                    # Check if chat owner has sufficient credits (same as frontend)
-                    credit_info = await check_user_credits(user_id_to_charge, required_credits)
-                    if not credit_info["has_sufficient"]:
-                        logger.error(f"💳 Insufficient credits for streaming: need {required_credits}, have {credit_info['remaining']}")
-                        raise InsufficientCreditsError(required_credits, credit_info["remaining"])
+                        if chunk is None:  # Error signal
+                            break
 
-                    logger.info(f"💳 Credit check passed for streaming chat owner {user_id_to_charge}: {credit_info['remaining']} credits available, need ~{required_credits}")
-                except InsufficientCreditsError as e:
-                    # Convert to HTTPException for proper API error response
-                    logger.error(f"💳 Insufficient credits for streaming: need {e.required}, have {e.available}")
-                    raise HTTPException(
-                        status_code=402,
-                        detail=f"Insufficient credits. Required: {e.required:.2f}, Available: {e.available:.2f}. Please add credits to continue."
-                    )
-                except Exception as e:
-                    logger.error(f"💳 Error checking credits for streaming: {e}")
-                    # For API calls, we should fail if we can't check credits (security)
-                    raise HTTPException(
-                        status_code=500,
-                        detail="Failed to verify credit balance. Please try again."
-                    )
+                        # Check if chunk has choices and delta with content
+                        if (chunk.choices and
+                            len(chunk.choices) > 0 and
+                            hasattr(chunk.choices[0], 'delta') and
+                            hasattr(chunk.choices[0].delta, 'content') and
+                            chunk.choices[0].delta.content is not None):
+
+                            content = chunk.choices[0].delta.content
+                            chunk_count += 1
+                            full_response_content.append(content)  # Collect for credit calculation
+                            json_data = json.dumps({"type": "content", "data": content})
+                            logger.info(f"📤 Streaming chunk {chunk_count}: {content[:50]}...")
+                            yield f"data: {json_data}\n\n"
+                            # Small delay to ensure chunks are processed individually
+                            await asyncio.sleep(0.01)
 
-                # Stream response from OpenAI or Grok based on unhinged mode
-                if unhinged_mode:
-                    # Create a separate OpenAI client for Grok (xAI)
-                    xai_api_key = os.getenv("XAI_API_KEY", "")
-                    if not xai_api_key:
-                        logger.warning("⚠️ Unhinged mode requested but XAI_API_KEY not set, falling back to OpenAI")
-                        client = openai.OpenAI()
-                        logger.info(f"🔄 Creating OpenAI stream (unhinged fallback) with model={selected_model}, messages={len(messages)}")
-                        stream = client.chat.completions.create(
+                    except asyncio.TimeoutError:
+                        # No chunk available yet, yield control and check again
+                        await asyncio.sleep(0.01)
+                        continue
+                    except Exception as e:
+                        logger.warning(f"⚠️ Error processing chunk: {e}")
+                        continue
+
+                logger.info(f"✅ Streamed {chunk_count} content chunks total")
+                if chunk_count == 0:
+                    logger.error(f"❌ No content chunks were streamed! Stream may be empty or malformed.")
+                    # Send an error message if no chunks were received
+                    error_json = json.dumps({"type": "error", "data": "No content was generated from the stream. Please check your query and try again."})
+                    yield f"data: {error_json}\n\n"
+
+                # Consume credits based on actual usage after streaming completes
+                # Note: user_id_to_charge is captured from outer scope
+                try:
+                    full_answer = "".join(full_response_content)
+                    if full_answer:  # Only consume credits if we got content
+                        credits_consumed = await consume_credits_for_actual_usage(
+                            user_id=user_id_to_charge,
                             model=selected_model,
-                            messages=messages,
-                            temperature=temperature,
-                            max_tokens=max_tokens,
-                            stream=True
-                        )
-                        logger.info(f"✅ OpenAI stream created successfully (unhinged fallback)")
-                    else:
-                        # Use xAI's Grok API
-                        grok_client = OpenAI(
-                            api_key=xai_api_key,
-                            base_url="https://api.x.ai/v1"
+                            question=question,
+                            response=full_answer,
+                            chat_id=chat_id,
+                            skip_developer_lookup=True  # Use chat owner, not developer
                         )
-                        logger.info("🔥 Using Grok's unhinged AI model (streaming)")
-                        logger.info(f"🔄 Creating Grok stream with model=grok-3, messages={len(messages)}")
-                        stream = grok_client.chat.completions.create(
-                            model="grok-3",  # Use Grok's latest model
-                            messages=messages,
-                            temperature=temperature,
-                            max_tokens=max_tokens,
-                            stream=True
-                        )
-                        logger.info(f"✅ Grok stream created successfully")
-                else:
-                    # Use regular OpenAI
-                    client = openai.OpenAI()
-                    logger.info(f"🔄 Creating OpenAI stream with model={selected_model}, messages={len(messages)}")
-                    stream = client.chat.completions.create(
-                        model=selected_model,
-                        messages=messages,
-                        temperature=temperature,
-                        max_tokens=max_tokens,
-                        stream=True
-                    )
-                    logger.info(f"✅ OpenAI stream created successfully")
-
-                async def generate():
-                    try:
-                        chunk_count = 0
-                        full_response_content = []  # Collect all content for credit consumption
-                        logger.info(f"🚀 Starting to iterate over stream...")
-                        logger.info(f"📝 Messages being sent: {len(messages)} messages")
-                        logger.info(f"📝 First message preview: {str(messages[0])[:100] if messages else 'No messages'}")
-
-                        # Use a queue to collect chunks from the synchronous stream in a thread
-                        chunk_queue = asyncio.Queue()
-                        stream_done = asyncio.Event()
-
-                        def collect_chunks():
-                            """Collect chunks from synchronous stream in a separate thread"""
-                            try:
-                                for chunk in stream:
-                                    chunk_queue.put_nowait(chunk)
-                            except Exception as e:
-                                logger.error(f"Error collecting chunks: {e}")
-                                chunk_queue.put_nowait(None)  # Signal error
-                            finally:
-                                stream_done.set()
+                        logger.info(f"💳 Consumed {credits_consumed} credits for {selected_model} streaming response (chat: {chat_id}, user: {user_id_to_charge})")
+                except InsufficientCreditsError as e:
+                    # This should be very rare since we checked before the call
+                    logger.error(f"💳 CREDIT ERROR after streaming: need {e.required}, have {e.available}")
+                    logger.warning(f"💳 Allowing response despite insufficient credits - this should be monitored")
+                except Exception as e:
+                    logger.error(f"💳 Error consuming credits for streaming: {e}")
+                    logger.warning(f"💳 Allowing response despite credit consumption error")
 
-                        # Start collecting chunks in a thread pool
-                        loop = asyncio.get_event_loop()
-                        loop.run_in_executor(None, collect_chunks)
+                yield "data: [DONE]\n\n"
+            except Exception as e:
+                import traceback
+                logger.error(f"Streaming error: {e}")
+                logger.error(f"Traceback: {traceback.format_exc()}")
+                error_json = json.dumps({"type": "error", "data": str(e)})
+                yield f"data: {error_json}\n\n"
+                yield "data: [DONE]\n\n"
 
-                        # Process chunks as they arrive
-                        while not stream_done.is_set() or not chunk_queue.empty():
-                            try:
-                                # Wait for chunk with timeout to avoid blocking indefinitely
-                                chunk = await asyncio.wait_for(chunk_queue.get(), timeout=0.1)
-
-                                if chunk is None:  # Error signal
-                                    break
-
-                                # Check if chunk has choices and delta with content
-                                if (chunk.choices and
-                                    len(chunk.choices) > 0 and
-                                    hasattr(chunk.choices[0], 'delta') and
-                                    hasattr(chunk.choices[0].delta, 'content') and
-                                    chunk.choices[0].delta.content is not None):
-
-                                    content = chunk.choices[0].delta.content
-                                    chunk_count += 1
-                                    full_response_content.append(content)  # Collect for credit calculation
-                                    json_data = json.dumps({"type": "content", "data": content})
-                                    logger.info(f"📤 Streaming chunk {chunk_count}: {content[:50]}...")
-                                    yield f"data: {json_data}\n\n"
-                                    # Small delay to ensure chunks are processed individually
-                                    await asyncio.sleep(0.01)
-
-                            except asyncio.TimeoutError:
-                                # No chunk available yet, yield control and check again
-                                await asyncio.sleep(0.01)
-                                continue
-                            except Exception as e:
-                                logger.warning(f"⚠️ Error processing chunk: {e}")
-                                continue
-
-                        logger.info(f"✅ Streamed {chunk_count} content chunks total")
-                        if chunk_count == 0:
-                            logger.error(f"❌ No content chunks were streamed! Stream may be empty or malformed.")
-                            # Send an error message if no chunks were received
-                            error_json = json.dumps({"type": "error", "data": "No content was generated from the stream. Please check your query and try again."})
-                            yield f"data: {error_json}\n\n"
-
-                        # Consume credits based on actual usage after streaming completes
-                        # Note: user_id_to_charge is captured from outer scope
-                        try:
-                            full_answer = "".join(full_response_content)
-                            if full_answer:  # Only consume credits if we got content
-                                credits_consumed = await consume_credits_for_actual_usage(
-                                    user_id=user_id_to_charge,
-                                    model=selected_model,
-                                    question=question,
-                                    response=full_answer,
-                                    chat_id=chat_id,
-                                    skip_developer_lookup=True  # Use chat owner, not developer
-                                )
-                                logger.info(f"💳 Consumed {credits_consumed} credits for {selected_model} streaming response (chat: {chat_id}, user: {user_id_to_charge})")
-                        except InsufficientCreditsError as e:
-                            # This should be very rare since we checked before the call
-                            logger.error(f"💳 CREDIT ERROR after streaming: need {e.required}, have {e.available}")
-                            logger.warning(f"💳 Allowing response despite insufficient credits - this should be monitored")
-                        except Exception as e:
-                            logger.error(f"💳 Error consuming credits for streaming: {e}")
-                            logger.warning(f"💳 Allowing response despite credit consumption error")
-
-                        yield "data: [DONE]\n\n"
-                    except Exception as e:
-                        import traceback
-                        logger.error(f"Streaming error: {e}")
-                        logger.error(f"Traceback: {traceback.format_exc()}")
-                        error_json = json.dumps({"type": "error", "data": str(e)})
-                        yield f"data: {error_json}\n\n"
-                        yield "data: [DONE]\n\n"
-
-                return StreamingResponse(
-                    generate(),
-                    media_type="text/event-stream",
-                    headers={
-                        "Cache-Control": "no-cache",
-                        "Connection": "keep-alive",
-                        "Access-Control-Allow-Origin": "*",
-                    }
-                )
+        return StreamingResponse(
+            generate(),
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "Connection": "keep-alive",
+                "Access-Control-Allow-Origin": "*",
+            }
+        )
 
     except Exception as e:
         logger.error(f"❌ Error in streaming with published context: {str(e)}")
@@ -5663,128 +5968,39 @@ async def answer_question_stream(payload: QuestionRequest):
             logger.warning(f"Failed to retrieve conversation history for chat {chat_id}: {e}")
             conversation_history = []
 
-        # Generate question embedding
-        question_embedding = get_embedding(question)
-
-        # Check if this is a subchat and get parent chat ID for file inheritance
-        parent_chat_id = None
-        if chat_id.startswith("subchat_"):
-            # Extract app_id from subchat format: subchat_{app_id}_{user_id}_{timestamp}
-            # The app_id format is: app_xxxxx_xxxxx, so we need to find where "user_" starts
-            parts = chat_id.split("_")
-
-            # Find the index where "user" appears to determine app_id boundary
-            user_index = -1
-            for i, part in enumerate(parts):
-                if part == "user" and i > 1:  # "user" should not be the first or second part
-                    user_index = i
-                    break
+        # Retrieve context: subchat -> parent inheritance and scope filters
+        scope_filters = payload.scope_filters if hasattr(payload, 'scope_filters') else {}
+        if scope_filters:
+            logger.info(f"📊 Applying scope filters: {scope_filters}")
 
-            if user_index > 1:
-                # Reconstruct app_id from parts[1] to parts[user_index-1]
-                app_id = "_".join(parts[1:user_index])
-                parent_chat_id = await get_parent_chat_id_from_app(app_id)
-                if parent_chat_id:
-                    logger.info(f"🔗 Subchat {chat_id} inheriting ALL files from parent chat {parent_chat_id} (streaming v2)")
+        # Top 10 chunks for cleaner citations; graph-expansion neighbours of those 10 follow them
+        retrieval = await retrieval_engine.retrieve(
+            question, chat_id, top_k=10, scope_filters=scope_filters, expand_graph=payload.expand_graph
+        )
+        top_chunks = [
+            ChunkScore(
+                chunk_id=chunk["chunk_id"],
+                chunk_text=chunk["chunk_text"],
+                score=float(chunk["score"])
+            )
+            for chunk in retrieval.chunks
+        ]
 
-        # Fetch chunks from Neo4j with document metadata for filename-based queries
-        with GraphDatabase.driver(neo4j_uri, auth=(neo4j_user, neo4j_password)) as driver:
-            with driver.session() as session:
-                # Enhanced query to include document filename for better context matching
-                if parent_chat_id:
-                    # Include chunks from both subchat and parent chat (all files)
-                    query = f"""
-                    MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
-                    WHERE c.chatId = '{chat_id}' OR c.chatId = '{parent_chat_id}'
-                    RETURN c.id AS id, c.text AS text, c.embedding AS embedding, d.filename AS filename, c.chatId AS source_chat
-                    """
-                    logger.info(f"📋 Including ALL files from subchat and parent chat {parent_chat_id} (streaming v2)")
-                else:
-                    query = f"""
-                    MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
-                    WHERE c.chatId = '{chat_id}'
-                    RETURN c.id AS id, c.text AS text, c.embedding AS embedding, d.filename AS filename, c.chatId AS source_chat
-                    """
-                    logger.info(f"📋 Using subchat files only (streaming v2)")
-                results = session.run(query)
-
-                # Calculate similarities with filename boost
-                chunk_scores = []
-                question_lower = question.lower()
-
-                for record in results:
-                    chunk_id = record["id"]
-                    chunk_text = record["text"]
-                    chunk_embedding = record["embedding"]
-                    filename = record["filename"] or ""
-
-                    # Calculate semantic similarity
-                    # Ensure both are numpy arrays with correct dimensions
-                    q_emb = np.array(question_embedding)
-                    c_emb = np.array(chunk_embedding) if isinstance(chunk_embedding, list) else chunk_embedding
-                    semantic_score = cosine_similarity(q_emb, c_emb)
-
-                    # Add filename relevance boost
-                    filename_boost = 0.0
-                    if filename:
-                        filename_lower = filename.lower()
-                        # Remove file extension for better matching
-                        filename_base = filename_lower.replace('.pdf', '').replace('.docx', '').replace('.txt', '')
-
-                        # Check for filename mentions in question
-                        filename_words = filename_base.replace('_', ' ').replace('-', ' ').split()
-                        question_words = question_lower.replace('_', ' ').replace('-', ' ').split()
-
-                        # Boost score if filename words appear in question
-                        for fname_word in filename_words:
-                            if len(fname_word) > 2:  # Skip very short words
-                                for q_word in question_words:
-                                    if fname_word in q_word or q_word in fname_word:
-                                        filename_boost += 0.1
-
-                        # Additional boost for exact filename matches
-                        if any(fname_word in question_lower for fname_word in filename_words if len(fname_word) > 3):
-                            filename_boost += 0.2
-
-                    # Combine semantic similarity with filename relevance
-                    final_score = semantic_score + filename_boost
-
-                    chunk_scores.append(ChunkScore(
-                        chunk_id=chunk_id,
-                        chunk_text=chunk_text,
-                        score=float(final_score)
-                    ))
+        # Generate answer using GPT-4 with citations
+        top_chunks_for_citations = top_chunks
 
-                # Sort and get top chunks
-                chunk_scores.sort(key=lambda x: x.score, reverse=True)
-                top_k = 50
-                top_chunks = chunk_scores[:top_k]
+        # Document names come back with the retrieved chunks
+        chunk_document_info = {chunk["chunk_id"]: chunk["filename"] for chunk in retrieval.chunks if chunk.get("filename")}
 
-                # Generate answer using GPT-4 with citations
-                # Limit to top 10 chunks for cleaner citations
-                top_chunks_for_citations = top_chunks[:10]
+        context_with_ids = "\n\n---\n\n".join([
+            f"[CHUNK_{i}] (from document: {chunk_document_info.get(chunk.chunk_id, 'Unknown')}) {chunk.chunk_text}"
+            for i, chunk in enumerate(top_chunks_for_citations)
+        ])
 
-                # Get document information for each chunk to provide better context
-                chunk_document_info = {}
-                for chunk in top_chunks_for_citations:
-                    doc_query = f"""
-                    MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk {{id: '{chunk.chunk_id}'}})
-                    RETURN d.filename AS filename
-                    """
-                    doc_result = session.run(doc_query)
-                    doc_record = doc_result.single()
-                    if doc_record:
-                        chunk_document_info[chunk.chunk_id] = doc_record['filename']
-
-                context_with_ids = "\n\n---\n\n".join([
-                    f"[CHUNK_{i}] (from document: {chunk_document_info.get(chunk.chunk_id, 'Unknown')}) {chunk.chunk_text}"
-                    for i, chunk in enumerate(top_chunks_for_citations)
-                ])
-
-                # Use custom prompt if provided, otherwise use default system prompt
-                if custom_prompt:
-                    # Use custom prompt but ensure context is included
-                    system_prompt = f"""
+        # Use custom prompt if provided, otherwise use default system prompt
+        if custom_prompt:
+            # Use custom prompt but ensure context is included
+            system_prompt = f"""
                     {custom_prompt}
 
                     You have the following context with chunk IDs (0-{len(top_chunks_for_citations)-1}):
@@ -5794,9 +6010,9 @@ async def answer_question_stream(payload: QuestionRequest):
                     When you reference information from the context, add a citation using this format: [^{{i}}] where {{i}} is the chunk number (0-{len(top_chunks_for_citations)-1})
                     Only use citations [^0] through [^{len(top_chunks_for_citations)-1}]. Do not use citation numbers higher than {len(top_chunks_for_citations)-1}
                     """.strip()
-                else:
-                    # Default system prompt
-                    system_prompt = f"""
+        else:
+            # Default system prompt
+            system_prompt = f"""
                     You are a helpful assistant. You have the following context with chunk IDs (0-{len(top_chunks_for_citations)-1}):
 
                     {context_with_ids}
@@ -5817,99 +6033,99 @@ async def answer_question_stream(payload: QuestionRequest):
                     RESPOND IN MARKDOWN FORMAT WITH CITATIONS
                     """.strip()
 
-                # Create streaming generator function
-                async def generate_stream():
-                    # First, send the context information
-                    context_data = {
-                        "type": "context",
-                        "data": [
-                            {
-                                "chunk_id": chunk.chunk_id,
-                                "chunk_text": chunk.chunk_text,
-                                "score": chunk.score
-                            }
-                            for chunk in top_chunks_for_citations
-                        ]
+        # Create streaming generator function
+        async def generate_stream():
+            # First, send the context information
+            context_data = {
+                "type": "context",
+                "data": [
+                    {
+                        "chunk_id": chunk.chunk_id,
+                        "chunk_text": chunk.chunk_text,
+                        "score": chunk.score
                     }
-                    yield f"data: {json.dumps(context_data)}\n\n"
-
-                    # Build messages with conversation history for context
-                    messages = [{"role": "system", "content": system_prompt}]
-
-                    # Add conversation history (limit based on chat setting to avoid token limits)
-                    if history_limit > 0:
-                        history_limit_int = int(history_limit)  # Ensure it's an integer for slicing
-                        recent_history = conversation_history[-history_limit_int:] if len(conversation_history) > history_limit_int else conversation_history
-                        messages.extend(recent_history)
-
-                    # Add current question
-                    messages.append({"role": "user", "content": question})
-
-                    # Then stream the AI response with selected model and settings
-                    # Use Grok's unhinged AI if unhinged mode is enabled
-                    if unhinged_mode:
-                        # Create a separate OpenAI client for Grok (xAI)
-                        xai_api_key = os.getenv("XAI_API_KEY", "")
-                        if not xai_api_key:
-                            logger.warning("⚠️ Unhinged mode requested but XAI_API_KEY not set, falling back to OpenAI")
-                            stream = openai.chat.completions.create(
-                                model=selected_model,
-                                messages=messages,
-                                temperature=temperature,
-                                max_tokens=max_tokens,
-                                stream=True
-                            )
-                        else:
-                            # Use xAI's Grok API
-                            grok_client = OpenAI(
-                                api_key=xai_api_key,
-                                base_url="https://api.x.ai/v1"
-                            )
-                            logger.info("🔥 Using Grok's unhinged AI model")
-                            stream = grok_client.chat.completions.create(
-                                model="grok-3",  # Use Grok's latest model (grok-beta deprecated)
-                                messages=messages,
-                                temperature=temperature,
-                                max_tokens=max_tokens,
-                                stream=True
-                            )
-                    else:
-                        # Use regular OpenAI
-                        stream = openai.chat.completions.create(
-                            model=selected_model,
-                            messages=messages,
-                            temperature=temperature,
-                            max_tokens=max_tokens,
-                            stream=True
-                        )
-
-                    for chunk in stream:
-                        if chunk.choices[0].delta.content is not None:
-                            content_data = {
-                                "type": "content",
-                                "data": chunk.choices[0].delta.content
-                            }
-                            print(f"🔥 Streaming chunk: {chunk.choices[0].delta.content}")
-                            yield f"data: {json.dumps(content_data)}\n\n"
-                            # Small delay to ensure chunks are processed individually
-                            await asyncio.sleep(0.01)
+                    for chunk in top_chunks_for_citations
+                ]
+            }
+            yield f"data: {json.dumps(context_data)}\n\n"
+
+            # Build messages with conversation history for context
+            messages = [{"role": "system", "content": system_prompt}]
+
+            # Add conversation history (limit based on chat setting to avoid token limits)
+            if history_limit > 0:
+                history_limit_int = int(history_limit)  # Ensure it's an integer for slicing
+                recent_history = conversation_history[-history_limit_int:] if len(conversation_history) > history_limit_int else conversation_history
+                messages.extend(recent_history)
+
+            # Add current question
+            messages.append({"role": "user", "content": question})
+
+            # Then stream the AI response with selected model and settings
+            # Use Grok's unhinged AI if unhinged mode is enabled
+            if unhinged_mode:
+                # Create a separate OpenAI client for Grok (xAI)
+                xai_api_key = os.getenv("XAI_API_KEY", "")
+                if not xai_api_key:
+                    logger.warning("⚠️ Unhinged mode requested but XAI_API_KEY not set, falling back to OpenAI")
+                    stream = openai.chat.completions.create(
+                        model=selected_model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        stream=True
+                    )
+                else:
+                    # Use xAI's Grok API
+                    grok_client = OpenAI(
+                        api_key=xai_api_key,
+                        base_url="https://api.x.ai/v1"
+                    )
+                    logger.info("🔥 Using Grok's unhinged AI model")
+                    stream = grok_client.chat.completions.create(
+                        model="grok-3",  # Use Grok's latest model (grok-beta deprecated)
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        stream=True
+                    )
+            else:
+                # Use regular OpenAI
+                stream = openai.chat.completions.create(
+                    model=selected_model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True
+                )
 
-                    # Send end signal
-                    end_data = {'type': 'end'}
-                    logger.info(f"🏁 Sending end signal: {end_data}")
-                    yield f"data: {json.dumps(end_data)}\n\n"
-
-                return StreamingResponse(
-                    generate_stream(),
-                    media_type="text/event-stream",
-                    headers={
-                        "Cache-Control": "no-cache",
-                        "Connection": "keep-alive",
-                        "Access-Control-Allow-Origin": "*",
-                        "Access-Control-Allow-Headers": "*",
-                        "X-Accel-Buffering": "no",  # Disable nginx buffering
+            for chunk in stream:
+                if chunk.choices[0].delta.content is not None:
+                    content_data = {
+                        "type": "content",
+                        "data": chunk.choices[0].delta.content
                     }
-                )
+                    print(f"🔥 Streaming chunk: {chunk.choices[0].delta.content}")
+                    yield f"data: {json.dumps(content_data)}\n\n"
+                    # Small delay to ensure chunks are processed individually
+                    await asyncio.sleep(0.01)
+
+            # Send end signal
+            end_data = {'type': 'end'}
+            logger.info(f"🏁 Sending end signal: {end_data}")
+            yield f"data: {json.dumps(end_data)}\n\n"
+
+        return StreamingResponse(
+            generate_stream(),
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "Connection": "keep-alive",
+                "Access-Control-Allow-Origin": "*",
+                "Access-Control-Allow-Headers": "*",
+                "X-Accel-Buffering": "no",  # Disable nginx buffering
+            }
+        )
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -5935,7 +6151,7 @@ async def remove_context(file_id: str): # TODO: add auth to this endpoint
                 check_query = """
                 MATCH (d:Document {id: $file_id})
                 OPTIONAL MATCH (d)-[:HAS_CHUNK]->(c:Chunk)
-                RETURN d.id as doc_id, d.filename as filename, count(c) as chunk_count
+                RETURN d.id as doc_id, d.filename as filename, d.chatId as chat_id, count(c) as chunk_count
                 """
                 check_result = session.run(check_query, file_id=file_id)
                 check_record = check_result.single()
@@ -5986,6 +6202,9 @@ async def remove_context(file_id: str): # TODO: add auth to this endpoint
 
                 print(f"🗑️ Deleted {nodes_deleted} nodes for file_id: {file_id}")
 
+                if nodes_deleted and check_record and check_record["chat_id"]:
+                    chat_chunks_deleted(session, check_record["chat_id"])
+
         # If nothing in Neo4j, check if it's still in the processing queue
         if nodes_deleted == 0:
             queue = get_file_queue()
@@ -6011,9 +6230,11 @@ async def remove_context(file_id: str): # TODO: add auth to this endpoint
                                 if job.args and len(job.args) >= 1:
                                     # Check if this job is for our file
                                     if job.args[0] == file_queue_id or (len(job.args) >= 7 and job.args[6] == file_id):
-                                        # Cancel/delete the job
+                                        # Cancel/delete the job (and the extracted text it would have read)
                                         job.cancel()
                                         job.delete()
+                                        if len(job.args) >= 4 and is_text_ref(job.args[3]):
+                                            delete_text(job.args[3])
                                         job_cancelled = True
                                         print(f"🗑️ Cancelled queued job for file: {file_id}")
                                         break
@@ -6072,6 +6293,7 @@ async def delete_chat_nodes(chat_id: str): # TODO: add auth to this endpoint
                 relationships_deleted = summary.counters.relationships_deleted
 
                 print(f"Deleted {nodes_deleted} nodes and {relationships_deleted} relationships for chat {chat_id}")
+                chat_deleted(chat_id)
 
                 return {
                     "status": "success",
@@ -6148,6 +6370,8 @@ async def cleanup_chat_data(chat_id: str, convex_id: str = Query(None), child_ch
                 relationships_deleted = summary.counters.relationships_deleted
 
                 print(f"🗑️ SUCCESS: Deleted chat cluster for {chat_id} and {len(child_ids)} child chats: {nodes_deleted} nodes, {relationships_deleted} relationships")
+                for deleted_chat_id in all_chat_ids:
+                    chat_deleted(deleted_chat_id)
 
                 return {
                     "status": "success",
@@ -6405,15 +6629,21 @@ async def delete_node(node_id: str):
                 query = """
                 MATCH (n)
                 WHERE id(n) = $node_id
+                WITH n, n.chatId AS chat_id, n:Chunk AS is_chunk
                 DETACH DELETE n
+                RETURN chat_id, is_chunk
                 """
 
                 result = session.run(query, node_id=int(node_id))
+                record = result.single()
                 summary = result.consume()
 
                 if summary.counters.nodes_deleted == 0:
                     raise HTTPException(status_code=404, detail="Node not found")
 
+                if record and record["is_chunk"] and record["chat_id"]:
+                    chat_chunks_deleted(session, record["chat_id"])
+
                 return {
                     "status": "success",
                     "message": f"Node {node_id} deleted successfully",
@@ -7453,7 +7683,7 @@ async def privacy_upload_process(
                     file_queue_id,
                     sanitized_chat_id,
                     sanitized_filename,
-                    sanitized_text,
+                    job_text_arg(sanitized_text),  # Blob reference, not the text itself
                     file_size,
                     {},  # No scope values for privacy uploads
                     pdf_id,
@@ -7571,7 +7801,8 @@ async def answer_question_with_privacy_scope(
     model: str = "gpt-4o-mini",
     temperature: float = 0.7,
     max_tokens: int = 1000,
-    custom_prompt: str = None
+    custom_prompt: str = None,
+    expand_graph: Optional[bool] = None
 ) -> Dict[str, Any]:
     """
     Privacy-scoped question answering that ensures complete data isolation.
@@ -7581,114 +7812,37 @@ async def answer_question_with_privacy_scope(
     # but with additional privacy controls and scoping
 
     try:
-        # Generate question embedding
-        question_embedding = get_embedding(question)
-
-        # Query Neo4j with user-specific filtering
-        with GraphDatabase.driver(neo4j_uri, auth=(neo4j_user, neo4j_password)) as driver:
-            with driver.session() as session:
-                # Enhanced query that includes user/chat isolation + parent chat access
-                # This searches BOTH user's private data AND parent app knowledge base
-                # Note: This implements the hybrid model you described
-
-                # First, let's see what documents exist for this chat
-                doc_query = f"""
-                MATCH (d:Document)
-                WHERE d.chatId = '{chat_id}' OR (d.chatId = '{app_id}' AND '{app_id}' <> 'direct')
-                RETURN d.filename AS filename, d.chatId AS docChatId
-                """
-                doc_result = session.run(doc_query)
-                doc_list = [(record["filename"], record["docChatId"]) for record in doc_result]
-                logger.info(f"🔍 DEBUG: Found {len(doc_list)} documents: {doc_list}")
-
-                query = f"""
-                MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
-                WHERE c.chatId = '{chat_id}' OR (c.chatId = '{app_id}' AND '{app_id}' <> 'direct')
-                RETURN c.id AS id, c.text AS text, c.embedding AS embedding, d.filename AS filename
-                """
-
-                result = session.run(query)
-                chunks = []
-
-                question_lower = question.lower()
-
-                # Calculate similarities with filename boost - EXACT SAME AS MAIN CHAT
-                chunk_scores = []
+        # User/chat isolation: search the user's chat and, for app users, the app knowledge base
+        # Top 10 chunks for cleaner citations; graph-expansion neighbours of those 10 follow them
+        retrieval = await retrieval_engine.retrieve(
+            question, chat_id, top_k=10, inherit_parent=False,
+            extra_chat_ids=[] if app_id == "direct" else [app_id], expand_graph=expand_graph
+        )
+        top_chunks = [
+            {
+                "chunk_id": chunk["chunk_id"],
+                "chunk_text": chunk["chunk_text"],
+                "score": float(chunk["score"]),
+                "filename": chunk["filename"] or ""
+            }
+            for chunk in retrieval.chunks
+        ]
 
-                for record in result:
-                    chunk_id = record["id"]
-                    chunk_text = record["text"]
-                    chunk_embedding = record["embedding"]
-                    filename = record["filename"] or ""
-
-                    # Calculate semantic similarity
-                    # Ensure both are numpy arrays with correct dimensions
-                    q_emb = np.array(question_embedding)
-                    c_emb = np.array(chunk_embedding) if isinstance(chunk_embedding, list) else chunk_embedding
-                    semantic_score = cosine_similarity(q_emb, c_emb)
-
-                    # Add filename relevance boost (same logic as main chat)
-                    filename_boost = 0.0
-                    if filename:
-                        filename_lower = filename.lower()
-                        # Remove file extension for better matching
-                        filename_base = filename_lower.replace('.pdf', '').replace('.docx', '').replace('.txt', '')
-
-                        # Check for filename mentions in question
-                        filename_words = filename_base.replace('_', ' ').replace('-', ' ').split()
-                        question_words = question_lower.replace('_', ' ').replace('-', ' ').split()
-
-                        # Boost score if filename words appear in question
-                        for fname_word in filename_words:
-                            if len(fname_word) > 2:  # Skip very short words
-                                for q_word in question_words:
-                                    if fname_word in q_word or q_word in fname_word:
-                                        filename_boost += 0.1
-
-                        # Additional boost for exact filename matches
-                        if any(fname_word in question_lower for fname_word in filename_words if len(fname_word) > 3):
-                            filename_boost += 0.2
-
-                    # Combine semantic similarity with filename relevance
-                    final_score = semantic_score + filename_boost
-
-                    chunk_scores.append({
-                        "chunk_id": chunk_id,
-                        "chunk_text": chunk_text,
-                        "score": float(final_score),
-                        "filename": filename
-                    })
+        # Generate answer using GPT-4 with citations - EXACT SAME AS MAIN CHAT
+        top_chunks_for_citations = top_chunks
 
-                # Sort and get top chunks - EXACT SAME AS MAIN CHAT
-                chunk_scores.sort(key=lambda x: x["score"], reverse=True)
-                top_k = 50  # Same as main chat
-                top_chunks = chunk_scores[:top_k]
+        # Document names come back with the retrieved chunks
+        chunk_document_info = {chunk["chunk_id"]: chunk["filename"] for chunk in top_chunks_for_citations if chunk["filename"]}
 
-                # Generate answer using GPT-4 with citations - EXACT SAME AS MAIN CHAT
-                # Limit to top 10 chunks for cleaner citations
-                top_chunks_for_citations = top_chunks[:10]
+        context_with_ids = "\n\n---\n\n".join([
+            f"[CHUNK_{i}] (from document: {chunk_document_info.get(chunk['chunk_id'], 'Unknown')}) {chunk['chunk_text']}"
+            for i, chunk in enumerate(top_chunks_for_citations)
+        ])
 
-                # Get document information for each chunk to provide better context - EXACT SAME AS MAIN CHAT
-                chunk_document_info = {}
-                for chunk in top_chunks_for_citations:
-                    doc_query = f"""
-                    MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk {{id: '{chunk["chunk_id"]}'}})
-                    RETURN d.filename AS filename
-                    """
-                    doc_result = session.run(doc_query)
-                    doc_record = doc_result.single()
-                    if doc_record:
-                        chunk_document_info[chunk["chunk_id"]] = doc_record['filename']
-
-                context_with_ids = "\n\n---\n\n".join([
-                    f"[CHUNK_{i}] (from document: {chunk_document_info.get(chunk['chunk_id'], 'Unknown')}) {chunk['chunk_text']}"
-                    for i, chunk in enumerate(top_chunks_for_citations)
-                ])
-
-                # Use custom prompt if provided, otherwise use default system prompt - EXACT SAME AS MAIN CHAT
-                if custom_prompt:
-                    # Use custom prompt but ensure context is included
-                    system_prompt = f"""
+        # Use custom prompt if provided, otherwise use default system prompt - EXACT SAME AS MAIN CHAT
+        if custom_prompt:
+            # Use custom prompt but ensure context is included
+            system_prompt = f"""
                     {custom_prompt}
 
                     You have the following context with chunk IDs (0-{len(top_chunks_for_citations)-1}):
@@ -7698,9 +7852,9 @@ async def answer_question_with_privacy_scope(
                     When you reference information from the context, add a citation using this format: [^{{i}}] where {{i}} is the chunk number (0-{len(top_chunks_for_citations)-1})
                     Only use citations [^0] through [^{len(top_chunks_for_citations)-1}]. Do not use citation numbers higher than {len(top_chunks_for_citations)-1}
                     """.strip()
-                else:
-                    # Default system prompt - EXACT SAME AS MAIN CHAT
-                    system_prompt = f"""
+        else:
+            # Default system prompt - EXACT SAME AS MAIN CHAT
+            system_prompt = f"""
                     You are a helpful assistant. You have the following context with chunk IDs (0-{len(top_chunks_for_citations)-1}):
 
                     {context_with_ids}
@@ -7720,37 +7874,37 @@ async def answer_question_with_privacy_scope(
                     RESPOND IN MARKDOWN FORMAT WITH CITATIONS
                     """.strip()
 
-                completion = openai.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": question}
-                    ],
-                    temperature=temperature,
-                    max_tokens=max_tokens
-                )
+        completion = openai.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": question}
+            ],
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
 
-                answer = completion.choices[0].message.content.strip()
+        answer = completion.choices[0].message.content.strip()
 
-                # Convert to same format as main chat
-                context_chunks = []
-                for chunk in top_chunks_for_citations:
-                    context_chunks.append({
-                        "chunk_id": chunk["chunk_id"],
-                        "chunk_text": chunk["chunk_text"],
-                        "score": chunk["score"]
-                    })
+        # Convert to same format as main chat
+        context_chunks = []
+        for chunk in top_chunks_for_citations:
+            context_chunks.append({
+                "chunk_id": chunk["chunk_id"],
+                "chunk_text": chunk["chunk_text"],
+                "score": chunk["score"]
+            })
 
-                return {
-                    "answer": answer,
-                    "context": context_chunks,
-                    "privacy_scope": {
-                        "app_id": app_id,
-                        "end_user_id": end_user_id,
-                        "chat_id": chat_id,
-                        "isolation_confirmed": True
-                    }
-                }
+        return {
+            "answer": answer,
+            "context": context_chunks,
+            "privacy_scope": {
+                "app_id": app_id,
+                "end_user_id": end_user_id,
+                "chat_id": chat_id,
+                "isolation_confirmed": True
+            }
+        }
 
     except Exception as e:
         import traceback
@@ -8012,6 +8166,25 @@ async def user_chat_query(
 # Scope Management API Endpoints
 # ==============================================================================
 
+def sync_scope_indexes(chat_id: str, previous_scopes: List[str], scopes: List[str]) -> Dict[str, List[str]]:
+    """
+    Create / drop the Chunk(chatId, scope) indexes for scopes added to or removed from a chat.
+
+    Returns:
+        {"created": [...], "dropped": [...]} scope names
+    """
+    added = [name for name in scopes if name not in previous_scopes]
+    removed = [name for name in previous_scopes if name not in scopes]
+    created, dropped = [], []
+    with retrieval_engine.driver.session() as session:
+        for name in added:
+            ensure_scope_index(session, chat_id, name)
+            created.append(name)
+        for name in removed:
+            if drop_scope_index(session, chat_id, name):
+                dropped.append(name)
+    return {"created": created, "dropped": dropped}
+
 @app.post("/v1/{chat_id}/scopes/configure")
 async def configure_scopes(
     chat_id: str,
@@ -8061,16 +8234,30 @@ async def configure_scopes(
                     detail=f"Invalid scope type: {scope_def.type}. Must be string, number, or boolean."
                 )
 
+        previous_config = await get_scope_config(sanitized_chat_id)
+        previous_scopes = [s.name for s in previous_config.scopes] if previous_config else []
+
         # Save the configuration
         success = await save_scope_config(sanitized_chat_id, scope_config)
 
         if success:
             logger.info(f"✅ Scope configuration saved for chat {sanitized_chat_id}: {[s.name for s in scope_config.scopes]}")
+
+            # Index the scope properties so scoped queries only read matching chunks
+            scope_indexes = {"created": [], "dropped": []}
+            try:
+                scope_indexes = await asyncio.to_thread(
+                    sync_scope_indexes, sanitized_chat_id, previous_scopes, [s.name for s in scope_config.scopes]
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ Could not update scope indexes for chat {sanitized_chat_id}: {e}")
+
             return {
                 "success": True,
                 "message": "Scope configuration saved successfully",
                 "chat_id": sanitized_chat_id,
-                "scopes": [s.dict() for s in scope_config.scopes]
+                "scopes": [s.dict() for s in scope_config.scopes],
+                "scope_indexes": scope_indexes
             }
         else:
             raise HTTPException(status_code=500, detail="Failed to save scope configuration")
@@ -8131,10 +8318,20 @@ async def delete_scopes(
         if not sanitized_chat_id:
             raise HTTPException(status_code=400, detail="Invalid chat_id format")
 
+        previous_config = await get_scope_config(sanitized_chat_id)
+
         # Clear in-memory config
         if sanitized_chat_id in SCOPE_CONFIGS:
             del SCOPE_CONFIGS[sanitized_chat_id]
 
+        if previous_config and previous_config.scopes:
+            try:
+                await asyncio.to_thread(
+                    sync_scope_indexes, sanitized_chat_id, [s.name for s in previous_config.scopes], []
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ Could not drop scope indexes for chat {sanitized_chat_id}: {e}")
+
         # Also clear in Convex (you would implement this based on your Convex schema)
         logger.info(f"🗑️ Cleared scope configuration for chat {sanitized_chat_id}")
 
@@ -8165,6 +8362,12 @@ async def update_chat_settings(
     """
     Update chat settings such as custom prompt, temperature, max_tokens, model.
     These settings are stored in Convex's published settings for the chat.
+
+    answer_cache_enabled turns the semantic answer cache on or off for the chat.
+    embedding_dimensions changes the embedding size of new uploads immediately
+    and enqueues a throttled job that re-embeds the existing documents.
+    mmr_enabled / mmr_lambda / mmr_candidate_pool control diversity re-ranking
+    of the retrieved chunks.
     """
     try:
         sanitized_chat_id = sanitize_chat_id(chat_id)
@@ -8181,6 +8384,33 @@ async def update_chat_settings(
             updates["maxTokens"] = int(settings.max_tokens)
         if settings.selected_model is not None:
             updates["selectedModel"] = settings.selected_model
+        if settings.answer_cache_enabled is not None:
+            updates["answerCacheEnabled"] = settings.answer_cache_enabled
+        if settings.answer_cache_threshold is not None:
+            if not 0.0 < settings.answer_cache_threshold <= 1.0:
+                raise HTTPException(status_code=400, detail="answer_cache_threshold must be in (0, 1]")
+            updates["answerCacheThreshold"] = settings.answer_cache_threshold
+        if settings.answer_cache_ttl_seconds is not None:
+            if settings.answer_cache_ttl_seconds <= 0:
+                raise HTTPException(status_code=400, detail="answer_cache_ttl_seconds must be positive")
+            updates["answerCacheTtlSeconds"] = int(settings.answer_cache_ttl_seconds)
+        if settings.embedding_dimensions is not None:
+            if settings.embedding_dimensions not in SUPPORTED_EMBEDDING_DIMENSIONS:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"embedding_dimensions must be one of {list(SUPPORTED_EMBEDDING_DIMENSIONS)}"
+                )
+            updates["embeddingDimensions"] = int(settings.embedding_dimensions)
+        if settings.mmr_enabled is not None:
+            updates["mmrEnabled"] = settings.mmr_enabled
+        if settings.mmr_lambda is not None:
+            if not 0.0 <= settings.mmr_lambda <= 1.0:
+                raise HTTPException(status_code=400, detail="mmr_lambda must be in [0, 1]")
+            updates["mmrLambda"] = settings.mmr_lambda
+        if settings.mmr_candidate_pool is not None:
+            if not 1 <= settings.mmr_candidate_pool <= MMR_MAX_CANDIDATE_POOL:
+                raise HTTPException(status_code=400, detail=f"mmr_candidate_pool must be between 1 and {MMR_MAX_CANDIDATE_POOL}")
+            updates["mmrCandidatePool"] = int(settings.mmr_candidate_pool)
 
         if not updates:
             return {
@@ -8216,6 +8446,14 @@ async def update_chat_settings(
         for key, val in updates.items():
             CHAT_SETTINGS_OVERRIDES[sanitized_chat_id][key] = val
 
+        # New uploads use the new size right away; existing documents move in the background
+        reembed_job_id = None
+        if "embeddingDimensions" in updates:
+            dimensions = updates["embeddingDimensions"]
+            if get_chat_target_dimensions(sanitized_chat_id) != dimensions:
+                set_chat_target_dimensions(sanitized_chat_id, dimensions)
+                reembed_job_id = enqueue_chat_reembed(sanitized_chat_id, dimensions)
+
         # Fetch the latest published settings to confirm (auto-publish behavior)
         async with httpx.AsyncClient() as client:
             published_response = await client.post(
@@ -8236,6 +8474,7 @@ async def update_chat_settings(
                 "chat_id": sanitized_chat_id,
                 "updated": updates,
                 "settings": {},
+                "reembed_job_id": reembed_job_id,
                 "message": "Settings updated, but fetch of published settings failed",
             }
 
@@ -8251,6 +8490,7 @@ async def update_chat_settings(
             "chat_id": sanitized_chat_id,
             "updated": updates,
             "settings": merged_settings,
+            "reembed_job_id": reembed_job_id,
         }
 
     except HTTPException:
@@ -8407,7 +8647,7 @@ async def upload_file_with_scopes(
                     file_queue_id,
                     sanitized_chat_id,
                     sanitized_filename,
-                    sanitized_text,
+                    job_text_arg(sanitized_text),  # Blob reference, not the text itself
                     file_size,
                     parsed_scope_values,
                     pdf_id,
@@ -8748,6 +8988,7 @@ async def api_delete_file(
 
                 delete_result = session.run(delete_query, file_id=sanitized_file_id, chat_id=sanitized_chat_id)
                 summary = delete_result.consume()
+                chat_chunks_deleted(session, sanitized_chat_id)
 
                 if summary.counters.nodes_deleted == 0:
                     raise HTTPException(
@@ -8859,6 +9100,71 @@ def show_queue_status():
             except Exception as e:
                 print(f"  - {job_id[:20]}... | error: {e}")
 
+def normalize_existing_embeddings(batch_size: int = 500):
+    """
+    Backfill unit-normalized embeddings for chunks ingested before normalization.
+
+    Usage:
+        python read_files.py normalize-embeddings [batch_size]
+
+    Safe to re-run; only chunks without an embeddingNorm property are touched.
+    Scores are unchanged, so cached chat matrices stay valid.
+    """
+    if not (neo4j_uri and neo4j_user and neo4j_password):
+        print("❌ NEO4J_URI, NEO4J_USER and NEO4J_PASSWORD must be set")
+        sys.exit(1)
+
+    print(f"📐 Normalizing stored chunk embeddings (batch size {batch_size})...")
+    with GraphDatabase.driver(neo4j_uri, auth=(neo4j_user, neo4j_password)) as driver:
+        with driver.session() as session:
+            updated = backfill_normalized_embeddings(session, batch_size=batch_size)
+    print(f"✅ Normalized {updated} chunk embeddings")
+
+def build_ann_index(chat_id: str):
+    """
+    Build (or rebuild) a chat's HNSW index from its chunks in Neo4j.
+
+    Usage:
+        python read_files.py build-ann-index <chat_id>
+
+    Only chats with at least ANN_INDEX_MIN_CHUNKS chunks get an index.
+    """
+    if not (neo4j_uri and neo4j_user and neo4j_password):
+        print("❌ NEO4J_URI, NEO4J_USER and NEO4J_PASSWORD must be set")
+        sys.exit(1)
+
+    print(f"🗺️ Building ANN index for chat {chat_id}...")
+    with GraphDatabase.driver(neo4j_uri, auth=(neo4j_user, neo4j_password)) as driver:
+        with driver.session() as session:
+            result = sync_chat_ann_index(session, chat_id, rebuild=True)
+    print(f"✅ ANN index for {chat_id}: {result or 'not needed (chat below ANN_INDEX_MIN_CHUNKS or usearch missing)'}")
+
+def migrate_embedding_encoding(encoding: str = EMBEDDING_STORAGE, batch_size: int = 500):
+    """
+    Re-encode stored chunk embeddings to a storage encoding.
+
+    Usage:
+        python read_files.py migrate-embeddings [list|float32|float16|int8] [batch_size]
+
+    Keeps the list property next to the blob when EMBEDDING_STORE_LIST is on
+    (required by the vector index). Bumps the version of every rewritten chat
+    so cached matrices are reloaded with the new encoding.
+    """
+    if encoding not in EMBEDDING_ENCODINGS:
+        print(f"❌ Unknown encoding {encoding!r}; choose one of {', '.join(EMBEDDING_ENCODINGS)}")
+        sys.exit(1)
+    if not (neo4j_uri and neo4j_user and neo4j_password):
+        print("❌ NEO4J_URI, NEO4J_USER and NEO4J_PASSWORD must be set")
+        sys.exit(1)
+
+    print(f"🗜️ Re-encoding stored chunk embeddings as {encoding} (batch size {batch_size}, keep list: {EMBEDDING_STORE_LIST})...")
+    with GraphDatabase.driver(neo4j_uri, auth=(neo4j_user, neo4j_password)) as driver:
+        with driver.session() as session:
+            chat_ids = migrate_embedding_storage(session, encoding, batch_size, keep_list=EMBEDDING_STORE_LIST)
+    for chat_id in chat_ids:
+        bump_chat_version(chat_id)
+    print(f"✅ Re-encoded embeddings in {len(chat_ids)} chats")
+
 if __name__ == "__main__":
     # Check for CLI commands
     if len(sys.argv) > 1:
@@ -8868,6 +9174,24 @@ if __name__ == "__main__":
             run_worker()
         elif command == "status":
             show_queue_status()
+        elif command == "normalize-embeddings":
+            normalize_existing_embeddings(int(sys.argv[2]) if len(sys.argv) > 2 else 500)
+        elif command == "build-ann-index":
+            if len(sys.argv) < 3:
+                print("Usage: python read_files.py build-ann-index <chat_id>")
+                sys.exit(1)
+            build_ann_index(sys.argv[2])
+        elif command == "reembed":
+            if len(sys.argv) < 4:
+                print("Usage: python read_files.py reembed <chat_id> <dimensions>")
+                sys.exit(1)
+            set_chat_target_dimensions(sys.argv[2], int(sys.argv[3]))
+            print(reembed_chat_job(sys.argv[2], int(sys.argv[3])))
+        elif command == "migrate-embeddings":
+            migrate_embedding_encoding(
+                sys.argv[2].lower() if len(sys.argv) > 2 else EMBEDDING_STORAGE,
+                int(sys.argv[3]) if len(sys.argv) > 3 else 500
+            )
         elif command == "help":
             print("""
 Trainly Backend CLI
@@ -8876,6 +9200,14 @@ Usage:
     python read_files.py              Start the FastAPI server
     python read_files.py worker       Start a background worker
     python read_files.py status       Show queue status
+    python read_files.py normalize-embeddings [batch_size]
+                                      Normalize embeddings of previously ingested chunks
+    python read_files.py migrate-embeddings [list|float32|float16|int8] [batch_size]
+                                      Re-encode stored embeddings (default: EMBEDDING_STORAGE)
+    python read_files.py reembed <chat_id> <dimensions>
+                                      Re-embed a chat at 256/512/1024/1536 dimensions
+    python read_files.py build-ann-index <chat_id>
+                                      (Re)build a chat's HNSW index from Neo4j
     python read_files.py help         Show this help message
 
 Environment Variables:
@@ -8885,6 +9217,39 @@ Environment Variables:
     NEO4J_USER                        Neo4j username
     NEO4J_PASSWORD                    Neo4j password
     CONVEX_URL                        Convex deployment URL
+    RETRIEVAL_MODE                    "vector_index" (default) or "full_scan"
+    EMBEDDING_STORAGE                 "list" (default), "float32", "float16" or "int8" chunk embedding storage
+    EMBEDDING_STORE_LIST              Keep the list next to byte-encoded embeddings (default: on in vector_index mode)
+    REEMBED_CHUNKS_PER_MINUTE         Throttle for re-embed jobs (default 3000)
+    ANN_INDEX_DIR                     Directory for per-chat HNSW indexes (shared by API and workers)
+    ANN_INDEX_MIN_CHUNKS              Chat size that switches retrieval to the HNSW index (default 50000)
+    QUESTION_EMBEDDING_CACHE_SIZE     In-process question embedding cache entries (default 2048)
+    QUESTION_EMBEDDING_REDIS_TTL      Redis TTL for cached question embeddings in seconds (default 7 days)
+    ANSWER_CACHE_ENABLED              "false" disables the semantic answer cache for all chats
+    HYBRID_RETRIEVAL                  "true" enables full-text + vector rank fusion (off by default)
+    RETRIEVAL_TIMING_LOG              "true" logs per-stage retrieval timings
+    SHARED_TIER_CACHE_TTL             Seconds parent-chat results are shared across an app's subchats (default 600)
+    CONTEXT_MAX_TOKENS                Cap on retrieved-context tokens per LLM call (default 6000)
+    BATCH_MAX_QUESTIONS               Questions per /answer_questions_batch request (default 200)
+    BATCH_LLM_CONCURRENCY             Concurrent LLM calls per batch (default 8)
+    CONTEXT_MIN_SCORE / CONTEXT_SCORE_GAP  Score threshold and gap-to-best that end context assembly
+    GRAPH_EXPANSION_ENABLED           "true" appends NEXT / AI-relationship neighbours of retrieved chunks
+                                      (a question request's expand_graph overrides it)
+    GRAPH_EXPANSION_HOPS              Neighbour hops for graph expansion, 1 (default) or 2
+    GRAPH_EXPANSION_TOKEN_BUDGET      Tokens of neighbour text graph expansion may add (default 1500)
+    INGEST_WRITE_BATCH_SIZE           Chunks / relationships per UNWIND write during ingestion (default 500)
+    EMBEDDING_CONCURRENCY             Embedding batches in flight during ingestion (default 4, halves on 429s)
+    EMBEDDING_MAX_BATCH_TOKENS        Tokens per embeddings request (default 60000)
+    EMBEDDING_MAX_RETRIES             Retries per embedding batch on 429 / 5xx before the job fails (default 6)
+    CHUNK_TARGET_TOKENS               Tokens per ingested chunk (default 500, ~2000 characters)
+    CHUNK_OVERLAP_TOKENS              Tokens of each chunk repeated at the start of the next (default 0)
+    INGEST_PIPELINE_GROUP_SIZE        Chunks per embed/write group in the ingestion pipeline (default 128)
+    INGEST_PIPELINE_EMBED_WORKERS     Groups embedded concurrently while earlier groups are written (default 2)
+    BLOB_STORE_BACKEND                Where extracted text waits for workers: local (BLOB_STORE_DIR shared with
+                                      every worker host) or s3; unset (default) passes text in job arguments
+    BLOB_STORE_S3_BUCKET              Bucket for BLOB_STORE_BACKEND=s3 (BLOB_STORE_S3_ENDPOINT for S3-compatible stores)
+    EMBEDDING_CACHE_BACKEND           Chunk embedding cache: auto (Redis, else local SQLite), redis, local or off
+    EMBEDDING_CACHE_DIR               Directory of the local chunk embedding cache
 
 Example:
     # Terminal 1: Start the API server
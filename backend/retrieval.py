@@ -0,0 +1,2124 @@
+"""
+Chunk retrieval helpers for the question-answering endpoints.
+
+Similarity search over `Chunk.embedding` is served by a native Neo4j vector
+index (`db.index.vector.queryNodes`) with the chat / parent-chat / file / scope
+restrictions applied as a post-filter. Retrieval is two-phase: the ranking
+queries return only ids, document ids and scores, and hydrate_chunks fetches
+text for just the final winners in one batched query. The full scan is kept
+as the fallback for when the index is unavailable or the post-filter cannot
+fill the requested k; it scores a process-local, per-chat float32 embedding
+matrix that is rebuilt only when the chat's content version changes (see
+bump_chat_version).
+
+Chunk embeddings can be stored as compact little-endian bytes (float32,
+float16 or int8 with a per-vector scale, EMBEDDING_STORAGE) in
+`Chunk.embeddingBlob`, which the full scan decodes with np.frombuffer instead
+of materializing Python floats. The vector index only reads the list
+property, so the list is kept next to the blob unless RETRIEVAL_MODE is
+full_scan (EMBEDDING_STORE_LIST).
+
+Chats can store reduced-size embeddings (256/512/1024, recorded as
+`Document.embeddingDimensions`); the question is embedded once at full size
+and shortened per chat (shorten_embedding), each size has its own vector
+index, and mixed-size matrices (mid re-embed) are scored exactly through
+dimension_norms.
+
+Question embeddings are cached in two tiers (in-process LRU, then Redis) so
+repeated questions skip the embeddings API.
+
+With HYBRID_RETRIEVAL on (it is opt-in), the vector ranking is fused with
+Neo4j full-text (Lucene BM25) rankings over Chunk.text and Document.filename
+using reciprocal-rank fusion to pick the candidates, which are then ordered
+by score like vector-only results; identifier-like questions are answered
+from the full-text index alone without embedding the question.
+"""
+
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from cachetools import TTLCache
+
+from ann_index import (
+    ChatAnnIndex, ann_index_cache, has_ann_index, delete_chat_ann_index, ANN_INDEX_ENABLED, ANN_INDEX_MIN_CHUNKS,
+    ANN_INDEX_MAX_STALE_FRACTION
+)
+
+logger = logging.getLogger(__name__)
+
+# "vector_index" (default) or "full_scan"
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector_index").lower()
+CHUNK_VECTOR_INDEX = os.getenv("CHUNK_VECTOR_INDEX", "chunk_embedding_index")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1536"))
+# Reduced sizes a chat can opt into (text-embedding-3 native shortening); the
+# vector index for a reduced size covers the Chunk nodes with its extra label
+SUPPORTED_EMBEDDING_DIMENSIONS = tuple(sorted({256, 512, 1024, EMBEDDING_DIMENSIONS}))
+# The index is global across chats, so over-fetch candidates before post-filtering
+VECTOR_INDEX_OVERFETCH = int(os.getenv("VECTOR_INDEX_OVERFETCH", "20"))
+VECTOR_INDEX_MAX_CANDIDATES = int(os.getenv("VECTOR_INDEX_MAX_CANDIDATES", "10000"))
+VECTOR_INDEX_RETRY_SECONDS = 300
+# Chunks handed to the endpoints for filename boosting before their final top-k cut
+RETRIEVAL_CANDIDATE_POOL = int(os.getenv("RETRIEVAL_CANDIDATE_POOL", "50"))
+# Memory budget for the per-chat embedding matrix cache
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+
+# Chunk embedding storage: "list" (Neo4j list of floats) or a byte encoding
+# ("float32", "float16", "int8"), see encode_embedding
+EMBEDDING_ENCODINGS = ("list", "float32", "float16", "int8")
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "list").lower()
+if EMBEDDING_STORAGE not in EMBEDDING_ENCODINGS:
+    logger.warning(f"⚠️ Unknown EMBEDDING_STORAGE {EMBEDDING_STORAGE!r}, storing embeddings as lists")
+    EMBEDDING_STORAGE = "list"
+# The vector index can only read list properties, so byte-encoded chunks keep
+# the list as well unless retrieval runs in full_scan mode
+EMBEDDING_STORE_LIST = os.getenv(
+    "EMBEDDING_STORE_LIST", "true" if RETRIEVAL_MODE == "vector_index" else "false"
+).lower() == "true"
+
+# Question embedding cache: in-process LRU in front of Redis
+QUESTION_EMBEDDING_CACHE_SIZE = int(os.getenv("QUESTION_EMBEDDING_CACHE_SIZE", "2048"))
+QUESTION_EMBEDDING_LOCAL_TTL = int(os.getenv("QUESTION_EMBEDDING_LOCAL_TTL", "3600"))
+QUESTION_EMBEDDING_REDIS_TTL = int(os.getenv("QUESTION_EMBEDDING_REDIS_TTL", str(7 * 24 * 3600)))
+
+# Hybrid lexical + vector retrieval (reciprocal-rank fusion)
+# Opt-in: fusion changes which chunks every endpoint retrieves
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "false").lower() == "true"
+CHUNK_FULLTEXT_INDEX = os.getenv("CHUNK_FULLTEXT_INDEX", "chunk_text_fulltext")
+DOCUMENT_FULLTEXT_INDEX = os.getenv("DOCUMENT_FULLTEXT_INDEX", "document_filename_fulltext")
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+# Full-text indexes are global across chats too: Lucene returns at most top_k * this many hits to post-filter
+FULLTEXT_INDEX_OVERFETCH = int(os.getenv("FULLTEXT_INDEX_OVERFETCH", "20"))
+# Maximal-marginal-relevance re-ranking defaults (chat settings mmrLambda / mmrCandidatePool override)
+MMR_DEFAULT_LAMBDA = float(os.getenv("MMR_DEFAULT_LAMBDA", "0.7"))
+MMR_MAX_CANDIDATE_POOL = int(os.getenv("MMR_MAX_CANDIDATE_POOL", "200"))
+# Documents whose filename matches the question that contribute a fusion term
+FILENAME_MATCH_LIMIT = 10
+
+# Per embedding size: None = not checked yet, True = index online, False = unavailable (retry later)
+_vector_index_state: Dict[int, Optional[bool]] = {}
+_vector_index_checked_at: Dict[int, float] = {}
+_fulltext_index_state: Optional[bool] = None
+_fulltext_index_checked_at = 0.0
+
+
+_lookup_indexes_ready = False
+
+
+def ensure_lookup_indexes(session):
+    """Create the Chunk.chatId / Chunk.id / Document.chatId range indexes used by filtering and hydration."""
+    global _lookup_indexes_ready
+    if _lookup_indexes_ready:
+        return
+    for statement in (
+        "CREATE INDEX chunk_chat_id IF NOT EXISTS FOR (c:Chunk) ON (c.chatId)",
+        "CREATE INDEX chunk_id IF NOT EXISTS FOR (c:Chunk) ON (c.id)",
+        "CREATE INDEX document_chat_id IF NOT EXISTS FOR (d:Document) ON (d.chatId)",
+    ):
+        try:
+            session.run(statement).consume()
+        except Exception as e:
+            # e.g. an equivalent uniqueness constraint already exists
+            logger.info(f"ℹ️ Skipped lookup index ({statement.split()[2]}): {e}")
+    _lookup_indexes_ready = True
+
+
+class ScopeClause(str):
+    """
+    Scope predicate (" AND c.`playlist_id` = $scope_filter_0") plus its parameter values.
+
+    Interpolates into query text like a plain predicate string; pass
+    **scope_params(clause) to session.run next to the other parameters so
+    the values never reach the query text and Neo4j can use the scope indexes.
+    """
+
+    def __new__(cls, text: str = "", params: Optional[Dict[str, Any]] = None):
+        clause = super().__new__(cls, text)
+        clause.params = dict(params or {})
+        return clause
+
+
+def build_scope_clause(scope_filters: Dict[str, Any], node_var: str = "c") -> ScopeClause:
+    """
+    Parameterized " AND ..." predicate for already-validated scope filters.
+
+    Args:
+        scope_filters: {scope_name: value}; names must pass validate_scope_name
+        node_var: Cypher variable of the node carrying the scope properties
+
+    Returns:
+        ScopeClause (empty when there are no filters)
+    """
+    conditions = []
+    params = {}
+    for i, (key, value) in enumerate(scope_filters.items()):
+        param_name = f"scope_filter_{i}"
+        conditions.append(f"{node_var}.`{key}` = ${param_name}")
+        params[param_name] = value
+    return ScopeClause(" AND " + " AND ".join(conditions) if conditions else "", params)
+
+
+def scope_params(scope_where_clause: str) -> Dict[str, Any]:
+    """Parameters of a ScopeClause ({} for plain predicate strings)."""
+    return getattr(scope_where_clause, "params", {})
+
+
+def scope_index_name(scope_name: str) -> str:
+    return "chunk_scope_" + re.sub(r"[^A-Za-z0-9_]", "_", scope_name)
+
+
+def _scope_index_chats_key(scope_name: str) -> str:
+    return f"trainly:scope_index_chats:{scope_name}"
+
+
+_local_scope_index_chats: Dict[str, set] = defaultdict(set)
+
+
+def ensure_scope_index(session, chat_id: str, scope_name: str):
+    """
+    Create the composite (chatId, scope) range index for a configured scope.
+
+    Property indexes are database-wide, so the chats using each scope are
+    tracked (Redis set, shared with other API processes) and drop_scope_index
+    only drops the index once no chat configures the scope any more.
+    """
+    _local_scope_index_chats[scope_name].add(chat_id)
+    conn = get_shared_redis()
+    if conn is not None:
+        try:
+            conn.sadd(_scope_index_chats_key(scope_name), chat_id)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not record scope index usage in Redis: {e}")
+    session.run(
+        f"CREATE INDEX {scope_index_name(scope_name)} IF NOT EXISTS "
+        f"FOR (c:Chunk) ON (c.chatId, c.`{scope_name}`)"
+    ).consume()
+    logger.info(f"📇 Scope index ready: Chunk(chatId, {scope_name})")
+
+
+def drop_scope_index(session, chat_id: str, scope_name: str) -> bool:
+    """
+    Release a chat's use of a scope index, dropping it when no chat uses the scope.
+
+    Returns:
+        True if the index was dropped
+    """
+    _local_scope_index_chats[scope_name].discard(chat_id)
+    remaining = len(_local_scope_index_chats[scope_name])
+    conn = get_shared_redis()
+    if conn is not None:
+        try:
+            key = _scope_index_chats_key(scope_name)
+            conn.srem(key, chat_id)
+            remaining = conn.scard(key)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read scope index usage from Redis, keeping index: {e}")
+            return False
+    if remaining:
+        return False
+    session.run(f"DROP INDEX {scope_index_name(scope_name)} IF EXISTS").consume()
+    logger.info(f"🗑️ Dropped scope index for {scope_name}")
+    return True
+
+
+def vector_index_name(dimensions: int = EMBEDDING_DIMENSIONS) -> str:
+    return CHUNK_VECTOR_INDEX if dimensions == EMBEDDING_DIMENSIONS else f"{CHUNK_VECTOR_INDEX}_{dimensions}"
+
+
+def chunk_labels(dimensions: int = EMBEDDING_DIMENSIONS) -> str:
+    """
+    Cypher labels for a Chunk with embeddings of the given size.
+
+    Neo4j allows one vector index per label/property, so reduced-size chunks
+    carry an extra ChunkDim{n} label that their index is built on (the
+    full-size index skips vectors of the wrong size).
+    """
+    if dimensions not in SUPPORTED_EMBEDDING_DIMENSIONS:
+        raise ValueError(f"Unsupported embedding dimensions: {dimensions}")
+    return "Chunk" if dimensions == EMBEDDING_DIMENSIONS else f"Chunk:ChunkDim{dimensions}"
+
+
+def ensure_vector_index(session, dimensions: int = EMBEDDING_DIMENSIONS) -> bool:
+    """
+    Create the Chunk embedding vector index for an embedding size if missing.
+
+    Safe to call on every ingest/query: the result is cached per process and a
+    failed check (e.g. Neo4j < 5.11) is only retried every few minutes.
+
+    Returns:
+        True if the vector index can be queried
+    """
+    state = _vector_index_state.get(dimensions)
+    if state is True:
+        return True
+    if state is False and time.time() - _vector_index_checked_at.get(dimensions, 0.0) < VECTOR_INDEX_RETRY_SECONDS:
+        return False
+
+    index_name = vector_index_name(dimensions)
+    label = chunk_labels(dimensions).split(":")[-1]
+    _vector_index_checked_at[dimensions] = time.time()
+    try:
+        session.run(
+            f"""
+            CREATE VECTOR INDEX {index_name} IF NOT EXISTS
+            FOR (c:{label}) ON (c.embedding)
+            OPTIONS {{indexConfig: {{
+                `vector.dimensions`: {dimensions},
+                `vector.similarity_function`: 'cosine'
+            }}}}
+            """
+        ).consume()
+
+        record = session.run(
+            "SHOW INDEXES YIELD name, state WHERE name = $name RETURN state",
+            name=index_name
+        ).single()
+        state = record["state"] if record else None
+        _vector_index_state[dimensions] = state == "ONLINE"
+        if _vector_index_state[dimensions]:
+            logger.info(f"✅ Vector index {index_name} is online")
+        else:
+            logger.info(f"⏳ Vector index {index_name} not ready yet (state: {state})")
+    except Exception as e:
+        logger.warning(f"⚠️ Vector index unavailable, using full scan retrieval: {e}")
+        _vector_index_state[dimensions] = False
+
+    return _vector_index_state[dimensions]
+
+
+def ensure_fulltext_indexes(session) -> bool:
+    """
+    Create the full-text indexes on Chunk.text and Document.filename if missing.
+
+    Cached per process like ensure_vector_index; a failed check is retried
+    every few minutes.
+
+    Returns:
+        True if both full-text indexes can be queried
+    """
+    global _fulltext_index_state, _fulltext_index_checked_at
+
+    if _fulltext_index_state is True:
+        return True
+    if _fulltext_index_state is False and time.time() - _fulltext_index_checked_at < VECTOR_INDEX_RETRY_SECONDS:
+        return False
+
+    _fulltext_index_checked_at = time.time()
+    try:
+        session.run(
+            f"CREATE FULLTEXT INDEX {CHUNK_FULLTEXT_INDEX} IF NOT EXISTS FOR (c:Chunk) ON EACH [c.text]"
+        ).consume()
+        session.run(
+            f"CREATE FULLTEXT INDEX {DOCUMENT_FULLTEXT_INDEX} IF NOT EXISTS FOR (d:Document) ON EACH [d.filename]"
+        ).consume()
+
+        states = {
+            record["name"]: record["state"]
+            for record in session.run(
+                "SHOW INDEXES YIELD name, state WHERE name IN $names RETURN name, state",
+                names=[CHUNK_FULLTEXT_INDEX, DOCUMENT_FULLTEXT_INDEX]
+            )
+        }
+        _fulltext_index_state = all(states.get(name) == "ONLINE" for name in (CHUNK_FULLTEXT_INDEX, DOCUMENT_FULLTEXT_INDEX))
+        if _fulltext_index_state:
+            logger.info("✅ Full-text indexes are online")
+        else:
+            logger.info(f"⏳ Full-text indexes not ready yet (states: {states})")
+    except Exception as e:
+        logger.warning(f"⚠️ Full-text indexes unavailable, using vector-only retrieval: {e}")
+        _fulltext_index_state = False
+
+    return _fulltext_index_state
+
+
+def _count_eligible_chunks(session, chat_ids: List[str], file_ids: Optional[List[str]],
+                           scope_where_clause: str, dimensions: int = EMBEDDING_DIMENSIONS) -> int:
+    query = f"""
+    MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
+    WHERE c.chatId IN $chat_ids AND ($file_ids IS NULL OR d.id IN $file_ids)
+      AND coalesce(d.embeddingDimensions, $default_dimensions) = $dimensions{scope_where_clause}
+    RETURN count(c) AS total
+    """
+    record = session.run(query, chat_ids=chat_ids, file_ids=file_ids, dimensions=dimensions,
+                         default_dimensions=EMBEDDING_DIMENSIONS, **scope_params(scope_where_clause)).single()
+    return record["total"] if record else 0
+
+
+def vector_index_search(
+    session,
+    question_embedding: List[float],
+    chat_ids: List[str],
+    top_k: int,
+    file_ids: Optional[List[str]] = None,
+    scope_where_clause: str = ""
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Top-k chunk search through the Neo4j vector index.
+
+    Args:
+        session: Open Neo4j session
+        question_embedding: Embedding of the question
+        chat_ids: Chats whose chunks are eligible (subchat and/or parent chat)
+        top_k: Number of chunks to return
+        file_ids: Optional Document ids to restrict to (published context files)
+        scope_where_clause: Extra " AND c.x = ..." predicate (a ScopeClause from build_scope_clause)
+
+    Chats whose documents use reduced embedding sizes are searched through
+    the index of each size with the question shortened to match, and the
+    rankings are merged by cosine.
+
+    Returns:
+        Chunks (without text, see hydrate_chunks) sorted by cosine similarity,
+        or None if the index cannot serve this query and the caller should
+        fall back to a full scan
+    """
+    rows = []
+    for dimensions in chat_embedding_dimensions(session, chat_ids):
+        if not ensure_vector_index(session, dimensions):
+            return None
+        dimension_rows = _vector_index_search_dimensions(
+            session, shorten_embedding(question_embedding, dimensions), dimensions,
+            chat_ids, top_k, file_ids, scope_where_clause
+        )
+        if dimension_rows is None:
+            return None
+        rows.extend(dimension_rows)
+    rows.sort(key=lambda row: row["score"], reverse=True)
+    return rows[:top_k]
+
+
+def _vector_index_search_dimensions(session, question_embedding: List[float], dimensions: int,
+                                    chat_ids: List[str], top_k: int, file_ids: Optional[List[str]],
+                                    scope_where_clause: str) -> Optional[List[Dict[str, Any]]]:
+    """vector_index_search against the index of one embedding size."""
+    query = f"""
+    CALL db.index.vector.queryNodes($index_name, $candidates, $embedding)
+    YIELD node AS c, score
+    WHERE c.chatId IN $chat_ids{scope_where_clause}
+    MATCH (d:Document)-[:HAS_CHUNK]->(c)
+    WHERE $file_ids IS NULL OR d.id IN $file_ids
+    RETURN c.id AS id, d.filename AS filename, c.chatId AS source_chat, d.id AS doc_id, score
+    ORDER BY score DESC
+    LIMIT $top_k
+    """
+
+    candidates = max(top_k * VECTOR_INDEX_OVERFETCH, top_k)
+    eligible = None
+    try:
+        while True:
+            results = session.run(
+                query,
+                index_name=vector_index_name(dimensions),
+                candidates=candidates,
+                embedding=question_embedding,
+                chat_ids=chat_ids,
+                file_ids=file_ids,
+                top_k=top_k,
+                **scope_params(scope_where_clause)
+            )
+            rows = [
+                {
+                    "chunk_id": record["id"],
+                    "filename": record["filename"],
+                    "source_chat": record["source_chat"],
+                    "doc_id": record["doc_id"],
+                    # The cosine index reports (1 + cos) / 2; convert back to raw cosine
+                    "score": 2.0 * record["score"] - 1.0,
+                }
+                for record in results
+            ]
+
+            if len(rows) >= top_k:
+                return rows
+
+            # Short result: either the filter really has fewer chunks, or the
+            # global candidate pool was too small for this chat
+            if eligible is None:
+                eligible = _count_eligible_chunks(session, chat_ids, file_ids, scope_where_clause, dimensions)
+            if len(rows) >= eligible:
+                return rows
+            if candidates >= VECTOR_INDEX_MAX_CANDIDATES:
+                logger.info(f"🔍 Vector index post-filter found {len(rows)}/{min(top_k, eligible)} chunks, falling back to full scan")
+                return None
+            candidates = min(candidates * 4, VECTOR_INDEX_MAX_CANDIDATES)
+    except Exception as e:
+        logger.warning(f"⚠️ Vector index query failed, falling back to full scan: {e}")
+        return None
+
+
+# ==============================================================================
+# Vectorized scoring
+# ==============================================================================
+
+# Filename boost styles: "simple" (+0.1 if any question word occurs in the
+# filename, used by the published-settings endpoints) and "weighted" (+0.1 per
+# matching filename/question word pair, +0.2 for an exact filename word match)
+BOOST_SIMPLE = "simple"
+BOOST_WEIGHTED = "weighted"
+
+
+def filename_boost(question: str, filename: str, style: str = BOOST_WEIGHTED) -> float:
+    """Score bonus for chunks whose filename is mentioned in the question."""
+    if not filename or not question:
+        return 0.0
+    question_lower = question.lower()
+    filename_lower = filename.lower()
+
+    if style == BOOST_SIMPLE:
+        return 0.1 if any(word in filename_lower for word in question_lower.split()) else 0.0
+
+    # Remove file extension for better matching
+    filename_base = filename_lower.replace('.pdf', '').replace('.docx', '').replace('.txt', '')
+    filename_words = filename_base.replace('_', ' ').replace('-', ' ').split()
+    question_words = question_lower.replace('_', ' ').replace('-', ' ').split()
+
+    boost = 0.0
+    for fname_word in filename_words:
+        if len(fname_word) > 2:  # Skip very short words
+            for q_word in question_words:
+                if fname_word in q_word or q_word in fname_word:
+                    boost += 0.1
+
+    # Additional boost for exact filename matches
+    if any(fname_word in question_lower for fname_word in filename_words if len(fname_word) > 3):
+        boost += 0.2
+    return boost
+
+
+def filename_boost_vector(question: str, unique_filenames: np.ndarray, filename_codes: np.ndarray,
+                          style: str = BOOST_WEIGHTED) -> Optional[np.ndarray]:
+    """
+    Per-row filename boost as a float32 vector.
+
+    The boost only depends on the filename, so it is computed once per distinct
+    filename and broadcast to rows through filename_codes (np.unique inverse).
+
+    Returns:
+        Boost vector aligned with the rows, or None when no filename matches
+    """
+    if not question or len(unique_filenames) == 0:
+        return None
+    per_file = np.array([filename_boost(question, name, style) for name in unique_filenames], dtype=np.float32)
+    if not per_file.any():
+        return None
+    return per_file[filename_codes]
+
+
+def score_top_k(
+    question_vector: np.ndarray,
+    matrix: np.ndarray,
+    k: int,
+    norms: Optional[np.ndarray] = None,
+    boost: Optional[np.ndarray] = None,
+    mask: Optional[np.ndarray] = None
+) -> tuple:
+    """
+    Top-k cosine scoring of a question against an (N x D) embedding matrix.
+
+    One matrix-vector product scores every row; argpartition selects the k best
+    in O(N) and only those k are sorted.
+
+    Args:
+        question_vector: (D,) question embedding
+        matrix: (N, D) float32 chunk embeddings
+        k: Number of rows to return
+        norms: Optional precomputed row norms; pass None for unit-normalized rows
+        boost: Optional (N,) additive score boost (e.g. filename_boost_vector)
+        mask: Optional (N,) bool array of eligible rows
+
+    Returns:
+        (row_indices, scores) sorted by score descending; at most k entries
+    """
+    n = matrix.shape[0]
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    q = np.asarray(question_vector, dtype=np.float32)
+    q_norm = float(np.linalg.norm(q)) or 1.0
+    scores = matrix @ (q / q_norm)
+    if norms is not None:
+        scores /= norms
+    if boost is not None:
+        scores += boost
+    if mask is not None:
+        scores = np.where(mask, scores, -np.inf)
+        k = min(k, int(mask.sum()))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    if k < n:
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(n)
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return top, scores[top]
+
+
+def shorten_embedding(embedding, dimensions: int) -> List[float]:
+    """
+    First `dimensions` components of an embedding, re-normalized.
+
+    For text-embedding-3 models this equals requesting the shorter embedding
+    from the API (native shortening), so one full-size question embedding
+    serves chats stored at any size.
+    """
+    if len(embedding) <= dimensions:
+        return list(embedding)
+    vector = np.asarray(embedding[:dimensions], dtype=np.float32)
+    norm = float(np.linalg.norm(vector)) or 1.0
+    return (vector / norm).tolist()
+
+
+def dimension_norms(question_vector, row_dims: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    """
+    Per-row norms for score_top_k over a zero-padded matrix of mixed embedding sizes.
+
+    A row stored at d dimensions is compared with the question shortened to d:
+    dividing its dot product with the unit question by |q[:d]| / |q| gives
+    exactly that cosine. Returns None for uniform matrices (row_dims None).
+    """
+    if row_dims is None:
+        return None
+    q = np.asarray(question_vector, dtype=np.float32)
+    prefix = np.sqrt(np.cumsum(q.astype(np.float64) ** 2))
+    total = prefix[-1] or 1.0
+    return np.maximum(prefix[row_dims - 1] / total, 1e-12).astype(np.float32)
+
+
+# ==============================================================================
+# Embedding normalization
+# ==============================================================================
+
+def normalize_embeddings(embeddings: List[List[float]]) -> tuple:
+    """
+    Unit-normalize embeddings for storage.
+
+    Returns:
+        (unit_embeddings, norms): lists aligned with the input; zero vectors are
+        kept as-is with norm 0.0
+    """
+    if not embeddings:
+        return [], []
+    matrix = np.asarray(embeddings, dtype=np.float64)
+    norms = np.linalg.norm(matrix, axis=1)
+    unit = matrix / np.where(norms == 0, 1.0, norms)[:, None]
+    return unit.tolist(), norms.tolist()
+
+
+def backfill_normalized_embeddings(session, batch_size: int = 500) -> int:
+    """
+    Normalize Chunk embeddings written before ingest-time normalization.
+
+    Processes chunks without an embeddingNorm property in batches, storing the
+    unit vector in `embedding` and the original norm in `embeddingNorm`.
+
+    Returns:
+        Number of chunks updated
+    """
+    fetch_query = """
+    MATCH (c:Chunk)
+    WHERE c.embedding IS NOT NULL AND c.embeddingNorm IS NULL
+    RETURN elementId(c) AS element_id, c.embedding AS embedding
+    LIMIT $batch_size
+    """
+    update_query = """
+    UNWIND $rows AS row
+    MATCH (c:Chunk) WHERE elementId(c) = row.element_id
+    SET c.embedding = row.embedding, c.embeddingNorm = row.norm
+    """
+    updated = 0
+    while True:
+        records = list(session.run(fetch_query, batch_size=batch_size))
+        if not records:
+            break
+        unit, norms = normalize_embeddings([record["embedding"] for record in records])
+        rows = [
+            {"element_id": record["element_id"], "embedding": embedding, "norm": norm}
+            for record, embedding, norm in zip(records, unit, norms)
+        ]
+        session.execute_write(lambda tx: tx.run(update_query, rows=rows).consume())
+        updated += len(rows)
+        logger.info(f"📐 Normalized {updated} chunk embeddings so far")
+    return updated
+
+
+# ==============================================================================
+# Compact embedding storage
+# ==============================================================================
+
+_BYTE_DTYPES = {"float32": np.dtype("<f4"), "float16": np.dtype("<f2")}
+
+
+def _int8_dtype(dimensions: int) -> np.dtype:
+    # One record per vector: little-endian float32 scale followed by the int8 codes
+    return np.dtype([("scale", "<f4"), ("codes", "i1", (dimensions,))])
+
+
+def encode_embedding(embedding, encoding: str = EMBEDDING_STORAGE) -> bytes:
+    """
+    Encode one (unit-normalized) embedding as little-endian bytes.
+
+    Args:
+        embedding: Embedding vector
+        encoding: "float32" (4 bytes/dim), "float16" (2 bytes/dim) or "int8"
+            (1 byte/dim plus a 4-byte per-vector scale, max |x| / 127)
+
+    Returns:
+        Bytes for the Chunk.embeddingBlob property
+    """
+    vector = np.asarray(embedding, dtype=np.float32)
+    if encoding in _BYTE_DTYPES:
+        return vector.astype(_BYTE_DTYPES[encoding]).tobytes()
+    if encoding == "int8":
+        peak = float(np.max(np.abs(vector))) if vector.size else 0.0
+        scale = peak / 127.0 if peak else 1.0
+        record = np.zeros(1, dtype=_int8_dtype(vector.size))
+        record["scale"] = scale
+        record["codes"] = np.clip(np.rint(vector / scale), -127, 127)
+        return record.tobytes()
+    raise ValueError(f"Unsupported embedding encoding: {encoding}")
+
+
+def decode_embeddings(blobs: List[bytes], encoding: str) -> np.ndarray:
+    """
+    Decode same-encoding, same-dimension embedding blobs into an (N x D) float32 matrix.
+
+    The blobs are concatenated once and read with np.frombuffer, so no Python
+    float objects are created.
+    """
+    if not blobs:
+        return np.empty((0, EMBEDDING_DIMENSIONS), dtype=np.float32)
+    buffer = b"".join(blobs)
+    if encoding in _BYTE_DTYPES:
+        matrix = np.frombuffer(buffer, dtype=_BYTE_DTYPES[encoding]).reshape(len(blobs), -1)
+        return matrix.astype(np.float32)
+    if encoding == "int8":
+        dimensions = len(blobs[0]) - 4
+        records = np.frombuffer(buffer, dtype=_int8_dtype(dimensions))
+        matrix = records["codes"].astype(np.float32)
+        matrix *= records["scale"][:, None]
+        return matrix
+    raise ValueError(f"Unsupported embedding encoding: {encoding}")
+
+
+def chunk_embedding_params(unit_embedding: List[float]) -> Dict[str, Any]:
+    """
+    Chunk property parameters for an embedding under EMBEDDING_STORAGE.
+
+    Returns:
+        {"embedding", "embedding_blob", "embedding_encoding"}; unused ones are
+        None, which CREATE leaves unset
+    """
+    if EMBEDDING_STORAGE == "list":
+        return {"embedding": unit_embedding, "embedding_blob": None, "embedding_encoding": None}
+    return {
+        "embedding": unit_embedding if EMBEDDING_STORE_LIST else None,
+        "embedding_blob": encode_embedding(unit_embedding, EMBEDDING_STORAGE),
+        "embedding_encoding": EMBEDDING_STORAGE,
+    }
+
+
+def _stored_dimensions(record) -> int:
+    if record["blob"] is None:
+        return len(record["embedding"])
+    if record["encoding"] == "int8":
+        return len(record["blob"]) - 4
+    return len(record["blob"]) // _BYTE_DTYPES[record["encoding"]].itemsize
+
+
+def _records_to_matrix(records: List[Any]) -> tuple:
+    """
+    Float32 matrix from records with embedding / blob / encoding fields, in record order.
+
+    Rows are grouped by storage encoding and embedding size so each group is
+    decoded in one call. Rows shorter than the widest are zero-padded.
+
+    Returns:
+        (matrix, row_dims) where row_dims is an int array of each row's stored
+        size, or None when all rows have the same size
+    """
+    if not records:
+        return np.empty((0, EMBEDDING_DIMENSIONS), dtype=np.float32), None
+
+    groups: Dict[tuple, List[int]] = defaultdict(list)
+    for index, record in enumerate(records):
+        encoding = record["encoding"] if record["blob"] is not None else "list"
+        groups[(encoding, _stored_dimensions(record))].append(index)
+
+    width = max(dimensions for _, dimensions in groups)
+    matrix = np.zeros((len(records), width), dtype=np.float32)
+    row_dims = np.full(len(records), width, dtype=np.int64)
+    for (encoding, dimensions), rows in groups.items():
+        if encoding == "list":
+            decoded = np.array([records[i]["embedding"] for i in rows], dtype=np.float32)
+        else:
+            decoded = decode_embeddings([bytes(records[i]["blob"]) for i in rows], encoding)
+        matrix[rows, :dimensions] = decoded
+        row_dims[rows] = dimensions
+    return matrix, (row_dims if len(groups) > 1 and (row_dims != width).any() else None)
+
+
+def migrate_embedding_storage(session, encoding: str = EMBEDDING_STORAGE, batch_size: int = 500,
+                              keep_list: bool = EMBEDDING_STORE_LIST) -> List[str]:
+    """
+    Re-encode existing Chunk embeddings to the given storage encoding.
+
+    Legacy (un-normalized) embeddings are normalized on the way. Converting
+    back to "list" restores the list property and removes the blob.
+
+    Args:
+        session: Open Neo4j session
+        encoding: Target encoding (one of EMBEDDING_ENCODINGS)
+        batch_size: Chunks per write transaction
+        keep_list: Keep the list property next to the blob (needed by the vector index)
+
+    Returns:
+        Ids of the chats whose chunks were rewritten (their versions must be bumped)
+    """
+    if encoding not in EMBEDDING_ENCODINGS:
+        raise ValueError(f"Unsupported embedding encoding: {encoding}")
+
+    fetch_query = """
+    MATCH (c:Chunk)
+    WHERE (c.embedding IS NOT NULL OR c.embeddingBlob IS NOT NULL)
+      AND coalesce(c.embeddingEncoding, 'list') <> $encoding
+    RETURN elementId(c) AS element_id, c.chatId AS chat_id,
+           CASE WHEN c.embeddingBlob IS NULL THEN c.embedding END AS embedding,
+           c.embeddingBlob AS blob, c.embeddingEncoding AS encoding,
+           c.embeddingNorm IS NOT NULL AS normalized
+    LIMIT $batch_size
+    """
+    to_list_query = """
+    UNWIND $rows AS row
+    MATCH (c:Chunk) WHERE elementId(c) = row.element_id
+    SET c.embedding = row.embedding, c.embeddingNorm = coalesce(c.embeddingNorm, row.norm)
+    REMOVE c.embeddingBlob, c.embeddingEncoding
+    """
+    to_blob_query = """
+    UNWIND $rows AS row
+    MATCH (c:Chunk) WHERE elementId(c) = row.element_id
+    SET c.embeddingBlob = row.blob, c.embeddingEncoding = $encoding,
+        c.embedding = CASE WHEN $keep_list THEN row.embedding ELSE null END,
+        c.embeddingNorm = coalesce(c.embeddingNorm, row.norm)
+    """
+
+    chat_ids = set()
+    migrated = 0
+    while True:
+        records = list(session.run(fetch_query, encoding=encoding, batch_size=batch_size))
+        if not records:
+            break
+        matrix, row_dims = _records_to_matrix(records)
+        norms = np.linalg.norm(matrix, axis=1)
+        legacy = ~np.array([record["normalized"] for record in records], dtype=bool)
+        matrix[legacy] /= np.where(norms[legacy] == 0, 1.0, norms[legacy])[:, None]
+
+        rows = []
+        for index, (record, vector, norm, was_legacy) in enumerate(zip(records, matrix, norms, legacy)):
+            if row_dims is not None:
+                vector = vector[:row_dims[index]]
+            row = {"element_id": record["element_id"], "norm": float(norm) if was_legacy else None}
+            if encoding == "list" or keep_list:
+                row["embedding"] = vector.tolist()
+            if encoding != "list":
+                row["blob"] = encode_embedding(vector, encoding)
+            rows.append(row)
+            chat_ids.add(record["chat_id"])
+
+        if encoding == "list":
+            session.execute_write(lambda tx: tx.run(to_list_query, rows=rows).consume())
+        else:
+            session.execute_write(
+                lambda tx: tx.run(to_blob_query, rows=rows, encoding=encoding, keep_list=keep_list).consume()
+            )
+        migrated += len(rows)
+        logger.info(f"🗜️ Re-encoded {migrated} chunk embeddings as {encoding} so far")
+    return sorted(chat_id for chat_id in chat_ids if chat_id)
+
+
+# ==============================================================================
+# Per-chat embedding matrix cache
+# ==============================================================================
+
+class ChatEmbeddingMatrix:
+    """
+    All embeddings of one chat as a contiguous float32 matrix plus parallel id arrays.
+
+    Rows are unit-normalized, so scoring against it is a pure dot product. The
+    width is the chat's embedding size; while a chat is being re-embedded to
+    another size, shorter rows are zero-padded and row_dims records each
+    row's size (see dimension_norms).
+    """
+
+    def __init__(self, chat_id: str, version: int, matrix: np.ndarray, chunk_ids: np.ndarray,
+                 doc_ids: np.ndarray, filenames: np.ndarray, row_dims: Optional[np.ndarray] = None):
+        self.chat_id = chat_id
+        self.version = version
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.row_dims = row_dims
+        self.chunk_ids = chunk_ids
+        self.doc_ids = doc_ids
+        self.filenames = filenames
+        if len(filenames):
+            self.unique_filenames, self.filename_codes = np.unique(filenames, return_inverse=True)
+        else:
+            self.unique_filenames, self.filename_codes = np.empty(0, dtype=object), np.empty(0, dtype=np.int64)
+
+    @property
+    def size(self) -> int:
+        return len(self.chunk_ids)
+
+    @property
+    def nbytes(self) -> int:
+        # Matrix plus a rough allowance for the id/filename strings
+        return self.matrix.nbytes + (self.row_dims.nbytes if self.row_dims is not None else 0) + self.size * 256
+
+
+class EmbeddingMatrixCache:
+    """
+    Process-local LRU cache of ChatEmbeddingMatrix entries bounded by a memory budget.
+
+    Entries are tagged with the chat content version they were built from; a
+    lookup with a newer version misses so the matrix gets rebuilt.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, ChatEmbeddingMatrix]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, chat_id: str, version: int) -> Optional[ChatEmbeddingMatrix]:
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is None or entry.version != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(chat_id)
+            self.hits += 1
+            return entry
+
+    def put(self, entry: ChatEmbeddingMatrix):
+        with self._lock:
+            self._remove(entry.chat_id)
+            if entry.nbytes > self.max_bytes:
+                logger.info(f"📦 Embedding matrix for {entry.chat_id} ({entry.nbytes} bytes) exceeds cache budget, not caching")
+                return
+            self._entries[entry.chat_id] = entry
+            self._bytes += entry.nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                evicted_id, _ = next(iter(self._entries.items()))
+                self._remove(evicted_id)
+                self.evictions += 1
+
+    def invalidate(self, chat_id: str):
+        with self._lock:
+            self._remove(chat_id)
+
+    def _remove(self, chat_id: str):
+        entry = self._entries.pop(chat_id, None)
+        if entry is not None:
+            self._bytes -= entry.nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "chats": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+embedding_matrix_cache = EmbeddingMatrixCache(EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+
+# Chat content versions. Ingestion runs in RQ workers, so the authoritative
+# counter lives in Redis; the local dict covers deployments without Redis.
+_redis_provider: Optional[Callable[[], Any]] = None
+_local_chat_versions: Dict[str, int] = defaultdict(int)
+
+
+def set_redis_provider(provider: Callable[[], Any]):
+    """Register the function used to obtain the shared Redis connection."""
+    global _redis_provider
+    _redis_provider = provider
+
+
+_redis_retry_at = 0.0
+
+
+def get_shared_redis():
+    """Shared Redis connection, or None while Redis is unavailable (retried after 60s)."""
+    global _redis_retry_at
+    if _redis_provider is None or time.time() < _redis_retry_at:
+        return None
+    try:
+        conn = _redis_provider()
+    except Exception:
+        conn = None
+    if conn is None:
+        # Don't attempt a reconnect on every query while Redis is down
+        _redis_retry_at = time.time() + 60
+    return conn
+
+
+def _chat_version_key(chat_id: str) -> str:
+    return f"trainly:chat_version:{chat_id}"
+
+
+def get_chat_version(chat_id: str) -> int:
+    """Current content version of a chat (changes whenever its chunks change)."""
+    conn = get_shared_redis()
+    if conn is not None:
+        try:
+            value = conn.get(_chat_version_key(chat_id))
+            return int(value) if value else 0
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read chat version from Redis: {e}")
+    return _local_chat_versions[chat_id]
+
+
+def bump_chat_version(chat_id: str) -> int:
+    """Mark a chat's chunks as changed so cached matrices are rebuilt."""
+    _local_chat_versions[chat_id] += 1
+    embedding_matrix_cache.invalidate(chat_id)
+    conn = get_shared_redis()
+    if conn is not None:
+        try:
+            return int(conn.incr(_chat_version_key(chat_id)))
+        except Exception as e:
+            logger.warning(f"⚠️ Could not bump chat version in Redis: {e}")
+    return _local_chat_versions[chat_id]
+
+
+# ==============================================================================
+# Per-chat embedding dimensions
+# ==============================================================================
+
+# (chat_id, chat version) -> embedding sizes stored on the chat's documents
+_chat_dimensions_cache = TTLCache(maxsize=4096, ttl=3600)
+_chat_dimensions_lock = threading.Lock()
+_local_target_dimensions: Dict[str, int] = {}
+
+
+def _target_dimensions_key(chat_id: str) -> str:
+    return f"trainly:chat_embedding_dims:{chat_id}"
+
+
+def get_chat_target_dimensions(chat_id: str) -> int:
+    """Embedding size new chunks of a chat are written with (its embeddingDimensions setting)."""
+    conn = get_shared_redis()
+    if conn is not None:
+        try:
+            value = conn.get(_target_dimensions_key(chat_id))
+            if value:
+                return int(value)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read chat embedding dimensions from Redis: {e}")
+    return _local_target_dimensions.get(chat_id, EMBEDDING_DIMENSIONS)
+
+
+def set_chat_target_dimensions(chat_id: str, dimensions: int):
+    """Record the embedding size for a chat's new chunks, shared with the ingest workers."""
+    if dimensions not in SUPPORTED_EMBEDDING_DIMENSIONS:
+        raise ValueError(f"Unsupported embedding dimensions: {dimensions}")
+    _local_target_dimensions[chat_id] = dimensions
+    conn = get_shared_redis()
+    if conn is not None:
+        try:
+            conn.set(_target_dimensions_key(chat_id), dimensions)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not store chat embedding dimensions in Redis: {e}")
+
+
+def chat_embedding_dimensions(session, chat_ids: List[str]) -> List[int]:
+    """
+    Embedding sizes stored across the chats' documents, largest first.
+
+    More than one size only occurs while a re-embed job is moving a chat
+    between settings (or across subchat and parent chat). Cached per chat
+    version.
+    """
+    sizes = set()
+    for chat_id in chat_ids:
+        key = (chat_id, get_chat_version(chat_id))
+        with _chat_dimensions_lock:
+            cached = _chat_dimensions_cache.get(key)
+        if cached is None:
+            results = session.run(
+                """
+                MATCH (d:Document) WHERE d.chatId = $chat_id
+                RETURN DISTINCT coalesce(d.embeddingDimensions, $default_dimensions) AS dimensions
+                """,
+                chat_id=chat_id, default_dimensions=EMBEDDING_DIMENSIONS
+            )
+            cached = tuple(record["dimensions"] for record in results)
+            with _chat_dimensions_lock:
+                _chat_dimensions_cache[key] = cached
+        sizes.update(cached)
+    return sorted(sizes, reverse=True) or [EMBEDDING_DIMENSIONS]
+
+
+# ==============================================================================
+# Question embedding cache
+# ==============================================================================
+
+def normalize_embedding_text(text: str) -> str:
+    """
+    Canonical form of a text for embedding cache keys.
+
+    Only Unicode normalization and whitespace are folded; case and punctuation
+    are kept because they can change the embedding.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class QuestionEmbeddingCache:
+    """
+    Two-tier cache for query embeddings keyed by (model, normalized text hash).
+
+    Tier 1 is a process-local TTL/LRU cache; tier 2 is the shared Redis
+    connection, so repeated questions across workers and end users skip the
+    embeddings API round trip. Values are stored as float32 bytes.
+    """
+
+    def __init__(self, max_entries: int, local_ttl: int, redis_ttl: int):
+        self.redis_ttl = redis_ttl
+        self._local = TTLCache(maxsize=max_entries, ttl=local_ttl)
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        digest = hashlib.sha256(normalize_embedding_text(text).encode("utf-8")).hexdigest()
+        return f"trainly:qemb:{model}:{digest}"
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        key = self.make_key(model, text)
+        with self._lock:
+            vector = self._local.get(key)
+            if vector is not None:
+                self.local_hits += 1
+                return vector.tolist()
+
+        conn = get_shared_redis()
+        if conn is not None:
+            try:
+                raw = conn.get(key)
+            except Exception as e:
+                logger.warning(f"⚠️ Could not read question embedding from Redis: {e}")
+                raw = None
+            if raw:
+                vector = np.frombuffer(raw, dtype=np.float32)
+                with self._lock:
+                    self._local[key] = vector
+                    self.redis_hits += 1
+                return vector.tolist()
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, model: str, text: str, embedding: List[float]):
+        key = self.make_key(model, text)
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._local[key] = vector
+        conn = get_shared_redis()
+        if conn is not None:
+            try:
+                conn.set(key, vector.tobytes(), ex=self.redis_ttl)
+            except Exception as e:
+                logger.warning(f"⚠️ Could not write question embedding to Redis: {e}")
+
+    def get_or_compute(self, model: str, text: str, compute: Callable[[str], List[float]]) -> List[float]:
+        """Return the cached embedding for text, calling compute(text) on a miss."""
+        cached = self.get(model, text)
+        if cached is not None:
+            return cached
+        embedding = compute(text)
+        self.put(model, text, embedding)
+        return embedding
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.local_hits + self.redis_hits + self.misses
+            return {
+                "entries": len(self._local),
+                "max_entries": self._local.maxsize,
+                "local_hits": self.local_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.local_hits + self.redis_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+question_embedding_cache = QuestionEmbeddingCache(
+    QUESTION_EMBEDDING_CACHE_SIZE, QUESTION_EMBEDDING_LOCAL_TTL, QUESTION_EMBEDDING_REDIS_TTL
+)
+
+
+def load_chat_matrix(session, chat_id: str, version: int, doc_id: Optional[str] = None) -> ChatEmbeddingMatrix:
+    """
+    Read all embeddings of a chat (or one of its documents) from Neo4j.
+
+    Only ids and embeddings are read, no text; blobs are preferred over lists.
+    """
+    query = """
+    MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
+    WHERE c.chatId = $chat_id AND ($doc_id IS NULL OR d.id = $doc_id)
+      AND (c.embedding IS NOT NULL OR c.embeddingBlob IS NOT NULL)
+    RETURN c.id AS id,
+           CASE WHEN c.embeddingBlob IS NULL THEN c.embedding END AS embedding,
+           c.embeddingBlob AS blob, c.embeddingEncoding AS encoding,
+           c.embeddingNorm IS NOT NULL AS normalized,
+           d.id AS doc_id, d.filename AS filename
+    """
+    records = list(session.run(query, chat_id=chat_id, doc_id=doc_id))
+    chunk_ids = [record["id"] for record in records]
+    normalized = [record["normalized"] for record in records]
+    doc_ids = [record["doc_id"] for record in records]
+    filenames = [record["filename"] or "" for record in records]
+
+    # Byte-encoded embeddings are decoded with np.frombuffer; list rows (when the
+    # list is the only copy) are converted as before
+    matrix, row_dims = _records_to_matrix(records)
+
+    # Chunks ingested before embeddings were stored normalized are normalized here, once per load
+    legacy_rows = np.flatnonzero(~np.array(normalized, dtype=bool)) if normalized else np.empty(0, dtype=np.int64)
+    if len(legacy_rows):
+        norms = np.linalg.norm(matrix[legacy_rows], axis=1, keepdims=True)
+        matrix[legacy_rows] /= np.where(norms == 0, 1.0, norms)
+
+    return ChatEmbeddingMatrix(
+        chat_id, version, matrix,
+        np.array(chunk_ids, dtype=object),
+        np.array(doc_ids, dtype=object),
+        np.array(filenames, dtype=object),
+        row_dims
+    )
+
+
+def get_chat_matrix(session, chat_id: str) -> ChatEmbeddingMatrix:
+    """Cached embedding matrix for a chat, rebuilt when the chat version changes."""
+    # Read the version before loading so a concurrent ingest forces a reload next time
+    version = get_chat_version(chat_id)
+    entry = embedding_matrix_cache.get(chat_id, version)
+    if entry is not None:
+        return entry
+
+    started = time.time()
+    entry = load_chat_matrix(session, chat_id, version)
+    embedding_matrix_cache.put(entry)
+    logger.info(f"📦 Loaded embedding matrix for {chat_id}: {entry.size} chunks in {time.time() - started:.2f}s (version {version})")
+    return entry
+
+
+def _fetch_scoped_chunk_ids(session, chat_ids: List[str], scope_where_clause: str) -> List[str]:
+    """Ids of the chunks matching a scope predicate (no embeddings or text)."""
+    query = f"""
+    MATCH (c:Chunk)
+    WHERE c.chatId IN $chat_ids{scope_where_clause}
+    RETURN c.id AS id
+    """
+    return [record["id"] for record in session.run(query, chat_ids=chat_ids, **scope_params(scope_where_clause))]
+
+
+def hydrate_chunks(session, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Second retrieval phase: fetch text and filename for just the winning chunks.
+
+    The ranking queries only return ids, document ids and scores, so chunk text
+    crosses Bolt once per selected chunk instead of once per candidate.
+
+    Args:
+        session: Open Neo4j session
+        rows: Ranked chunks from search_chunks(..., hydrate=False)
+
+    Returns:
+        The same rows, in order, with chunk_text, filename and token_count
+        filled in; chunks deleted since they were ranked are dropped
+    """
+    if not rows:
+        return []
+    results = session.run(
+        """
+        MATCH (d:Document)-[:HAS_CHUNK]->(c:Chunk)
+        WHERE c.id IN $ids
+        RETURN c.id AS id, c.text AS text, d.filename AS filename, c.tokenCount AS token_count
+        """,
+        ids=[row["chunk_id"] for row in rows]
+    )
+    found = {record["id"]: record for record in results}
+
+    hydrated = []
+    for row in rows:
+        record = found.get(row["chunk_id"])
+        if record is None:
+            continue
+        row["chunk_text"], row["filename"] = record["text"], record["filename"]
+        # Stored at ingest; chunks from before tokenCount existed are counted on demand
+        if record["token_count"] is not None:
+            row["token_count"] = record["token_count"]
+        hydrated.append(row)
+    return hydrated
+
+
+def full_scan_search(
+    session,
+    question_embedding: List[float],
+    chat_ids: List[str],
+    top_k: int,
+    file_ids: Optional[List[str]] = None,
+    scope_where_clause: str = "",
+    question: Optional[str] = None,
+    boost_style: str = BOOST_WEIGHTED
+) -> List[Dict[str, Any]]:
+    """
+    Exact retrieval: score every eligible chunk of the chats.
+
+    Embeddings come from the per-chat matrix cache, so a hot chat is scored
+    without fetching any embeddings over Bolt; scoring, filename boost and
+    top-k selection run through score_top_k. Chats large enough to have an
+    HNSW index (see sync_chat_ann_index) are searched through it instead of
+    loading their matrix. No text is read here; see hydrate_chunks.
+
+    Returns:
+        Up to top_k scored chunks (without text) sorted by score (cosine + filename boost)
+    """
+    allowed_ids = None
+    if scope_where_clause:
+        allowed_ids = _fetch_scoped_chunk_ids(session, chat_ids, scope_where_clause)
+
+    scored = []
+    for chat_id in chat_ids:
+        ann = _usable_ann_index(session, chat_id)
+        if ann is not None:
+            rows, scores = _ann_search(ann, question_embedding, top_k, file_ids, allowed_ids, question, boost_style)
+            scored.extend((float(score), ann, int(row)) for row, score in zip(rows, scores))
+            continue
+
+        entry = get_chat_matrix(session, chat_id)
+        if entry.size == 0:
+            continue
+
+        mask = None
+        if file_ids is not None:
+            mask = np.isin(entry.doc_ids, file_ids)
+        if allowed_ids is not None:
+            scope_mask = np.isin(entry.chunk_ids, allowed_ids)
+            mask = scope_mask if mask is None else mask & scope_mask
+
+        boost = filename_boost_vector(question, entry.unique_filenames, entry.filename_codes, boost_style)
+        question_vector = question_embedding[:entry.matrix.shape[1]]
+        rows, scores = score_top_k(question_vector, entry.matrix, top_k,
+                                   norms=dimension_norms(question_vector, entry.row_dims), boost=boost, mask=mask)
+        scored.extend((float(score), entry, int(row)) for row, score in zip(rows, scores))
+
+    # Merge the per-chat winners (subchat + parent chat)
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return [
+        {
+            "chunk_id": entry.chunk_ids[row],
+            "filename": entry.filenames[row],
+            "source_chat": entry.chat_id,
+            "doc_id": entry.doc_ids[row],
+            "score": score,
+        }
+        for score, entry, row in scored[:top_k]
+    ]
+
+
+def batch_full_scan_search(
+    session,
+    question_embeddings: List[List[float]],
+    questions: List[Optional[str]],
+    chat_ids: List[str],
+    top_k: int,
+    file_ids: Optional[List[str]] = None,
+    boost_style: str = BOOST_WEIGHTED
+) -> List[List[Dict[str, Any]]]:
+    """
+    full_scan_search for many questions at once.
+
+    Each chat's matrix is loaded once and every question is scored with one
+    (questions x chunks) matrix product; top-k per question uses argpartition
+    along the rows. Chats mid re-embed (mixed row sizes) and chats served by
+    an HNSW index are scored question by question.
+
+    Returns:
+        One ranked list (without text) per question, like full_scan_search
+    """
+    n_questions = len(question_embeddings)
+    if n_questions == 0:
+        return []
+    full = np.asarray(question_embeddings, dtype=np.float32)
+    scored: List[List[tuple]] = [[] for _ in range(n_questions)]
+
+    for chat_id in chat_ids:
+        ann = _usable_ann_index(session, chat_id)
+        if ann is not None:
+            for i in range(n_questions):
+                rows, scores = _ann_search(ann, full[i], top_k, file_ids, None, questions[i], boost_style)
+                scored[i].extend((float(score), ann, int(row)) for row, score in zip(rows, scores))
+            continue
+
+        entry = get_chat_matrix(session, chat_id)
+        if entry.size == 0:
+            continue
+        mask = np.isin(entry.doc_ids, file_ids) if file_ids is not None else None
+
+        if entry.row_dims is not None:
+            for i in range(n_questions):
+                question_vector = full[i, :entry.matrix.shape[1]]
+                boost = filename_boost_vector(questions[i], entry.unique_filenames, entry.filename_codes, boost_style)
+                rows, scores = score_top_k(question_vector, entry.matrix, top_k,
+                                           norms=dimension_norms(question_vector, entry.row_dims), boost=boost, mask=mask)
+                scored[i].extend((float(score), entry, int(row)) for row, score in zip(rows, scores))
+            continue
+
+        q = full[:, :entry.matrix.shape[1]]
+        q_norms = np.linalg.norm(q, axis=1, keepdims=True)
+        q = q / np.where(q_norms == 0, 1.0, q_norms)
+        scores = q @ entry.matrix.T
+        for i in range(n_questions):
+            boost = filename_boost_vector(questions[i], entry.unique_filenames, entry.filename_codes, boost_style)
+            if boost is not None:
+                scores[i] += boost
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+        k = min(top_k, entry.size if mask is None else int(mask.sum()))
+        if k <= 0:
+            continue
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < entry.size else np.tile(np.arange(entry.size), (n_questions, 1))
+        for i in range(n_questions):
+            scored[i].extend((float(scores[i, row]), entry, int(row)) for row in top[i])
+
+    results = []
+    for per_question in scored:
+        per_question.sort(key=lambda x: x[0], reverse=True)
+        results.append([
+            {
+                "chunk_id": entry.chunk_ids[row],
+                "filename": entry.filenames[row],
+                "source_chat": entry.chat_id,
+                "doc_id": entry.doc_ids[row],
+                "score": score,
+            }
+            for score, entry, row in per_question[:top_k]
+        ])
+    return results
+
+
+# ==============================================================================
+# Approximate nearest neighbour indexes for very large chats
+# ==============================================================================
+
+def _usable_ann_index(session, chat_id: str) -> Optional[ChatAnnIndex]:
+    """The chat's HNSW index, unless there is none or the chat is mid re-embed."""
+    ann = ann_index_cache.get(chat_id)
+    if ann is None:
+        return None
+    if chat_embedding_dimensions(session, [chat_id]) != [ann.dimensions]:
+        return None
+    return ann
+
+
+def _ann_search(ann: ChatAnnIndex, question_embedding, top_k: int, file_ids: Optional[List[str]],
+                allowed_ids: Optional[List[str]], question: Optional[str], boost_style: str) -> tuple:
+    def allowed(rows):
+        keep = np.ones(len(rows), dtype=bool)
+        if file_ids is not None:
+            keep &= np.isin(ann.doc_ids[rows], file_ids)
+        if allowed_ids is not None:
+            keep &= np.isin(ann.chunk_ids[rows], allowed_ids)
+        return keep
+
+    def boost(rows):
+        if not question:
+            return None
+        unique_filenames, codes = np.unique(ann.filenames[rows], return_inverse=True)
+        return filename_boost_vector(question, unique_filenames, codes, boost_style)
+
+    filtered = file_ids is not None or allowed_ids is not None
+    return ann.search(question_embedding[:ann.dimensions], top_k, boost=boost,
+                      allowed=allowed if filtered else None)
+
+
+def _ann_lock(chat_id: str):
+    conn = get_shared_redis()
+    if conn is not None:
+        # Workers on different hosts may ingest into the same chat
+        return conn.lock(f"trainly:ann_lock:{chat_id}", timeout=1800, blocking_timeout=1800)
+    return _local_ann_locks[chat_id]
+
+
+_local_ann_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+
+
+def sync_chat_ann_index(session, chat_id: str, doc_id: Optional[str] = None, rebuild: bool = False) -> Optional[str]:
+    """
+    Keep a chat's HNSW index in step with its chunks; called after ingestion and deletes.
+
+    Appends the chunks of doc_id to an existing index, or (re)builds the
+    index from all of the chat's chunks when the chat has reached
+    ANN_INDEX_MIN_CHUNKS, when rebuild is set (after a re-embed), or when
+    deleted chunks make up more than ANN_INDEX_MAX_STALE_FRACTION of it.
+    The index is dropped once the chat shrinks below half the threshold.
+
+    Returns:
+        "appended", "built", "removed" or None when the chat has no index
+    """
+    if not ANN_INDEX_ENABLED:
+        return None
+
+    with _ann_lock(chat_id):
+        dimensions = chat_embedding_dimensions(session, [chat_id])
+        if not dimensions and has_ann_index(chat_id):
+            # Every chunk is gone
+            delete_chat_ann_index(chat_id)
+            return "removed"
+        if len(dimensions) != 1:
+            # Mid re-embed; the re-embed job rebuilds the index when it finishes
+            return None
+        record = session.run(
+            "MATCH (c:Chunk) WHERE c.chatId = $chat_id RETURN count(c) AS total", chat_id=chat_id
+        ).single()
+        live_chunks = record["total"] if record else 0
+        indexed = has_ann_index(chat_id)
+
+        if live_chunks < ANN_INDEX_MIN_CHUNKS // 2:
+            if indexed:
+                delete_chat_ann_index(chat_id)
+                return "removed"
+            return None
+        if not indexed and live_chunks < ANN_INDEX_MIN_CHUNKS:
+            return None
+
+        started = time.time()
+        if indexed and doc_id and not rebuild:
+            existing = ChatAnnIndex.load(chat_id, view=False)
+            if (existing is not None and existing.dimensions == dimensions[0]
+                    and existing.size <= live_chunks * (1 + ANN_INDEX_MAX_STALE_FRACTION)):
+                new_rows = load_chat_matrix(session, chat_id, get_chat_version(chat_id), doc_id=doc_id)
+                existing.add(new_rows.matrix, new_rows.chunk_ids, new_rows.doc_ids, new_rows.filenames)
+                existing.save()
+                logger.info(f"🗺️ Appended {new_rows.size} chunks to ANN index for {chat_id} ({existing.size} total)")
+                return "appended"
+
+        entry = load_chat_matrix(session, chat_id, get_chat_version(chat_id))
+        ann = ChatAnnIndex.create(chat_id, entry.matrix.shape[1])
+        ann.add(entry.matrix, entry.chunk_ids, entry.doc_ids, entry.filenames)
+        ann.save()
+        logger.info(f"🗺️ Built ANN index for {chat_id}: {ann.size} chunks in {time.time() - started:.1f}s")
+        return "built"
+
+
+def chat_chunks_deleted(session, chat_id: str):
+    """
+    Invalidate a chat's cached content after some of its chunks were deleted.
+
+    Bumps the chat version and rebuilds (or drops) its HNSW index, so deleted
+    chunks stop taking top-k slots in the ANN search.
+    """
+    bump_chat_version(chat_id)
+    try:
+        sync_chat_ann_index(session, chat_id, rebuild=True)
+    except Exception as e:
+        logger.warning(f"⚠️ ANN index update failed for chat {chat_id}: {e}")
+
+
+def chat_deleted(chat_id: str):
+    """Invalidate a deleted chat's cached content and remove its HNSW index files."""
+    bump_chat_version(chat_id)
+    delete_chat_ann_index(chat_id)
+
+
+# ==============================================================================
+# Hybrid lexical + vector retrieval
+# ==============================================================================
+
+_LUCENE_SPECIAL = re.compile(r'([+\-&|!(){}\[\]^"~*?:\\/])')
+# Tokens that look like codes, names or ids: digits, inner separators, or all caps
+_IDENTIFIER_TOKEN = re.compile(r"^(?=.*\d)[\w.\-/#]+$|^\w+[_\-./#]\w[\w.\-/#]*$|^[A-Z]{2,}\d*$")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it me my of on or "
+    "the this that to was what when where which who why with you your about tell".split()
+)
+
+_lexical_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="lexical-search")
+_embedding_provider: Optional[Callable[[str], List[float]]] = None
+
+
+def set_embedding_provider(provider: Callable[[str], List[float]]):
+    """Register the function used to embed a question lazily (keyword-only fallback)."""
+    global _embedding_provider
+    _embedding_provider = provider
+
+
+def _question_tokens(question: str) -> List[str]:
+    return re.findall(r'"[^"]+"|\S+', question or "")
+
+
+def is_keyword_query(question: str) -> bool:
+    """
+    True for exact-term lookups (quoted phrases, codes, names, ids) that the
+    full-text index can answer without embedding the question.
+    """
+    if not HYBRID_RETRIEVAL or not question:
+        return False
+    stripped = question.strip()
+    if len(stripped) > 2 and stripped.startswith('"') and stripped.endswith('"') and stripped.count('"') == 2:
+        return True
+    tokens = [token.strip(".,;:!?()[]{}'") for token in _question_tokens(stripped)]
+    tokens = [token for token in tokens if token]
+    return 0 < len(tokens) <= 3 and all(_IDENTIFIER_TOKEN.match(token) for token in tokens)
+
+
+def build_fulltext_query(question: str) -> Optional[str]:
+    """
+    Lucene query for a natural-language question.
+
+    Terms are lowercased (so AND/OR/NOT are not operators), escaped and OR-ed;
+    quoted phrases and identifier-like tokens are searched as boosted phrases so
+    "INV-2041" matches the exact token sequence.
+    """
+    parts = []
+    for token in _question_tokens(question):
+        if token.startswith('"') and token.endswith('"') and len(token) > 2:
+            phrase = _LUCENE_SPECIAL.sub(r"\\\1", token[1:-1].lower())
+            parts.append(f'"{phrase}"^2')
+            continue
+        word = token.strip(".,;:!?()[]{}'\"")
+        if len(word) < 2 or word.lower() in _STOPWORDS:
+            continue
+        escaped = _LUCENE_SPECIAL.sub(r"\\\1", word.lower())
+        parts.append(f'"{escaped}"^2' if _IDENTIFIER_TOKEN.match(word) else escaped)
+    return " OR ".join(parts) if parts else None
+
+
+def fulltext_chunk_search(
+    session,
+    fulltext_query: str,
+    chat_ids: List[str],
+    top_k: int,
+    file_ids: Optional[List[str]] = None,
+    scope_where_clause: str = ""
+) -> List[Dict[str, Any]]:
+    """
+    Top-k chunks (without text) by full-text (BM25) score, with the same filters as vector_index_search.
+
+    The index spans every chat, so Lucene is capped at top_k * FULLTEXT_INDEX_OVERFETCH
+    best hits before the chat filter; the cost follows that cap, not the database size.
+    """
+    query = f"""
+    CALL db.index.fulltext.queryNodes($index_name, $query, {{limit: $candidates}})
+    YIELD node AS c, score
+    WHERE c.chatId IN $chat_ids{scope_where_clause}
+    MATCH (d:Document)-[:HAS_CHUNK]->(c)
+    WHERE $file_ids IS NULL OR d.id IN $file_ids
+    RETURN c.id AS id, d.filename AS filename, c.chatId AS source_chat, d.id AS doc_id, score
+    ORDER BY score DESC
+    LIMIT $top_k
+    """
+    results = session.run(
+        query,
+        index_name=CHUNK_FULLTEXT_INDEX,
+        query=fulltext_query,
+        chat_ids=chat_ids,
+        file_ids=file_ids,
+        top_k=top_k,
+        candidates=max(top_k * FULLTEXT_INDEX_OVERFETCH, top_k),
+        **scope_params(scope_where_clause)
+    )
+    return [
+        {
+            "chunk_id": record["id"],
+            "filename": record["filename"],
+            "source_chat": record["source_chat"],
+            "doc_id": record["doc_id"],
+            "lexical_score": record["score"],
+        }
+        for record in results
+    ]
+
+
+def fulltext_filename_search(session, fulltext_query: str, chat_ids: List[str],
+                             file_ids: Optional[List[str]] = None) -> Dict[str, int]:
+    """Documents whose filename matches the question, as {doc_id: rank}."""
+    query = """
+    CALL db.index.fulltext.queryNodes($index_name, $query, {limit: $candidates})
+    YIELD node AS d, score
+    WHERE d.chatId IN $chat_ids AND ($file_ids IS NULL OR d.id IN $file_ids)
+    RETURN d.id AS doc_id
+    ORDER BY score DESC
+    LIMIT $limit
+    """
+    results = session.run(
+        query,
+        index_name=DOCUMENT_FULLTEXT_INDEX,
+        query=fulltext_query,
+        chat_ids=chat_ids,
+        file_ids=file_ids,
+        limit=FILENAME_MATCH_LIMIT,
+        candidates=FILENAME_MATCH_LIMIT * FULLTEXT_INDEX_OVERFETCH
+    )
+    return {record["doc_id"]: rank for rank, record in enumerate(results)}
+
+
+def _lexical_search(session, fulltext_query, chat_ids, top_k, file_ids, scope_where_clause) -> tuple:
+    try:
+        chunks = fulltext_chunk_search(session, fulltext_query, chat_ids, top_k, file_ids, scope_where_clause)
+        doc_ranks = fulltext_filename_search(session, fulltext_query, chat_ids, file_ids)
+        return chunks, doc_ranks
+    except Exception as e:
+        logger.warning(f"⚠️ Full-text query failed, using vector-only retrieval: {e}")
+        return [], {}
+
+
+def _lexical_search_in_new_session(driver, *args) -> tuple:
+    with driver.session() as session:
+        return _lexical_search(session, *args)
+
+
+def _similarity_for_chunks(session, chunk_ids: List[str], question_embedding: List[float]) -> Dict[str, float]:
+    """Cosine similarity of a few chunks that only the lexical leg returned."""
+    if not chunk_ids:
+        return {}
+    results = session.run(
+        """
+        MATCH (c:Chunk)
+        WHERE c.id IN $ids AND (c.embedding IS NOT NULL OR c.embeddingBlob IS NOT NULL)
+        RETURN c.id AS id, CASE WHEN c.embeddingBlob IS NULL THEN c.embedding END AS embedding,
+               c.embeddingBlob AS blob, c.embeddingEncoding AS encoding
+        """,
+        ids=list(chunk_ids)
+    )
+    records = list(results)
+    if not records:
+        return {}
+    matrix, row_dims = _records_to_matrix(records)
+    question_vector = question_embedding[:matrix.shape[1]]
+    norms = np.linalg.norm(matrix, axis=1)
+    norms = np.where(norms == 0, 1.0, norms)
+    if row_dims is not None:
+        norms *= dimension_norms(question_vector, row_dims)
+    rows, scores = score_top_k(question_vector, matrix, len(records), norms=norms)
+    return {records[int(row)]["id"]: float(score) for row, score in zip(rows, scores)}
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = HYBRID_RRF_K) -> Dict[str, float]:
+    """Sum of 1 / (k + rank) over every ranking an id appears in (rank is 1-based)."""
+    fused: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            fused[item_id] += 1.0 / (k + rank)
+    return fused
+
+
+def hybrid_search(
+    session,
+    question: str,
+    question_embedding: Optional[List[float]],
+    chat_ids: List[str],
+    top_k: int,
+    file_ids: Optional[List[str]] = None,
+    scope_where_clause: str = "",
+    mode: Optional[str] = None,
+    boost_style: str = BOOST_WEIGHTED,
+    driver=None
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Fuse vector, chunk full-text and filename full-text rankings with RRF.
+
+    The lexical queries run on their own session in a worker thread while the
+    vector search runs (when a driver is given). Without a question embedding
+    (keyword-only questions) only the lexical rankings are used.
+
+    RRF decides which chunks make the top_k; those are then sorted by the
+    "score" they report (cosine + filename boost), so every consumer that
+    cuts on score (context assembly, MMR, tier merging) sees a descending
+    list. fused_score is kept on each row for diagnostics.
+
+    Returns:
+        Up to top_k chunks sorted by score, or None when the full-text
+        indexes are unavailable or a keyword-only query found nothing
+    """
+    fulltext_query = build_fulltext_query(question)
+    if not fulltext_query or not ensure_fulltext_indexes(session):
+        return None
+
+    lexical_args = (fulltext_query, chat_ids, top_k, file_ids, scope_where_clause)
+    dense = []
+    if question_embedding is None:
+        lexical, doc_ranks = _lexical_search(session, *lexical_args)
+        if not lexical:
+            return None
+    elif driver is not None:
+        future = _lexical_executor.submit(_lexical_search_in_new_session, driver, *lexical_args)
+        dense = _dense_search(session, question_embedding, chat_ids, top_k, file_ids, scope_where_clause, mode)
+        lexical, doc_ranks = future.result()
+    else:
+        dense = _dense_search(session, question_embedding, chat_ids, top_k, file_ids, scope_where_clause, mode)
+        lexical, doc_ranks = _lexical_search(session, *lexical_args)
+
+    rows: Dict[str, Dict[str, Any]] = {}
+    for row in dense:
+        rows[row["chunk_id"]] = row
+    for row in lexical:
+        rows.setdefault(row["chunk_id"], row)["lexical_score"] = row["lexical_score"]
+
+    # Filename matches rank the candidates from matching documents (by document rank)
+    filename_ranking = sorted(
+        (chunk_id for chunk_id, row in rows.items() if row["doc_id"] in doc_ranks),
+        key=lambda chunk_id: doc_ranks[rows[chunk_id]["doc_id"]]
+    )
+    fused = reciprocal_rank_fusion([
+        [row["chunk_id"] for row in dense],
+        [row["chunk_id"] for row in lexical],
+        filename_ranking,
+    ])
+
+    ranked = sorted(rows.values(), key=lambda row: fused[row["chunk_id"]], reverse=True)[:top_k]
+
+    if question_embedding is not None:
+        # Keep "score" comparable with vector-only retrieval: cosine + filename boost
+        missing = [row["chunk_id"] for row in ranked if "score" not in row]
+        similarities = _similarity_for_chunks(session, missing, question_embedding)
+        boosts = {}
+        for row in ranked:
+            if "score" not in row:
+                row["score"] = similarities.get(row["chunk_id"], 0.0)
+            name = row["filename"] or ""
+            if name not in boosts:
+                boosts[name] = filename_boost(question, name, boost_style)
+            row["score"] += boosts[name]
+        ranked.sort(key=lambda row: row["score"], reverse=True)
+    else:
+        # No embedding to compare against: report the fused score scaled so that
+        # ranking first in both lexical lists scores 1.0
+        best_possible = 2.0 / (HYBRID_RRF_K + 1)
+        for row in ranked:
+            row["score"] = min(fused[row["chunk_id"]] / best_possible, 1.0)
+
+    for row in ranked:
+        row["fused_score"] = fused[row["chunk_id"]]
+    logger.info(f"🔀 Hybrid retrieval fused {len(dense)} vector + {len(lexical)} full-text hits ({len(doc_ranks)} filename matches)")
+    return ranked
+
+
+def _dense_search(
+    session,
+    question_embedding: List[float],
+    chat_ids: List[str],
+    top_k: int,
+    file_ids: Optional[List[str]] = None,
+    scope_where_clause: str = "",
+    mode: Optional[str] = None,
+    question: Optional[str] = None,
+    boost_style: str = BOOST_WEIGHTED
+) -> List[Dict[str, Any]]:
+    """Vector-only retrieval: the vector index when enabled, otherwise the cached full scan."""
+    mode = (mode or RETRIEVAL_MODE).lower()
+    if mode == "vector_index":
+        rows = vector_index_search(session, question_embedding, chat_ids, top_k, file_ids, scope_where_clause)
+        if rows is not None:
+            if question:
+                boosts = {}
+                for row in rows:
+                    name = row["filename"] or ""
+                    if name not in boosts:
+                        boosts[name] = filename_boost(question, name, boost_style)
+                    row["score"] += boosts[name]
+                rows.sort(key=lambda x: x["score"], reverse=True)
+            logger.info(f"🔍 Vector index returned {len(rows)} chunks for chats {chat_ids}")
+            return rows
+
+    rows = full_scan_search(session, question_embedding, chat_ids, top_k, file_ids, scope_where_clause,
+                            question=question, boost_style=boost_style)
+    logger.info(f"🔍 Full scan returned {len(rows)} chunks for chats {chat_ids}")
+    return rows
+
+
+def search_chunks(
+    session,
+    question_embedding: Optional[List[float]],
+    chat_ids: List[str],
+    top_k: int,
+    file_ids: Optional[List[str]] = None,
+    scope_where_clause: str = "",
+    mode: Optional[str] = None,
+    question: Optional[str] = None,
+    boost_style: str = BOOST_WEIGHTED,
+    driver=None,
+    hydrate: bool = True
+) -> List[Dict[str, Any]]:
+    """
+    Retrieve the chunks most relevant to a question.
+
+    With HYBRID_RETRIEVAL and the question text, vector and full-text rankings
+    are fused (hybrid_search); otherwise the vector index is used when
+    RETRIEVAL_MODE is "vector_index", falling back to the (cached) full scan.
+    When the question text is given, the filename boost of boost_style is added
+    to the scores.
+
+    Args:
+        question_embedding: Question embedding, or None for keyword-only
+            questions (see is_keyword_query); it is computed through the
+            registered embedding provider if the full-text index finds nothing
+        driver: Optional Neo4j driver, lets the full-text leg run concurrently
+            with the vector search on a second session
+        hydrate: Fetch chunk text for the results. Pass False to rank a larger
+            pool, truncate it, and call hydrate_chunks on just the survivors
+
+    Returns:
+        List of dicts with chunk_id, chunk_text (when hydrated), filename,
+        source_chat, doc_id and score, sorted by relevance
+    """
+    chat_ids = [chat_id for chat_id in chat_ids if chat_id]
+    ensure_lookup_indexes(session)
+
+    if HYBRID_RETRIEVAL and question:
+        rows = hybrid_search(session, question, question_embedding, chat_ids, top_k, file_ids,
+                             scope_where_clause, mode, boost_style, driver)
+        if rows is not None:
+            return hydrate_chunks(session, rows) if hydrate else rows
+
+    if question_embedding is None:
+        if _embedding_provider is None or not question:
+            return []
+        question_embedding = _embedding_provider(question)
+
+    rows = _dense_search(session, question_embedding, chat_ids, top_k, file_ids, scope_where_clause,
+                         mode, question, boost_style)
+    return hydrate_chunks(session, rows) if hydrate else rows
+
+
+# Parent-chat results shared by all subchats of an app (same question, same corpus)
+SHARED_TIER_CACHE_SIZE = int(os.getenv("SHARED_TIER_CACHE_SIZE", "4096"))
+SHARED_TIER_CACHE_TTL = int(os.getenv("SHARED_TIER_CACHE_TTL", "600"))
+
+
+class SharedTierCache:
+    """
+    Ranked (unhydrated) parent-chat results keyed by question and filters.
+
+    An app's parent chat is the same corpus for every end user, so a question
+    asked by many users is ranked against it once. Keys include the parent
+    chat's content version, so re-ingesting the parent invalidates them.
+    """
+
+    def __init__(self, max_entries: int, ttl: int):
+        self._entries = TTLCache(maxsize=max_entries, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(chat_id: str, version: int, question: Optional[str], question_embedding: Optional[List[float]],
+                 top_k: int, file_ids: Optional[List[str]], scope_where_clause: str, boost_style: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(normalize_embedding_text(question or "").encode("utf-8"))
+        if question_embedding is not None:
+            digest.update(np.asarray(question_embedding, dtype=np.float32).tobytes())
+        digest.update(repr((top_k, sorted(file_ids) if file_ids is not None else None, str(scope_where_clause),
+                            sorted(scope_params(scope_where_clause).items()), boost_style)).encode("utf-8"))
+        return f"{chat_id}:{version}:{digest.hexdigest()}"
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            rows = self._entries.get(key)
+            if rows is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # Callers hydrate rows in place; keep the cached copies text-free
+        return [dict(row) for row in rows]
+
+    def put(self, key: str, rows: List[Dict[str, Any]]):
+        with self._lock:
+            self._entries[key] = [dict(row) for row in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+shared_tier_cache = SharedTierCache(SHARED_TIER_CACHE_SIZE, SHARED_TIER_CACHE_TTL)
+
+
+def search_shared_tier(
+    session,
+    question_embedding: Optional[List[float]],
+    chat_id: str,
+    top_k: int,
+    file_ids: Optional[List[str]] = None,
+    scope_where_clause: str = "",
+    question: Optional[str] = None,
+    boost_style: str = BOOST_WEIGHTED,
+    driver=None
+) -> List[Dict[str, Any]]:
+    """
+    search_chunks over one shared (parent) chat, served from shared_tier_cache when possible.
+
+    Returns:
+        Up to top_k ranked chunks without text
+    """
+    key = shared_tier_cache.make_key(chat_id, get_chat_version(chat_id), question, question_embedding,
+                                     top_k, file_ids, scope_where_clause, boost_style)
+    rows = shared_tier_cache.get(key)
+    if rows is not None:
+        return rows
+    rows = search_chunks(session, question_embedding, [chat_id], top_k, file_ids=file_ids,
+                         scope_where_clause=scope_where_clause, question=question,
+                         boost_style=boost_style, driver=driver, hydrate=False)
+    shared_tier_cache.put(key, rows)
+    return rows
+
+
+def merge_ranked(tiers: List[List[Dict[str, Any]]], top_k: int) -> List[Dict[str, Any]]:
+    """
+    Merge separately ranked result lists (shared parent tier, private subchat tier).
+
+    Rows are ordered by "score" (cosine + filename boost), which hybrid_search
+    also sorts its results by, so the merged list stays sorted by the field
+    downstream cut-offs read.
+    """
+    rows = {}
+    for tier in tiers:
+        for row in tier:
+            rows.setdefault(row["chunk_id"], row)
+    merged = sorted(rows.values(), key=lambda row: row.get("score", 0.0), reverse=True)
+    return merged[:top_k]
+
+
+def mmr_policy(settings: Optional[dict]) -> Optional[Dict[str, Any]]:
+    """
+    Resolve MMR re-ranking from a chat's effective settings.
+
+    Args:
+        settings: Output of merge_settings_with_overrides
+
+    Returns:
+        {"lambda": float, "candidate_pool": int} when mmrEnabled is set, otherwise None
+    """
+    if not settings or not settings.get("mmrEnabled"):
+        return None
+    mmr_lambda = settings.get("mmrLambda")
+    if mmr_lambda is None:
+        mmr_lambda = MMR_DEFAULT_LAMBDA
+    pool = settings.get("mmrCandidatePool") or RETRIEVAL_CANDIDATE_POOL
+    return {
+        "lambda": min(max(float(mmr_lambda), 0.0), 1.0),
+        "candidate_pool": min(max(int(pool), 1), MMR_MAX_CANDIDATE_POOL),
+    }
+
+
+def fetch_chunk_embeddings(session, chunk_ids: List[str]) -> tuple:
+    """
+    Unit-normalized embeddings of the given chunks in one query.
+
+    Chunks stored at different sizes (mid re-embed) are compared on their
+    common prefix, re-normalized, like shorten_embedding.
+
+    Returns:
+        (chunk_ids found, matrix) with matrix rows in the same order
+    """
+    if not chunk_ids:
+        return [], np.empty((0, EMBEDDING_DIMENSIONS), dtype=np.float32)
+    results = session.run(
+        """
+        MATCH (c:Chunk)
+        WHERE c.id IN $ids AND (c.embedding IS NOT NULL OR c.embeddingBlob IS NOT NULL)
+        RETURN c.id AS id, CASE WHEN c.embeddingBlob IS NULL THEN c.embedding END AS embedding,
+               c.embeddingBlob AS blob, c.embeddingEncoding AS encoding
+        """,
+        ids=list(chunk_ids)
+    )
+    records = list(results)
+    matrix, row_dims = _records_to_matrix(records)
+    if row_dims is not None:
+        matrix = matrix[:, :int(row_dims.min())]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = matrix / np.where(norms == 0, 1.0, norms)
+    return [record["id"] for record in records], matrix
+
+
+def mmr_select(relevance: np.ndarray, matrix: np.ndarray, k: int, mmr_lambda: float) -> List[int]:
+    """
+    Greedy maximal-marginal-relevance selection.
+
+    Each step picks argmax(λ·relevance − (1−λ)·max similarity to the picks so
+    far). The pairwise similarities come from one matrix product; each step
+    only updates a running max vector.
+
+    Args:
+        relevance: Candidate relevance scores (n,)
+        matrix: Unit-normalized candidate embeddings (n, d)
+        k: Number of candidates to select
+        mmr_lambda: 1.0 = pure relevance, 0.0 = pure diversity
+
+    Returns:
+        Selected candidate indices in selection order
+    """
+    n = len(relevance)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    similarity = matrix @ matrix.T
+    max_similarity = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    selected = []
+    for step in range(k):
+        # Nothing selected yet: the redundancy term is zero
+        redundancy = max_similarity if step else np.zeros(n, dtype=np.float32)
+        marginal = mmr_lambda * relevance - (1.0 - mmr_lambda) * redundancy
+        marginal = np.where(available, marginal, -np.inf)
+        best = int(np.argmax(marginal))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return selected
+
+
+def mmr_rerank(session, rows: List[Dict[str, Any]], top_k: int, mmr_lambda: float) -> List[Dict[str, Any]]:
+    """
+    Re-rank a candidate pool (ranked rows, without text) for diversity and keep top_k.
+
+    Candidates whose embedding cannot be read keep their relevance order
+    after the MMR picks.
+    """
+    if len(rows) <= 1:
+        return rows[:top_k]
+    found_ids, matrix = fetch_chunk_embeddings(session, [row["chunk_id"] for row in rows])
+    if not found_ids:
+        return rows[:top_k]
+    by_id = {row["chunk_id"]: row for row in rows}
+    candidates = [by_id[chunk_id] for chunk_id in found_ids]
+    relevance = np.array([float(row.get("score", 0.0)) for row in candidates], dtype=np.float32)
+    picked = [candidates[i] for i in mmr_select(relevance, matrix, top_k, mmr_lambda)]
+    if len(picked) < top_k:
+        found = set(found_ids)
+        picked.extend(row for row in rows if row["chunk_id"] not in found)
+    return picked[:top_k]
@@ -0,0 +1,400 @@
+"""
+Shared retrieval component for the question-answering endpoints.
+
+Every answer path (internal chat, published API, privacy API, V1 OAuth) calls
+RetrievalEngine.retrieve, which owns the one hot path:
+
+    resolve parent chat (subchat inheritance) ┐ concurrently
+    embed the question                        ┘
+    build the scope predicate
+    search_chunks (vector / full-text fusion, file filter); for subchats the
+        parent chat is searched as a shared tier (cached per question across
+        all of the app's users) next to the private subchat, and the two
+        ranked lists are merged
+    optional fallback to all files
+    top-k, optionally re-ranked for diversity (MMR over the candidate pool)
+    hydrate (chunk text for the top-k only)
+    optional graph expansion (NEXT / AI-relationship neighbours of the top-k)
+
+retrieve_batch serves many questions for one chat with a single matrix
+product per chat and a single hydration query (batch question endpoint).
+
+It holds a single long-lived Neo4j driver instead of opening one per request,
+runs blocking work in threads so the event loop stays free, and reports each
+stage's duration to registered timing hooks.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from cachetools import TTLCache
+
+from retrieval import (
+    search_chunks, search_shared_tier, merge_ranked, hydrate_chunks, mmr_rerank, batch_full_scan_search,
+    is_keyword_query, BOOST_WEIGHTED, RETRIEVAL_CANDIDATE_POOL
+)
+from graph_expansion import expand_with_neighbours, GRAPH_EXPANSION_ENABLED, GRAPH_EXPANSION_TOKEN_BUDGET
+
+logger = logging.getLogger(__name__)
+
+# Parent chat ids rarely change; cache the Convex lookup per app
+PARENT_CHAT_CACHE_TTL = int(os.getenv("PARENT_CHAT_CACHE_TTL", "300"))
+# Log every retrieval's stage timings at INFO
+RETRIEVAL_TIMING_LOG = os.getenv("RETRIEVAL_TIMING_LOG", "false").lower() == "true"
+
+TimingHook = Callable[[str, float, Dict[str, Any]], None]
+
+
+@dataclass
+class RetrievalResult:
+    """Chunks selected for a question plus how they were found."""
+    chunks: List[Dict[str, Any]]
+    chat_ids: List[str]
+    parent_chat_id: Optional[str] = None
+    used_fallback: bool = False
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+def parse_subchat_app_id(chat_id: str) -> Optional[str]:
+    """
+    App id embedded in a subchat id (subchat_{app_id}_user_..._{timestamp}).
+
+    Returns:
+        The app id, or None for regular chats and malformed subchat ids
+    """
+    if not chat_id or not chat_id.startswith("subchat_"):
+        return None
+    parts = chat_id.split("_")
+    user_index = next((i for i, part in enumerate(parts) if part == "user" and i > 1), -1)
+    if user_index <= 1:
+        return None
+    return "_".join(parts[1:user_index])
+
+
+class RetrievalEngine:
+    """
+    One retrieval implementation shared by all question-answering endpoints.
+
+    Args:
+        driver_factory: Returns a Neo4j driver; called once, the driver is reused
+        embed: Embeds a question (the cached get_embedding)
+        parent_chat_resolver: async app_id -> parent chat id (or None)
+        scope_clause_builder: async (chat_id, scope_filters) -> Cypher predicate
+    """
+
+    def __init__(
+        self,
+        driver_factory: Callable[[], Any],
+        embed: Callable[[str], List[float]],
+        parent_chat_resolver: Callable[[str], Awaitable[Optional[str]]],
+        scope_clause_builder: Callable[[str, Dict[str, Any]], Awaitable[str]]
+    ):
+        self._driver_factory = driver_factory
+        self._driver = None
+        self._embed = embed
+        self._parent_chat_resolver = parent_chat_resolver
+        self._scope_clause_builder = scope_clause_builder
+        self._parent_cache = TTLCache(maxsize=4096, ttl=PARENT_CHAT_CACHE_TTL)
+        self._timing_hooks: List[TimingHook] = []
+
+    @property
+    def driver(self):
+        if self._driver is None:
+            self._driver = self._driver_factory()
+        return self._driver
+
+    def close(self):
+        if self._driver is not None:
+            self._driver.close()
+            self._driver = None
+
+    def add_timing_hook(self, hook: TimingHook):
+        """Register hook(stage, seconds, context), called after every retrieval stage."""
+        self._timing_hooks.append(hook)
+
+    def remove_timing_hook(self, hook: TimingHook):
+        if hook in self._timing_hooks:
+            self._timing_hooks.remove(hook)
+
+    @contextmanager
+    def _stage(self, name: str, timings: Dict[str, float], context: Dict[str, Any]):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            timings[name] = timings.get(name, 0.0) + elapsed
+            for hook in self._timing_hooks:
+                try:
+                    hook(name, elapsed, context)
+                except Exception as e:
+                    logger.warning(f"⚠️ Retrieval timing hook failed: {e}")
+
+    async def resolve_parent_chat_id(self, chat_id: str) -> Optional[str]:
+        """Parent chat a subchat inherits files from (cached per app)."""
+        app_id = parse_subchat_app_id(chat_id)
+        if not app_id:
+            return None
+        if app_id in self._parent_cache:
+            return self._parent_cache[app_id]
+        parent_chat_id = await self._parent_chat_resolver(app_id)
+        self._parent_cache[app_id] = parent_chat_id
+        return parent_chat_id
+
+    def _embed_question(self, question: str) -> Optional[List[float]]:
+        # Exact-term lookups are served by the full-text index alone
+        return None if is_keyword_query(question) else self._embed(question)
+
+    def _search(self, question, question_embedding, chat_ids, file_ids, scope_where_clause,
+                boost_style, candidate_pool) -> List[Dict[str, Any]]:
+        with self.driver.session() as session:
+            return search_chunks(
+                session, question_embedding, chat_ids, candidate_pool,
+                file_ids=file_ids, scope_where_clause=scope_where_clause,
+                question=question, boost_style=boost_style, driver=self.driver, hydrate=False
+            )
+
+    def _search_shared(self, question, question_embedding, chat_id, file_ids, scope_where_clause,
+                       boost_style, candidate_pool) -> List[Dict[str, Any]]:
+        with self.driver.session() as session:
+            return search_shared_tier(
+                session, question_embedding, chat_id, candidate_pool,
+                file_ids=file_ids, scope_where_clause=scope_where_clause,
+                question=question, boost_style=boost_style, driver=self.driver
+            )
+
+    async def _tiered_search(self, question, question_embedding, chat_ids, shared_chat_id, file_ids,
+                             scope_where_clause, boost_style, candidate_pool) -> List[Dict[str, Any]]:
+        """Search the shared parent tier and the private chats concurrently, then merge."""
+        loop = asyncio.get_running_loop()
+        if not shared_chat_id:
+            return await loop.run_in_executor(
+                None, self._search, question, question_embedding, chat_ids, file_ids,
+                scope_where_clause, boost_style, candidate_pool
+            )
+        private_chat_ids = [chat_id for chat_id in chat_ids if chat_id != shared_chat_id]
+        shared, private = await asyncio.gather(
+            loop.run_in_executor(
+                None, self._search_shared, question, question_embedding, shared_chat_id, file_ids,
+                scope_where_clause, boost_style, candidate_pool
+            ),
+            loop.run_in_executor(
+                None, self._search, question, question_embedding, private_chat_ids, file_ids,
+                scope_where_clause, boost_style, candidate_pool
+            )
+        )
+        return merge_ranked([shared, private], candidate_pool)
+
+    def _mmr(self, chunks, top_k, mmr_lambda) -> List[Dict[str, Any]]:
+        with self.driver.session() as session:
+            return mmr_rerank(session, chunks, top_k, mmr_lambda)
+
+    def _hydrate(self, chunks) -> List[Dict[str, Any]]:
+        with self.driver.session() as session:
+            return hydrate_chunks(session, chunks)
+
+    def _expand(self, chunks, chat_ids, file_ids, scope_where_clause, token_budget) -> List[Dict[str, Any]]:
+        with self.driver.session() as session:
+            return expand_with_neighbours(
+                session, chunks, chat_ids, file_ids=file_ids,
+                scope_where_clause=scope_where_clause, token_budget=token_budget
+            )
+
+    async def retrieve(
+        self,
+        question: str,
+        chat_id: str,
+        top_k: int,
+        inherit_parent: bool = True,
+        parent_chat_id: Optional[str] = None,
+        extra_chat_ids: Optional[List[str]] = None,
+        file_ids: Optional[List[str]] = None,
+        fallback_to_all_files: bool = False,
+        scope_filters: Optional[Dict[str, Any]] = None,
+        boost_style: str = BOOST_WEIGHTED,
+        candidate_pool: int = RETRIEVAL_CANDIDATE_POOL,
+        mmr_lambda: Optional[float] = None,
+        expand_graph: Optional[bool] = None,
+        expansion_token_budget: int = GRAPH_EXPANSION_TOKEN_BUDGET
+    ) -> RetrievalResult:
+        """
+        Select the top_k chunks for a question.
+
+        Args:
+            question: Sanitized question text
+            chat_id: Chat (or subchat) being queried
+            top_k: Number of chunks to return
+            inherit_parent: Also search the parent chat of a subchat
+            parent_chat_id: Already-known parent chat (skips the lookup)
+            extra_chat_ids: Additional chats to search (e.g. privacy API app chat)
+            file_ids: Restrict to these Document ids (published context files)
+            fallback_to_all_files: Retry without file_ids when they match nothing
+            scope_filters: Custom scope filters ({"playlist_id": "..."})
+            boost_style: Filename boost style (BOOST_SIMPLE / BOOST_WEIGHTED)
+            candidate_pool: Candidates ranked before truncating to top_k
+            mmr_lambda: Re-rank the candidate pool with MMR (see mmr_policy); None keeps score order
+            expand_graph: Append graph neighbours of the top_k (None = GRAPH_EXPANSION_ENABLED)
+            expansion_token_budget: Token budget for the appended neighbours
+
+        Returns:
+            RetrievalResult with chunks sorted by relevance (expanded neighbours last)
+        """
+        timings: Dict[str, float] = {}
+        context = {"chat_id": chat_id}
+        loop = asyncio.get_running_loop()
+
+        with self._stage("total", timings, context):
+            # The embedding call and the Convex parent lookup are independent network calls
+            embedding_task = loop.run_in_executor(None, self._embed_question, question)
+            if inherit_parent and parent_chat_id is None:
+                with self._stage("resolve_parent", timings, context):
+                    parent_chat_id = await self.resolve_parent_chat_id(chat_id)
+            with self._stage("embed", timings, context):
+                question_embedding = await embedding_task
+
+            scope_where_clause = ""
+            if scope_filters:
+                with self._stage("scope", timings, context):
+                    scope_where_clause = await self._scope_clause_builder(chat_id, scope_filters)
+
+            chat_ids = [chat_id]
+            if inherit_parent and parent_chat_id:
+                chat_ids.append(parent_chat_id)
+                logger.info(f"🔗 Subchat {chat_id} inheriting files from parent chat {parent_chat_id}")
+            for extra_chat_id in extra_chat_ids or []:
+                if extra_chat_id and extra_chat_id not in chat_ids:
+                    chat_ids.append(extra_chat_id)
+
+            # The parent chat is the same corpus for every subchat of an app
+            shared_chat_id = parent_chat_id if inherit_parent and parent_chat_id else None
+
+            with self._stage("search", timings, context):
+                chunks = await self._tiered_search(
+                    question, question_embedding, chat_ids, shared_chat_id, file_ids,
+                    scope_where_clause, boost_style, candidate_pool
+                )
+
+            used_fallback = False
+            if not chunks and file_ids is not None and fallback_to_all_files:
+                logger.warning(f"⚠️ File filter matched no chunks in {chat_ids}, falling back to all files")
+                with self._stage("fallback", timings, context):
+                    chunks = await self._tiered_search(
+                        question, question_embedding, chat_ids, shared_chat_id, None,
+                        scope_where_clause, boost_style, candidate_pool
+                    )
+                used_fallback = True
+
+            if mmr_lambda is not None and len(chunks) > 1:
+                with self._stage("mmr", timings, context):
+                    chunks = await loop.run_in_executor(None, self._mmr, chunks, top_k, mmr_lambda)
+
+            # Candidates were ranked without text; read it for the winners only
+            with self._stage("hydrate", timings, context):
+                chunks = await loop.run_in_executor(None, self._hydrate, chunks[:top_k])
+
+            if expand_graph is None:
+                expand_graph = GRAPH_EXPANSION_ENABLED
+            if expand_graph and chunks:
+                with self._stage("expand", timings, context):
+                    chunks = await loop.run_in_executor(
+                        None, self._expand, chunks, chat_ids,
+                        None if used_fallback else file_ids, scope_where_clause, expansion_token_budget
+                    )
+
+        if RETRIEVAL_TIMING_LOG:
+            logger.info(f"⏱️ Retrieval for {chat_id}: " + ", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in timings.items()))
+
+        return RetrievalResult(
+            chunks=chunks,
+            chat_ids=chat_ids,
+            parent_chat_id=parent_chat_id if inherit_parent else None,
+            used_fallback=used_fallback,
+            timings=timings
+        )
+
+    def _batch_search(self, questions, question_embeddings, chat_ids, top_k, file_ids, boost_style):
+        with self.driver.session() as session:
+            ranked = batch_full_scan_search(
+                session, question_embeddings, questions, chat_ids, top_k,
+                file_ids=file_ids, boost_style=boost_style
+            )
+            # One hydration query for the union of every question's winners
+            unique = {}
+            for rows in ranked:
+                for row in rows:
+                    unique.setdefault(row["chunk_id"], dict(row))
+            hydrated = {row["chunk_id"]: row for row in hydrate_chunks(session, list(unique.values()))}
+        return [
+            [
+                {**row, "chunk_text": hydrated[row["chunk_id"]]["chunk_text"],
+                 "filename": hydrated[row["chunk_id"]]["filename"],
+                 "token_count": hydrated[row["chunk_id"]].get("token_count")}
+                for row in rows if row["chunk_id"] in hydrated
+            ]
+            for rows in ranked
+        ]
+
+    async def retrieve_batch(
+        self,
+        questions: List[str],
+        question_embeddings: List[List[float]],
+        chat_id: str,
+        top_k: int,
+        file_ids: Optional[List[str]] = None,
+        fallback_to_all_files: bool = False,
+        boost_style: str = BOOST_WEIGHTED
+    ) -> List[RetrievalResult]:
+        """
+        Select the top_k chunks for many questions against one chat (and its parent chat).
+
+        Args:
+            questions: Sanitized question texts
+            question_embeddings: Full-size embeddings, one per question
+            chat_id: Chat (or subchat) being queried
+            top_k: Chunks per question
+            file_ids: Restrict to these Document ids (published context files)
+            fallback_to_all_files: Re-run questions the file filter left empty without it
+            boost_style: Filename boost style
+
+        Returns:
+            One RetrievalResult per question, in order
+        """
+        timings: Dict[str, float] = {}
+        context = {"chat_id": chat_id, "batch_size": len(questions)}
+        loop = asyncio.get_running_loop()
+
+        with self._stage("total", timings, context):
+            with self._stage("resolve_parent", timings, context):
+                parent_chat_id = await self.resolve_parent_chat_id(chat_id)
+            chat_ids = [chat_id] + ([parent_chat_id] if parent_chat_id else [])
+            with self._stage("batch_search", timings, context):
+                per_question = await loop.run_in_executor(
+                    None, self._batch_search, questions, question_embeddings, chat_ids, top_k, file_ids, boost_style
+                )
+
+            empty = [i for i, chunks in enumerate(per_question) if not chunks]
+            used_fallback = set()
+            if empty and file_ids is not None and fallback_to_all_files:
+                logger.warning(f"⚠️ File filter matched nothing for {len(empty)} batch questions in {chat_ids}, falling back to all files")
+                with self._stage("fallback", timings, context):
+                    retried = await loop.run_in_executor(
+                        None, self._batch_search, [questions[i] for i in empty],
+                        [question_embeddings[i] for i in empty], chat_ids, top_k, None, boost_style
+                    )
+                for i, chunks in zip(empty, retried):
+                    per_question[i] = chunks
+                    used_fallback.add(i)
+
+        if RETRIEVAL_TIMING_LOG:
+            logger.info(f"⏱️ Batch retrieval for {chat_id} ({len(questions)} questions): " + ", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in timings.items()))
+
+        return [
+            RetrievalResult(chunks=chunks, chat_ids=chat_ids, parent_chat_id=parent_chat_id,
+                            used_fallback=i in used_fallback, timings=timings)
+            for i, chunks in enumerate(per_question)
+        ]